@@ -1,4 +1,6 @@
 import copy
+import hashlib
+import json
 import logging
 from abc import ABC, abstractmethod
 
@@ -55,6 +57,7 @@ class FlowSheet(ABC):
     NODE_IDENTIFIER = 3
 
     OPERATION_TYPES = FLOWEDIT_OPERATION_TYPES
+    EDIT_OP_CLASS = FlowEditOp
 
     def __init__(self, name, rows, config=None):
         """
@@ -66,27 +69,164 @@ class FlowSheet(ABC):
         self._name = name
         self._rows = rows
         self._config = config or {}
+        # Specs of the ops of the rows, see `compile_rows`
+        self._specs = None
+        self._category_names = None
+
+    def name(self):
+        return self._name
+
+    def rows(self):
+        return self._rows
+
+    @classmethod
+    def from_compiled(cls, data):
+        """Create a sheet from the output of `to_compiled`, without rows."""
+
+        sheet = cls(data["name"], None, data["config"])
+        sheet._category_names = data["category_names"]
+        sheet._specs = data["operations"]
+        return sheet
+
+    def to_compiled(self):
+        """Json-serializable representation of the compiled sheet,
+        see `compile_rows`."""
+
+        specs = self.compile_rows()
+        return {
+            "sheet_type": type(self).__name__,
+            "name": self._name,
+            "config": self._config,
+            "category_names": self._category_names,
+            "operations": specs,
+        }
+
+    def compile_rows(self, cached_specs=None):
+        """Parse the rows into specs of the ops.
+
+        The specs are json-serializable dicts with the arguments of
+        `GenericEditOp.create_parsed_edit_op` and the categories of the op.
+        They do not depend on the flows the sheet is applied to, so the rows
+        are only parsed once, even if the sheet is applied to several files.
+        Invalid rows are omitted.
+
+        Each spec has a "row_hash" of the content of its row and the header,
+        which is independent of the position of the row in the sheet.
 
-    def parse_rows(self, uuid_lookup):
-        self._edit_ops = []
-        self._uuid_lookup = uuid_lookup
+        Args:
+            cached_specs (dict): specs of an earlier version of the sheet by
+                row hash. Rows with one of these hashes are not parsed again.
+
+        Returns:
+            list of dict: the op specs.
+        """
+
+        if self._specs is not None:
+            return self._specs
+        self._specs = []
 
-        if self._rows[0][: len(self.FIXED_COLS)] != self.FIXED_COLS:
+        if not self._rows or self._rows[0][: len(self.FIXED_COLS)] != self.FIXED_COLS:
             logger.warning("ABTest {} has invalid header.".format(self._name))
-            return
+            return self._specs
 
         self._category_names = self._get_category_names(self._rows[0])
         if self._category_names is None:
             logger.warning("Omitting {} {}.".format(type(self), self._name))
+            return self._specs
+
+        for i, row in enumerate(self._rows[1:]):
+            row_hash = hash_row(type(self).__name__, self._rows[0], row)
+            if cached_specs is not None and row_hash in cached_specs:
+                # Only the position of the row may have changed
+                spec = dict(cached_specs[row_hash], debug_string=self._debug_string(i))
+            else:
+                spec = self._row_to_spec(row, i)
+            if spec is not None:
+                spec["row_hash"] = row_hash
+                self._specs.append(spec)
+        return self._specs
+
+    def _debug_string(self, index):
+        return "{} {} row {}: ".format(type(self).__name__, self._name, index + 2)
+
+    def parse_rows(self, uuid_lookup):
+        self._edit_ops = []
+        self._uuid_lookup = uuid_lookup
+
+        specs = self.compile_rows()
+        if self._category_names is None:
             return
 
-        self._generate_group_pair()
+        self._generate_groups()
 
-        for i, row in enumerate(self._rows[1:]):
-            edit_op = self._row_to_edit_op(row, i)
+        for spec in specs:
+            edit_op = self._spec_to_edit_op(spec)
             if edit_op is not None:
                 self._edit_ops.append(edit_op)
 
+    def _create_spec(
+        self,
+        row,
+        debug_string,
+        bit_of_text,
+        split_by,
+        default_text,
+        has_node_for_other_category=True,
+        assign_to_group=False,
+    ):
+        """Spec of the op of a row (see `compile_rows`) without categories.
+
+        Returns None if the node identifier is invalid.
+        """
+
+        op_type = self.OPERATION_TYPES[row[self.TYPE]]
+        node_identifier = op_type.parse_node_identifier(row[self.NODE_IDENTIFIER])
+        if node_identifier is None:
+            logger.warning(debug_string + "invalid node identifier.")
+            return None
+        return {
+            "op_type": row[self.TYPE],
+            "flow_id": row[self.FLOW_ID],
+            "row_id": row[self.ROW_ID],
+            "node_identifier": node_identifier,
+            "bit_of_text": bit_of_text,
+            "split_by": split_by,
+            "default_text": default_text,
+            "debug_string": debug_string,
+            "has_node_for_other_category": has_node_for_other_category,
+            "assign_to_group": assign_to_group,
+            "categories": [],
+        }
+
+    def _spec_to_edit_op(self, spec):
+        edit_op = self.EDIT_OP_CLASS.create_parsed_edit_op(
+            spec["op_type"],
+            spec["flow_id"],
+            spec["row_id"],
+            spec["node_identifier"],
+            spec["bit_of_text"],
+            spec["split_by"],
+            spec["default_text"],
+            spec["debug_string"],
+            spec["has_node_for_other_category"],
+            spec["assign_to_group"],
+            self._uuid_lookup,
+            self._config,
+        )
+        if edit_op is None:
+            return None
+        for category in spec["categories"]:
+            edit_op.add_category(self._spec_to_category(category), self._uuid_lookup)
+        return edit_op
+
+    def _spec_to_category(self, category):
+        return SwitchCategory(
+            category["name"],
+            category["condition_type"],
+            list(category["condition_arguments"]),
+            category["replacement_text"],
+        )
+
     def _get_operation_type(self, row, debug_string):
         if len(row) == 0:
             logger.warning(debug_string + "empty row.")
@@ -105,7 +245,7 @@ class FlowSheet(ABC):
         except ValueError:
             row[self.ROW_ID] = -1
 
-    def _generate_group_pair(self):
+    def _generate_groups(self):
         pass
 
     def get_groups(self):
@@ -175,10 +315,8 @@ class FlowEditSheet(FlowSheet):
 
         return category_names
 
-    def _row_to_edit_op(self, row, index):
-        debug_string = "{} {} row {}: ".format(
-            type(self).__name__, self._name, index + 2
-        )
+    def _row_to_spec(self, row, index):
+        debug_string = self._debug_string(index)
         op_type = self._get_operation_type(row, debug_string)
         if op_type is None:
             return None
@@ -190,43 +328,54 @@ class FlowEditSheet(FlowSheet):
 
         self._convert_row_id_to_int(row_new)
 
-        # Unpack the row entries to create edit op
-        edit_op = FlowEditOp.create_edit_op(
-            *row_new[: self.CATEGORIES],
+        spec = self._create_spec(
+            row_new,
             debug_string,
-            uuid_lookup=self._uuid_lookup,
-            config=self._config,
+            row_new[self.BIT_OF_TEXT],
+            row_new[self.SPLIT_BY],
+            row_new[self.DEFAULT_TEXT],
         )
+        if spec is None:
+            return None
 
         for i, name in enumerate(self._category_names):
-            condition_type = row[
+            condition_type = row_new[
                 len(self.FIXED_COLS) + len(self.CATEGORY_PREFIXES) * i + 2
             ]
             condition_arguments = [
-                row[len(self.FIXED_COLS) + len(self.CATEGORY_PREFIXES) * i + 1]
+                row_new[len(self.FIXED_COLS) + len(self.CATEGORY_PREFIXES) * i + 1]
             ]
             if condition_arguments == [""] and condition_type in NO_ARG_CONDITION_TYPES:
                 # For some condition_types "" is a valid and sensible argument, while
                 # for others, in particular those that work without arguments, the
                 # intent is likely to have no argument.
                 condition_arguments = []
-            replacement_text = row[
+            replacement_text = row_new[
                 len(self.FIXED_COLS) + len(self.CATEGORY_PREFIXES) * i
             ]
-            category = SwitchCategory(
-                name, condition_type, condition_arguments, replacement_text
+            spec["categories"].append(
+                {
+                    "name": name,
+                    "condition_type": condition_type,
+                    "condition_arguments": condition_arguments,
+                    "replacement_text": replacement_text,
+                }
             )
-            edit_op.add_category(category, self._uuid_lookup)
-        return edit_op
+        return spec
 
 
 class ABTest(FlowSheet):
     """
     An A/B test to be applied to RapidPro flow(s).
 
-    It has a name, a group pair representing the ContactGroups
-    for the A side and B side of the test, and a list of
-    `ABTestOps` to be applied to the flow(s).
+    It has a name, a list of ContactGroups, one for each arm of the test,
+    and a list of `ABTestOps` to be applied to the flow(s).
+
+    The first arm (A side) is the default, whose content is in the "change"
+    column. Each further arm (B side, ...) has a "change:<name>" column.
+    The relative probabilities of contacts being assigned to each arm can be
+    given as a list of positive integers via the "group_weights" key
+    of the config.
     """
 
     FIXED_COLS = [
@@ -244,46 +393,56 @@ class ABTest(FlowSheet):
     A_CONTENT = 4
     B_CONTENT = 5
     CATEGORIES = 5
-    ASSIGN_TO_GROUP = 6
 
-    def _generate_group_pair(self):
-        groupA_name = "ABTest_" + self._name + "_" + self.DEFAULT_CATEGORY_NAME
-        groupB_name = "ABTest_" + self._name + "_" + self._category_names[0]
-        groupA_uuid = self._uuid_lookup.lookup_group(groupA_name)
-        groupB_uuid = self._uuid_lookup.lookup_group(groupB_name)
-        groupA = ContactGroup(groupA_name, groupA_uuid)
-        groupB = ContactGroup(groupB_name, groupB_uuid)
-        self._group_pair = (groupA, groupB)
+    def _group_names(self):
+        return [
+            "ABTest_" + self._name + "_" + category_name
+            for category_name in [self.DEFAULT_CATEGORY_NAME] + self._category_names
+        ]
+
+    def _generate_groups(self):
+        self._groups = []
+        for group_name in self._group_names():
+            group_uuid = self._uuid_lookup.lookup_group(group_name)
+            self._groups.append(ContactGroup(group_name, group_uuid))
 
     def _get_category_names(self, row):
-        # Lazy implementation. Only 2 groups supported right now.
-        if not row[self.CATEGORIES].startswith(self.CATEGORY_PREFIXES[0]):
+        prefix = self.CATEGORY_PREFIXES[0]
+        if len(row) <= self.CATEGORIES or not row[self.CATEGORIES].startswith(prefix):
             logger.warning("ABTest {} has invalid group B header.".format(self._name))
             return None
-        return [row[self.CATEGORIES].split(":")[1]]
+        category_names = []
+        for col in row[self.CATEGORIES :]:
+            if not col.startswith(prefix):
+                break
+            category_names.append(col[len(prefix) :])
+        return category_names
+
+    def _assign_to_group_column(self):
+        return self.CATEGORIES + len(self._category_names)
 
-    def _row_to_edit_op(self, row, index):
-        """Convert the spreadsheet row into an ABTestOp.
+    def _row_to_spec(self, row, index):
+        """Convert the spreadsheet row into the spec of an ABTestOp.
 
         Tries to fix minor mistakes in the process.
         Returns None if the row is invalid.
         """
 
-        debug_string = "{} {} row {}: ".format(
-            type(self).__name__, self._name, index + 2
-        )
+        debug_string = self._debug_string(index)
         op_type = self._get_operation_type(row, debug_string)
         if op_type is None:
             return None
 
-        n_required_cols = 6
+        # The content of each arm is required
+        n_required_cols = self.CATEGORIES + len(self._category_names)
         if not op_type.needs_parameter():
             n_required_cols = 4
         if len(row) < n_required_cols:
             logger.warning(debug_string + "too few entries.")
             return None
 
-        if len(row) > self.ASSIGN_TO_GROUP and row[self.ASSIGN_TO_GROUP] in [
+        assign_to_group_column = self._assign_to_group_column()
+        if len(row) > assign_to_group_column and row[assign_to_group_column] in [
             "TRUE",
             "true",
             "True",
@@ -294,56 +453,67 @@ class ABTest(FlowSheet):
             assign_to_group = False
 
         row_new = copy.copy(row)
-        if len(row_new) < 6:
-            row_new = pad(row_new, 6)
+        if len(row_new) < assign_to_group_column:
+            row_new = pad(row_new, assign_to_group_column)
         self._convert_row_id_to_int(row_new)
 
-        edit_op = FlowEditOp.create_edit_op(
-            row_new[self.TYPE],
-            row_new[self.FLOW_ID],
-            row_new[self.ROW_ID],
-            row_new[self.NODE_IDENTIFIER],
+        spec = self._create_spec(
+            row_new,
+            debug_string,
             row_new[self.A_CONTENT],
             "@contact.groups",
             row_new[self.A_CONTENT],
-            debug_string,
             False,
             assign_to_group,
-            self._uuid_lookup,
-            self._config,
         )
+        if spec is None:
+            return None
 
-        a_content = row_new[self.A_CONTENT]
-        b_content = row_new[self.B_CONTENT]
-        groupA, groupB = self._group_pair
-        categoryA = SwitchCategory(
-            groupA.name, "has_group", [groupA.uuid, groupA.name], a_content
-        )
-        edit_op.add_category(categoryA, self._uuid_lookup)
-        categoryB = SwitchCategory(
-            groupB.name, "has_group", [groupB.uuid, groupB.name], b_content
+        contents = [row_new[self.A_CONTENT]] + row_new[
+            self.CATEGORIES : assign_to_group_column
+        ]
+        for group_name, content in zip(self._group_names(), contents):
+            # The uuid of the group is only looked up when creating the op
+            spec["categories"].append(
+                {
+                    "name": group_name,
+                    "condition_type": "has_group",
+                    "condition_arguments": [group_name],
+                    "replacement_text": content,
+                }
+            )
+        return spec
+
+    def _spec_to_category(self, category):
+        group_name = category["name"]
+        return SwitchCategory(
+            group_name,
+            "has_group",
+            [self._uuid_lookup.lookup_group(group_name), group_name],
+            category["replacement_text"],
         )
-        edit_op.add_category(categoryB, self._uuid_lookup)
-
-        return edit_op
 
     def groupA(self):
         """ContactGroup for the A side of this test."""
-        return self.group_pair()[0]
+        return self.groups()[0]
 
     def groupB(self):
         """ContactGroup for the B side of this test."""
-        return self.group_pair()[1]
+        return self.groups()[1]
 
     def group_pair(self):
-        if not hasattr(self, "_group_pair"):
+        return tuple(self.groups()[:2])
+
+    def groups(self):
+        """ContactGroups of all arms of this test, starting with the A side."""
+        if not hasattr(self, "_groups"):
             raise AttributeError(
                 "Uninitialized sheet. Call parse_rows() before accessing data."
             )
-        return self._group_pair
+        return self._groups
 
     def get_groups(self):
-        return list(self._group_pair)
+        return list(self.groups())
 
 
 class TranslationEditSheet(FlowSheet):
@@ -362,14 +532,13 @@ class TranslationEditSheet(FlowSheet):
     REPLACEMENT_TEXT = 6
 
     OPERATION_TYPES = TRANSLATIONEDIT_OPERATION_TYPES
+    EDIT_OP_CLASS = TranslationEditOp
 
     def _get_category_names(self, row):
         return []
 
-    def _row_to_edit_op(self, row, index):
-        debug_string = "{} {} row {}: ".format(
-            type(self).__name__, self._name, index + 2
-        )
+    def _row_to_spec(self, row, index):
+        debug_string = self._debug_string(index)
         op_type = self._get_operation_type(row, debug_string)
         if op_type is None:
             return None
@@ -377,14 +546,21 @@ class TranslationEditSheet(FlowSheet):
         row_new = pad(copy.copy(row), len(self.FIXED_COLS))
         self._convert_row_id_to_int(row_new)
 
-        # Unpack the row entries to create edit op
-        edit_op = TranslationEditOp.create_edit_op(
-            *row_new[: len(self.FIXED_COLS)],
+        return self._create_spec(
+            row_new,
             debug_string,
-            uuid_lookup=self._uuid_lookup,
-            config=self._config,
+            row_new[self.BIT_OF_TEXT],
+            row_new[self.LANGUAGE],
+            row_new[self.REPLACEMENT_TEXT],
         )
-        return edit_op
+
+
+def hash_row(sheet_type, header, row):
+    """Hash of a row of a sheet, which changes if the row or the header
+    change, but not if other rows are added or removed."""
+
+    serialized = json.dumps([sheet_type, header, row], separators=(",", ":"))
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
 
 
 def pad(row, n):
@@ -0,0 +1,216 @@
+import argparse
+import json
+import logging
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from .compiled_sheets import compile_sheet_groups, sheet_groups_from_compiled
+from .main import apply_sheet_groups, load_sheet_groups
+
+
+logger = logging.getLogger(__name__)
+
+
+def load_manifest(filename):
+    """Load a manifest of jobs.
+
+    The manifest is a JSON list of jobs, each a dict with the keys "input"
+    and "output" (RapidPro JSON files) and optionally "config" (JSON config
+    file replacing the config of the batch for this job).
+    """
+
+    with open(filename, "r", encoding="utf-8") as file:
+        jobs = json.load(file)
+    for i, job in enumerate(jobs):
+        if "input" not in job or "output" not in job:
+            raise ValueError(
+                'Job {} of manifest {} needs an "input" and "output".'.format(
+                    i, filename
+                )
+            )
+    return jobs
+
+
+def run_job(job, compiled_sheets, options):
+    """Apply the compiled sheets (see `compile_sheet_groups`) to the input of
+    the job and write the result to its output.
+
+    Args:
+        job (dict): entry of the manifest, see `load_manifest`.
+        compiled_sheets (dict): the sheets to apply.
+        options (dict): keyword arguments for `apply_sheet_groups`,
+            and "validate" (bool).
+
+    Returns:
+        dict: summary of the job, with the keys "input", "output", "status"
+        ("ok" or "failed"), "seconds", and either "error" or the number of
+        "flows" and "nodes" in the output, the "skipped_nodes" exceeding the
+        growth limits and the validation "issues".
+    """
+
+    options = dict(options)
+    validate = options.pop("validate", False)
+    summary = {"input": job["input"], "output": job["output"]}
+    start = time.perf_counter()
+    try:
+        config = None
+        if job.get("config"):
+            with open(job["config"], "r") as config_file:
+                config = json.load(config_file)
+        flow_edit_sheet_groups = sheet_groups_from_compiled(compiled_sheets, config)
+        rpx = apply_sheet_groups(
+            job["input"], job["output"], flow_edit_sheet_groups, **options
+        )
+        issues = rpx.validate() if validate else []
+    except Exception as error:
+        logger.exception("Job {} -> {} failed.".format(job["input"], job["output"]))
+        summary["status"] = "failed"
+        summary["error"] = "{}: {}".format(type(error).__name__, error)
+    else:
+        for issue in issues:
+            logger.warning("Invalid output {}: {}".format(job["output"], issue))
+        flows = rpx.get_flows()
+        summary["status"] = "ok"
+        summary["flows"] = len(flows)
+        summary["nodes"] = sum(len(flow["nodes"]) for flow in flows)
+        summary["skipped_nodes"] = len(rpx.skipped_nodes())
+        summary["issues"] = len(issues)
+    summary["seconds"] = time.perf_counter() - start
+    return summary
+
+
+def run_batch(jobs, compiled_sheets, options, processes=1):
+    """Run the jobs, in a pool of the given number of processes if
+    there is more than one.
+
+    Returns:
+        list of the summaries of the jobs (see `run_job`), in order.
+    """
+
+    if processes <= 1 or len(jobs) <= 1:
+        return [run_job(job, compiled_sheets, options) for job in jobs]
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = [
+            executor.submit(run_job, job, compiled_sheets, options) for job in jobs
+        ]
+        return [future.result() for future in futures]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Apply the same FlowEdits/ABTests to several RapidPro JSON files, "
+            "parsing the sheets only once."
+        )
+    )
+    parser.add_argument(
+        "manifest",
+        help=(
+            'JSON list of jobs, each with an "input" and "output" RapidPro JSON '
+            'file and optionally a "config" file replacing --config.'
+        ),
+    )
+    parser.add_argument(
+        "master_sheets",
+        nargs="+",
+        help=(
+            "Master sheet(s) referencing FlowEdits/ABTests. "
+            "Either CSV file(s) or a Google Sheet ID(s), or compiled sheets."
+        ),
+    )
+    parser.add_argument(
+        "--format",
+        required=True,
+        choices=["csv", "google_sheets", "json", "compiled"],
+        help="Format of the master sheet.",
+    )
+    parser.add_argument(
+        "--config",
+        help="JSON config file.",
+    )
+    parser.add_argument(
+        "--logfile",
+        help="File to log warnings and errors to.",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="Number of jobs to run in parallel.",
+    )
+    parser.add_argument(
+        "--summary",
+        help="JSON file to write the summary of each job to.",
+    )
+    parser.add_argument(
+        "--delta",
+        action="store_true",
+        help="See rapidpro_abtesting.main.",
+    )
+    parser.add_argument(
+        "--prune-unreachable",
+        action="store_true",
+        help="See rapidpro_abtesting.main.",
+    )
+    parser.add_argument(
+        "--bypass-redundant-switches",
+        action="store_true",
+        help="See rapidpro_abtesting.main.",
+    )
+    parser.add_argument(
+        "--max-node-expansion",
+        type=int,
+        help="See rapidpro_abtesting.main.",
+    )
+    parser.add_argument(
+        "--max-flow-growth",
+        type=float,
+        help="See rapidpro_abtesting.main.",
+    )
+    parser.add_argument(
+        "--no-validate",
+        action="store_true",
+        help="Skip the structural validation of the outputs.",
+    )
+    args = parser.parse_args()
+
+    if args.logfile:
+        logging.basicConfig(filename=args.logfile, level=logging.WARNING, filemode="w")
+
+    jobs = load_manifest(args.manifest)
+    config = {}
+    if args.config:
+        with open(args.config, "r") as config_file:
+            config = json.load(config_file)
+    # Compiled sheets can be sent to the worker processes as they are.
+    compiled_sheets = compile_sheet_groups(
+        load_sheet_groups(args.master_sheets, args.format, config)
+    )
+    options = {
+        "validate": not args.no_validate,
+        "delta": args.delta,
+        "prune_unreachable": args.prune_unreachable,
+        "bypass_switches": args.bypass_redundant_switches,
+        "max_node_expansion": args.max_node_expansion,
+        "max_flow_growth": args.max_flow_growth,
+    }
+    summaries = run_batch(jobs, compiled_sheets, options, args.processes)
+
+    for summary in summaries:
+        if summary["status"] == "ok":
+            print(
+                "{output}: {nodes} nodes in {flows} flows, {skipped_nodes} nodes "
+                "skipped, {issues} issues ({seconds:.2f}s)".format(**summary)
+            )
+        else:
+            print("{output}: failed: {error}".format(**summary))
+    if args.summary:
+        with open(args.summary, "w") as fout:
+            json.dump(summaries, fout, indent=2)
+    if any(summary["status"] != "ok" for summary in summaries):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
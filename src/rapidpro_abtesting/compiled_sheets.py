@@ -0,0 +1,74 @@
+import json
+
+from .abtest import ABTest, FlowEditSheet, TranslationEditSheet
+
+# Increase when the format of the compiled sheets changes.
+COMPILED_SHEETS_VERSION = 1
+
+SHEET_TYPES = {
+    sheet_type.__name__: sheet_type
+    for sheet_type in [ABTest, FlowEditSheet, TranslationEditSheet]
+}
+
+
+def compile_sheet_groups(flow_edit_sheet_groups):
+    """Json-serializable representation of groups of sheets, as returned by
+    `MasterSheetParser.get_flow_edit_sheet_groups`, with their rows parsed.
+
+    The result does not depend on the flows the sheets are applied to, so
+    it can be reused for any number of input files.
+    """
+
+    return {
+        "version": COMPILED_SHEETS_VERSION,
+        "sheet_groups": [
+            [sheet.to_compiled() for sheet in flow_edit_sheets]
+            for flow_edit_sheets in flow_edit_sheet_groups
+        ],
+    }
+
+
+class CompiledSheetsVersionError(ValueError):
+    """Raised for sheets compiled by an incompatible version."""
+
+
+def sheet_groups_from_compiled(data, config=None):
+    """Inverse of `compile_sheet_groups`.
+
+    Args:
+        data (dict): output of `compile_sheet_groups`.
+        config (dict): config of each sheet by sheet name, replacing the
+            config the sheets were compiled with. The specs of the ops do not
+            depend on the config, so the sheets don't need to be parsed again.
+
+    Raises:
+        CompiledSheetsVersionError: if the data was compiled by an incompatible
+            version.
+    """
+
+    version = data.get("version")
+    if version != COMPILED_SHEETS_VERSION:
+        raise CompiledSheetsVersionError(
+            "Compiled sheets have version {}, expected version {}.".format(
+                version, COMPILED_SHEETS_VERSION
+            )
+        )
+    sheet_groups = []
+    for sheets in data["sheet_groups"]:
+        sheet_group = []
+        for sheet in sheets:
+            if config is not None:
+                sheet = dict(sheet, config=config.get(sheet["name"]) or {})
+            sheet_group.append(SHEET_TYPES[sheet["sheet_type"]].from_compiled(sheet))
+        sheet_groups.append(sheet_group)
+    return sheet_groups
+
+
+def save_compiled_sheets(flow_edit_sheet_groups, filename):
+    with open(filename, "w", encoding="utf-8") as fout:
+        json.dump(compile_sheet_groups(flow_edit_sheet_groups), fout, indent=2)
+
+
+def load_compiled_sheets(filename):
+    with open(filename, "r", encoding="utf-8") as file:
+        return sheet_groups_from_compiled(json.load(file))
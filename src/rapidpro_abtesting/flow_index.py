@@ -0,0 +1,158 @@
+from collections import defaultdict
+
+
+def freeze(value):
+    """Convert json data into a hashable value.
+
+    Two values are equal if and only if their frozen values are equal,
+    so frozen values can be used as dict keys to look up json data.
+    """
+
+    if isinstance(value, dict):
+        return frozenset((key, freeze(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def router_match_cases(router):
+    """Returns the cases of a router in the format used to identify routers
+    in sheets, i.e. a list of dicts with "type", "arguments" and "category_name".
+
+    Returns None if a case refers to a category that does not exist.
+    """
+
+    category_names = {
+        category["uuid"]: category["name"] for category in router["categories"]
+    }
+    cases = []
+    for node_case in router["cases"]:
+        if node_case["category_uuid"] not in category_names:
+            return None
+        cases.append(
+            {
+                "type": node_case["type"],
+                "arguments": node_case["arguments"],
+                "category_name": category_names[node_case["category_uuid"]],
+            }
+        )
+    return cases
+
+
+def wait_for_response_signature(node):
+    """Hashable signature of the cases of a node waiting for a response,
+    or None if the node does not wait for a response."""
+
+    router = node.get("router")
+    if (
+        router is None
+        or "wait" not in router
+        or router["type"] != "switch"
+        or not router["operand"].startswith("@input")
+    ):
+        return None
+    cases = router_match_cases(router)
+    if cases is None:
+        return None
+    return freeze(cases)
+
+
+def switch_router_signature(node):
+    """Hashable signature of the operand and cases of a switch router node,
+    or None if the node has no switch router."""
+
+    router = node.get("router")
+    if router is None or router["type"] != "switch":
+        return None
+    cases = router_match_cases(router)
+    if cases is None:
+        return None
+    return freeze({"operand": router["operand"], "cases": cases})
+
+
+def saved_value_key(action):
+    """Returns (target, value) for an action saving a value, e.g.
+    ("@results.result_name", "value") or ("@contact.name", "Steve"),
+    and None for other actions. The value is converted to a string."""
+
+    action_type = action["type"]
+    if action_type == "set_run_result":
+        target = "@results." + action["name"].lower().replace(" ", "_")
+        value = action["value"]
+    elif action_type == "set_contact_field":
+        target = "@fields." + action["field"]["key"].lower()
+        value = action["value"]
+    elif action_type == "set_contact_name":
+        target = "@contact.name"
+        value = action["name"]
+    elif action_type == "set_contact_channel":
+        target = "@contact.channel"
+        value = action["channel"]["name"]
+    elif action_type == "set_contact_language":
+        target = "@contact.language"
+        value = action["language"]
+    elif action_type == "set_contact_status":
+        target = "@contact.status"
+        value = action["status"]
+    else:
+        return None
+    return (target, str(value))
+
+
+class FlowIndex(object):
+    """Indices of the nodes of a flow, to find the nodes an edit op applies to.
+
+    Each index is built on first use in a single pass over the flow.
+    The index becomes stale once the flow is modified.
+    """
+
+    def __init__(self, flow):
+        self._flow = flow
+        self._indices = dict()
+
+    def flow(self):
+        return self._flow
+
+    def nodes(self):
+        return self._flow["nodes"]
+
+    def _lookup(self, signature_function, signature):
+        if signature_function not in self._indices:
+            index = defaultdict(list)
+            for node in self._flow["nodes"]:
+                node_signature = signature_function(node)
+                if node_signature is not None:
+                    index[node_signature].append(node)
+            self._indices[signature_function] = index
+        return self._indices[signature_function].get(signature, [])
+
+    def saved_value_actions(self, target, value):
+        """Actions saving the given value to the given target (see
+        `saved_value_key`), as a list of (node, action index) pairs.
+        Only the first such action of each node is included."""
+
+        if saved_value_key not in self._indices:
+            index = defaultdict(list)
+            for node in self._flow["nodes"]:
+                node_keys = set()
+                for i, action in enumerate(node["actions"]):
+                    key = saved_value_key(action)
+                    if key is not None and key not in node_keys:
+                        node_keys.add(key)
+                        index[key].append((node, i))
+            self._indices[saved_value_key] = index
+        return self._indices[saved_value_key].get((target, str(value)), [])
+
+    def nodes_by_wait_for_response_cases(self, cases):
+        """Nodes waiting for a response with the given cases (see
+        `router_match_cases`)."""
+        return self._lookup(wait_for_response_signature, freeze(cases))
+
+    def nodes_by_switch_router(self, router_identifier):
+        """Nodes with a switch router with the given operand and cases.
+
+        Args:
+            router_identifier: dict with "operand" and "cases"
+                (see `router_match_cases`).
+        """
+        return self._lookup(switch_router_signature, freeze(router_identifier))
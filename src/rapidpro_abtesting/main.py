@@ -1,7 +1,10 @@
 import argparse
 import json
 import logging
+import sys
 
+from .compiled_sheets import load_compiled_sheets, save_compiled_sheets
+from .profiling import NullProfiler, PhaseProfiler
 from .rapidpro_abtest_creator import RapidProABTestCreator
 from .sheets import CSVMasterSheetParser, JSONMasterSheetParser, GoogleMasterSheetParser
 
@@ -23,13 +26,14 @@ def main():
         nargs="+",
         help=(
             "Master sheet(s) referencing FlowEdits/ABTests. "
-            "Either CSV file(s) or a Google Sheet ID(s)."
+            "Either CSV file(s) or a Google Sheet ID(s), "
+            "or compiled sheets (see --save-compiled)."
         ),
     )
     parser.add_argument(
         "--format",
         required=True,
-        choices=["csv", "google_sheets", "json"],
+        choices=["csv", "google_sheets", "json", "compiled"],
         help="Format of the master sheet.",
     )
     parser.add_argument(
@@ -40,18 +44,194 @@ def main():
         "--config",
         help="JSON config file.",
     )
+    parser.add_argument(
+        "--save-compiled",
+        help=(
+            "File to write the parsed sheets to. It can be passed instead of the "
+            "master sheets with --format compiled to apply the same sheets to "
+            "other input files without parsing them again."
+        ),
+    )
+    parser.add_argument(
+        "--profile",
+        help="JSON file to write time (and memory) usage per processing phase to.",
+    )
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="Record peak and retained memory per phase using tracemalloc.",
+    )
+    parser.add_argument(
+        "--memory-baseline",
+        help=(
+            "Profile of an earlier run. Exit with an error if the peak memory "
+            "of a phase exceeds the baseline. Implies --trace-memory."
+        ),
+    )
+    parser.add_argument(
+        "--memory-tolerance",
+        type=float,
+        default=0.1,
+        help="Relative peak memory increase over the baseline that is accepted.",
+    )
+    parser.add_argument(
+        "--max-peak-memory",
+        type=float,
+        help=(
+            "Exit with an error if the peak memory of a phase exceeds this many MB. "
+            "Implies --trace-memory."
+        ),
+    )
+    parser.add_argument(
+        "--delta",
+        action="store_true",
+        help=(
+            "Only write the flows that were modified and the groups that were "
+            "created to the output."
+        ),
+    )
+    parser.add_argument(
+        "--prune-unreachable",
+        action="store_true",
+        help=(
+            "Remove nodes of the edited flows that cannot be reached from the "
+            "flow entry after applying the edits."
+        ),
+    )
+    parser.add_argument(
+        "--bypass-redundant-switches",
+        action="store_true",
+        help=(
+            "Skip switches in the edited flows whose outcome is determined by "
+            "an identical switch earlier on the path, e.g. repeated switches on "
+            "the groups of an A/B test."
+        ),
+    )
+    parser.add_argument(
+        "--max-node-expansion",
+        type=int,
+        help=(
+            "Skip the edits of a node if they would turn it into more than this "
+            "many nodes."
+        ),
+    )
+    parser.add_argument(
+        "--max-flow-growth",
+        type=float,
+        help=(
+            "Skip the edits of a node if they would grow its flow to more than "
+            "this many times its number of input nodes."
+        ),
+    )
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        help=(
+            "Do not apply the edits. Instead, write a JSON report of the nodes "
+            "each row matches, the nodes matched by multiple rows and the rows "
+            "matching no node to the output."
+        ),
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help=(
+            "Keep running and rewrite the output whenever the master sheet or the "
+            "sheets change, only editing the flows affected by the changed sheets. "
+            "Only for the csv and json formats."
+        ),
+    )
+    parser.add_argument(
+        "--no-validate",
+        action="store_true",
+        help="Skip the structural validation of the output.",
+    )
     args = parser.parse_args()
 
     if args.logfile:
         logging.basicConfig(filename=args.logfile, level=logging.WARNING, filemode="w")
 
-    apply_abtests(
+    if args.watch:
+        if args.format not in ["csv", "json"]:
+            parser.error("--watch requires --format csv or json.")
+        if args.delta or args.plan:
+            parser.error("--watch cannot be combined with --delta or --plan.")
+        watch_sheets(args)
+        return
+
+    trace_memory = (
+        args.trace_memory
+        or args.memory_baseline is not None
+        or args.max_peak_memory is not None
+    )
+    profiler = None
+    if args.profile or trace_memory:
+        profiler = PhaseProfiler(trace_memory=trace_memory)
+
+    try:
+        apply_abtests(
+            args.input,
+            args.output,
+            args.master_sheets,
+            args.format,
+            config_fp=args.config,
+            compiled_fp=args.save_compiled,
+            profiler=profiler,
+            validate=not args.no_validate,
+            delta=args.delta,
+            prune_unreachable=args.prune_unreachable,
+            bypass_switches=args.bypass_redundant_switches,
+            max_node_expansion=args.max_node_expansion,
+            max_flow_growth=args.max_flow_growth,
+            plan=args.plan,
+        )
+    finally:
+        if profiler is not None:
+            profiler.stop()
+
+    if profiler is None:
+        return
+    if args.profile:
+        profiler.export_to_json(args.profile)
+    if trace_memory:
+        baseline = None
+        if args.memory_baseline:
+            with open(args.memory_baseline, "r") as baseline_file:
+                baseline = json.load(baseline_file)
+        max_peak_bytes = None
+        if args.max_peak_memory is not None:
+            max_peak_bytes = int(args.max_peak_memory * 1024 * 1024)
+        regressions = profiler.memory_regressions(
+            baseline, args.memory_tolerance, max_peak_bytes
+        )
+        for regression in regressions:
+            logging.error(regression)
+        if regressions:
+            sys.exit(1)
+
+
+def watch_sheets(args):
+    # Imported here as the watch module builds on this module
+    from .watch import IncrementalBuilder, watch
+
+    config = {}
+    if args.config:
+        with open(args.config, "r") as config_file:
+            config = json.load(config_file)
+    builder = IncrementalBuilder(
         args.input,
-        args.output,
         args.master_sheets,
         args.format,
-        config_fp=args.config,
+        config,
+        prune_unreachable=args.prune_unreachable,
+        bypass_switches=args.bypass_redundant_switches,
+        max_node_expansion=args.max_node_expansion,
+        max_flow_growth=args.max_flow_growth,
     )
+    try:
+        watch(builder, args.output)
+    except KeyboardInterrupt:
+        pass
 
 
 def apply_abtests(
@@ -61,27 +241,133 @@ def apply_abtests(
     sheet_format,
     logfile=None,  # deprecated
     config_fp=None,
+    compiled_fp=None,
+    profiler=None,
+    validate=False,
+    delta=False,
+    prune_unreachable=False,
+    bypass_switches=False,
+    max_node_expansion=None,
+    max_flow_growth=None,
+    plan=False,
 ):
     config = {}
+    profiler = profiler or NullProfiler()
 
     if config_fp:
         with open(config_fp, "r") as config_file:
             config = json.load(config_file)
 
+    with profiler.phase("load_sheets"):
+        flow_edit_sheet_groups = load_sheet_groups(main_sheets, sheet_format, config)
+    if compiled_fp:
+        with profiler.phase("compile_sheets"):
+            save_compiled_sheets(flow_edit_sheet_groups, compiled_fp)
+
+    rpx = apply_sheet_groups(
+        input_flow,
+        output_flow,
+        flow_edit_sheet_groups,
+        profiler=profiler,
+        delta=delta,
+        prune_unreachable=prune_unreachable,
+        bypass_switches=bypass_switches,
+        max_node_expansion=max_node_expansion,
+        max_flow_growth=max_flow_growth,
+        plan=plan,
+    )
+
+    if validate and not plan:
+        for issue in rpx.validate():
+            logging.warning("Invalid output: " + issue)
+
+
+def load_sheet_groups(main_sheets, sheet_format, config=None):
+    """Load the groups of sheets referenced by the master sheets
+    (or the compiled sheets if sheet_format is "compiled")."""
+
+    if sheet_format == "compiled":
+        # The sheets are compiled with their config
+        flow_edit_sheet_groups = []
+        for filename in main_sheets:
+            flow_edit_sheet_groups += load_compiled_sheets(filename)
+        return flow_edit_sheet_groups
+
     if sheet_format == "csv":
         sheet_parser = CSVMasterSheetParser(main_sheets)
     elif sheet_format == "json":
         sheet_parser = JSONMasterSheetParser(main_sheets)
     else:
         sheet_parser = GoogleMasterSheetParser(main_sheets)
+    return sheet_parser.get_flow_edit_sheet_groups(config or {})
+
+
+def apply_sheet_groups(
+    input_flow,
+    output_flow,
+    flow_edit_sheet_groups,
+    profiler=None,
+    delta=False,
+    prune_unreachable=False,
+    bypass_switches=False,
+    max_node_expansion=None,
+    max_flow_growth=None,
+    plan=False,
+):
+    """Apply the groups of sheets to the input file and write the result
+    (or the plan, see `RapidProABTestCreator.plan_editsheets`) to the output.
+
+    Returns:
+        `RapidProABTestCreator` holding the output.
+    """
 
-    flow_edit_sheet_groups = sheet_parser.get_flow_edit_sheet_groups(config)
-    rpx = RapidProABTestCreator(input_flow)
+    rpx = RapidProABTestCreator(
+        input_flow,
+        profiler=profiler,
+        track_changes=delta,
+        max_node_expansion=max_node_expansion,
+        max_flow_growth=max_flow_growth,
+    )
+
+    if plan:
+        with open(output_flow, "w") as fout:
+            json.dump(plan_sheet_groups(rpx, flow_edit_sheet_groups), fout, indent=2)
+        return rpx
+
+    process_sheet_groups(
+        rpx, flow_edit_sheet_groups, prune_unreachable, bypass_switches
+    )
+    if delta:
+        rpx.export_delta_to_json(output_flow)
+    else:
+        rpx.export_to_json(output_flow)
+    return rpx
+
+
+def process_sheet_groups(
+    rpx, flow_edit_sheet_groups, prune_unreachable=False, bypass_switches=False
+):
+    """Apply the groups of sheets to the flows of the `RapidProABTestCreator`,
+    one group after the other, and clean up the edited flows."""
 
     for flow_edit_sheets in flow_edit_sheet_groups:
         rpx.apply_abtests(flow_edit_sheets)
+    if bypass_switches:
+        rpx.bypass_redundant_switches()
+    if prune_unreachable:
+        rpx.remove_unreachable_nodes()
+
+
+def plan_sheet_groups(rpx, flow_edit_sheet_groups):
+    """Plan of each group of sheets, see `RapidProABTestCreator.plan_editsheets`.
+    Each group of sheets is matched against the input flows."""
 
-    rpx.export_to_json(output_flow)
+    return {
+        "sheet_groups": [
+            rpx.plan_editsheets(flow_edit_sheets)
+            for flow_edit_sheets in flow_edit_sheet_groups
+        ]
+    }
 
 
 if __name__ == "__main__":
@@ -0,0 +1,306 @@
+import argparse
+import json
+import random
+from collections import Counter, defaultdict
+
+from .simulator import FlowSimulator, InvalidPath
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, see `MultinomialSampler`
+    np = None
+
+
+class MultinomialSampler(object):
+    """Splits a number of contacts randomly into categories with given weights.
+
+    Uses NumPy if it is installed, which samples a split in time independent of
+    the number of contacts. Otherwise falls back to the random module, which
+    draws once per contact.
+    """
+
+    def __init__(self, seed=None, use_numpy=None):
+        if use_numpy is None:
+            use_numpy = np is not None
+        if use_numpy and np is None:
+            raise ImportError("NumPy is not installed.")
+        self._use_numpy = use_numpy
+        if use_numpy:
+            self._rng = np.random.default_rng(seed)
+        else:
+            self._rng = random.Random(seed)
+
+    def uses_numpy(self):
+        return self._use_numpy
+
+    def split(self, n, weights):
+        """Returns a list with the number of contacts in each category."""
+
+        if len(weights) == 1:
+            return [n]
+        total = float(sum(weights))
+        if self._use_numpy:
+            probabilities = [weight / total for weight in weights]
+            return [int(count) for count in self._rng.multinomial(n, probabilities)]
+        counts = [0] * len(weights)
+        for index in self._rng.choices(range(len(weights)), weights, k=n):
+            counts[index] += 1
+        return counts
+
+
+class MonteCarloSimulator(object):
+    """Estimates how a population of contacts traverses a flow.
+
+    Instead of simulating contacts one by one, contacts in the same state
+    (node, groups and sampled variables) are simulated together as a cohort.
+    Whenever contacts in a cohort can take different branches (random routers,
+    inputs and variables drawn from a distribution), the cohort is split
+    by sampling from a multinomial distribution. All cohorts at the same
+    step are processed together as a batch, and identical cohorts are merged.
+
+    Args:
+        flow: RapidPro flow, e.g. the output of an A/B test build.
+        groups: list of (group names, weight) pairs. The initial groups
+            of each contact are drawn from this distribution.
+        inputs: list of (text, weight) pairs. Each time a contact reaches
+            a router on @input.text, its response is drawn from this
+            distribution. Without inputs, contacts take the "Other" category.
+        node_inputs: dict mapping node uuids to input distributions
+            overriding `inputs` for specific routers.
+        variables: dict mapping router operands (e.g. "@fields.gender") to
+            lists of (value, weight) pairs. Each contact draws a value the first
+            time it reaches a router with that operand and keeps it.
+        seed: seed for the random number generator.
+        use_numpy: use NumPy for sampling. By default, use it if installed.
+        max_steps: contacts still in the flow after this many steps are
+            counted as aborted (to deal with cycles).
+    """
+
+    def __init__(
+        self,
+        flow,
+        groups=None,
+        inputs=None,
+        node_inputs=None,
+        variables=None,
+        seed=None,
+        use_numpy=None,
+        max_steps=1000,
+    ):
+        self._flow = flow
+        self._simulator = FlowSimulator(flow)
+        self._groups = groups or [((), 1)]
+        self._inputs = inputs or []
+        self._node_inputs = node_inputs or {}
+        self._variables = variables or {}
+        self._sampler = MultinomialSampler(seed, use_numpy)
+        self._max_steps = max_steps
+
+    def run(self, n_contacts):
+        """Simulate n_contacts contacts starting at the flow entry.
+
+        Returns:
+            dict with the keys
+            - "contacts": number of simulated contacts,
+            - "completed": contacts that reached the end of the flow,
+            - "exited": contacts that left to a destination outside the flow,
+            - "aborted": contacts still in the flow after max_steps steps,
+            - "errors": contacts that took an invalid branch,
+            - "node_visits": visits per node uuid,
+            - "actions": list of [action type, value, count] entries,
+              e.g. the number of times each message was sent,
+            - "switch_categories": per switch router node uuid, the number of
+              contacts per category, e.g. the split into the arms of an A/B test,
+            - "random_categories": same for random routers,
+            - "groups": number of contacts in each group at the end.
+        """
+
+        node_visits = Counter()
+        actions = Counter()
+        switch_categories = defaultdict(Counter)
+        random_categories = defaultdict(Counter)
+        final_groups = Counter()
+        outcomes = Counter()
+
+        # A cohort is (node uuid, groups, variables) -> number of contacts
+        cohorts = Counter()
+        entry_uuid = self._simulator.entry_uuid()
+        group_weights = [weight for _, weight in self._groups]
+        for (group_names, _), count in zip(
+            self._groups, self._sampler.split(n_contacts, group_weights)
+        ):
+            if count:
+                cohorts[(entry_uuid, frozenset(group_names), ())] += count
+
+        steps = 0
+        while cohorts:
+            if steps >= self._max_steps:
+                for (_, groups, _), count in cohorts.items():
+                    outcomes["aborted"] += count
+                    final_groups.update({group: count for group in groups})
+                break
+            steps += 1
+            next_cohorts = Counter()
+            for (uuid, groups, variables), count in cohorts.items():
+                node = self._simulator.node(uuid)
+                node_visits[uuid] += count
+                for output in node.outputs:
+                    actions[output] += count
+                if node.added_groups:
+                    groups = groups.union(node.added_groups)
+                for destination, category, new_variables, n in self._branches(
+                    node, groups, variables, count
+                ):
+                    if node.router_type == "switch":
+                        switch_categories[uuid][category] += n
+                    elif node.router_type == "random":
+                        random_categories[uuid][category] += n
+                    if isinstance(destination, InvalidPath):
+                        outcome = "errors"
+                    elif destination is None:
+                        outcome = "completed"
+                    elif self._simulator.node(destination) is None:
+                        outcome = "exited"
+                    else:
+                        next_cohorts[(destination, groups, new_variables)] += n
+                        continue
+                    outcomes[outcome] += n
+                    final_groups.update({group: n for group in groups})
+            cohorts = next_cohorts
+
+        return {
+            "contacts": n_contacts,
+            "completed": outcomes["completed"],
+            "exited": outcomes["exited"],
+            "aborted": outcomes["aborted"],
+            "errors": outcomes["errors"],
+            "node_visits": dict(node_visits),
+            "actions": [
+                [action_type, value, count]
+                for (action_type, value), count in actions.items()
+            ],
+            "switch_categories": {
+                uuid: dict(counts) for uuid, counts in switch_categories.items()
+            },
+            "random_categories": {
+                uuid: dict(counts) for uuid, counts in random_categories.items()
+            },
+            "groups": dict(final_groups),
+        }
+
+    def _branches(self, node, groups, variables, count):
+        """Split a cohort of contacts at a node among the node's branches.
+
+        Returns:
+            list of (destination, category name, variables, count)
+        """
+
+        if node.router_type is None:
+            return [(node.destination, None, variables, count)]
+        if node.router_type == "random":
+            weights = [1] * len(node.random_destinations)
+            return [
+                (destination, category, variables, n)
+                for destination, category, n in zip(
+                    node.random_destinations,
+                    node.random_categories,
+                    self._sampler.split(count, weights),
+                )
+                if n
+            ]
+
+        if node.operand == "@contact.groups":
+            return [self._evaluate_switch(node, groups) + (variables, count)]
+        if node.operand == "@input.text":
+            distribution = self._node_inputs.get(node.uuid, self._inputs)
+            if not distribution:
+                return [self._evaluate_switch(node, None) + (variables, count)]
+            return [
+                self._evaluate_switch(node, text) + (variables, n)
+                for (text, _), n in self._split(distribution, count)
+            ]
+        variable_values = dict(variables)
+        if node.operand in variable_values:
+            value = variable_values[node.operand]
+            return [self._evaluate_switch(node, value) + (variables, count)]
+        if node.operand not in self._variables:
+            return [self._evaluate_switch(node, None) + (variables, count)]
+        branches = []
+        for (value, _), n in self._split(self._variables[node.operand], count):
+            variable_values[node.operand] = value
+            new_variables = tuple(sorted(variable_values.items()))
+            branches.append(self._evaluate_switch(node, value) + (new_variables, n))
+        return branches
+
+    def _split(self, distribution, count):
+        weights = [weight for _, weight in distribution]
+        return [
+            (entry, n)
+            for entry, n in zip(distribution, self._sampler.split(count, weights))
+            if n
+        ]
+
+    def _evaluate_switch(self, node, operand):
+        if operand is not None:
+            for (test, arguments, destination), category in zip(
+                node.cases, node.case_categories
+            ):
+                if test(arguments, operand):
+                    return (destination, category)
+        return (node.default_destination, node.default_category)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Estimate message counts and A/B group splits of a RapidPro flow "
+            "by simulating a population of contacts."
+        )
+    )
+    parser.add_argument("input", help="RapidPro JSON file containing the flow.")
+    parser.add_argument("flow_name", help="Name of the flow to simulate.")
+    parser.add_argument(
+        "--contacts", type=int, default=100000, help="Number of contacts."
+    )
+    parser.add_argument(
+        "--scenario",
+        help=(
+            "JSON file with distributions of contact properties, with the "
+            'optional keys "groups", "inputs", "node_inputs" and "variables". '
+            "Distributions are lists of [value, weight] pairs."
+        ),
+    )
+    parser.add_argument("--seed", type=int, help="Random seed.")
+    parser.add_argument("--output", help="JSON file to write the report to.")
+    args = parser.parse_args()
+
+    with open(args.input, "r", encoding="utf-8") as input_file:
+        data = json.load(input_file)
+    flow = next(
+        (flow for flow in data["flows"] if flow["name"] == args.flow_name), None
+    )
+    if flow is None:
+        parser.error(f"No flow of name {args.flow_name} exists.")
+    scenario = {}
+    if args.scenario:
+        with open(args.scenario, "r") as scenario_file:
+            scenario = json.load(scenario_file)
+
+    simulator = MonteCarloSimulator(
+        flow,
+        groups=scenario.get("groups"),
+        inputs=scenario.get("inputs"),
+        node_inputs=scenario.get("node_inputs"),
+        variables=scenario.get("variables"),
+        seed=args.seed,
+    )
+    report = simulator.run(args.contacts)
+    if args.output:
+        with open(args.output, "w") as fout:
+            json.dump(report, fout, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
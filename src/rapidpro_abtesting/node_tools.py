@@ -1,8 +1,9 @@
+import functools
 import json
-import copy
+import math
 
 from .uuid_tools import generate_random_uuid
-from .templates import assign_to_random_group_template, assign_to_fixed_group_template
+from .templates import assign_to_fixed_group_template
 
 
 def get_assign_to_group_gadget(
@@ -20,35 +21,117 @@ def get_assign_to_group_gadget(
         node layout dict: mapping node uuid to layout information.
 
     """
-    template = (
-        assign_to_random_group_template.replace(
-            "EntryNode_UUID", generate_random_uuid()
+    return get_assign_to_random_group_gadget(
+        [(groupA_name, groupA_uuid), (groupB_name, groupB_uuid)], destination_uuid
+    )
+
+
+def get_assign_to_random_group_gadget(groups, destination_uuid, weights=None):
+    """
+    Create a gadget that checks whether the contact is in one of the given
+    groups, and if not, randomly adds the contact to one of them.
+
+    Each contact passes at most two routers: a switch on the groups
+    and a random router. As the categories of a random router are equally
+    likely, the weights are realized by giving each group as many categories
+    as its weight (divided by the greatest common divisor of the weights).
+
+    Args:
+        groups: list of (name, uuid) of the groups.
+        destination_uuid: uuid that all exits of the gadget lead to.
+        weights: list of positive integers, the relative probability of
+            assigning a contact to each group. By default, all groups are
+            equally likely.
+
+    Returns:
+        list of nodes: Nodes of the gadget.
+            The first node is entry point to the gadget.
+        node layout dict: mapping node uuid to layout information.
+    """
+
+    if weights is None:
+        weights = [1] * len(groups)
+    divisor = functools.reduce(math.gcd, weights)
+    weights = [weight // divisor for weight in weights]
+
+    entry_node = {
+        "uuid": generate_random_uuid(),
+        "actions": [],
+        "router": {
+            "type": "switch",
+            "cases": [],
+            "categories": [],
+            "operand": "@contact.groups",
+            "result_name": "",
+        },
+        "exits": [],
+    }
+    random_node = {
+        "uuid": generate_random_uuid(),
+        "actions": [],
+        "router": {"type": "random", "categories": []},
+        "exits": [],
+    }
+    assign_nodes = []
+    for (name, uuid), weight in zip(groups, weights):
+        assign_node = {
+            "uuid": generate_random_uuid(),
+            "actions": [
+                {
+                    "type": "add_contact_groups",
+                    "groups": [{"uuid": uuid, "name": name}],
+                    "uuid": generate_random_uuid(),
+                }
+            ],
+            "exits": [
+                {"uuid": generate_random_uuid(), "destination_uuid": destination_uuid}
+            ],
+        }
+        assign_nodes.append(assign_node)
+        _add_category(entry_node, name, destination_uuid)
+        entry_node["router"]["cases"].append(
+            {
+                "uuid": generate_random_uuid(),
+                "type": "has_group",
+                "arguments": [uuid, name],
+                "category_uuid": entry_node["router"]["categories"][-1]["uuid"],
+            }
         )
-        .replace("CaseA_UUID", generate_random_uuid())
-        .replace("CaseB_UUID", generate_random_uuid())
-        .replace("GroupA_UUID", groupA_uuid)
-        .replace("GroupB_UUID", groupB_uuid)
-        .replace("GroupA_Category_UUID", generate_random_uuid())
-        .replace("GroupB_Category_UUID", generate_random_uuid())
-        .replace("Other_Category_UUID", generate_random_uuid())
-        .replace("ExitA_UUID", generate_random_uuid())
-        .replace("ExitB_UUID", generate_random_uuid())
-        .replace("ExitOther_UUID", generate_random_uuid())
-        .replace("Destination_UUID", destination_uuid)
-        .replace("PickRandomGroupNode_UUID", generate_random_uuid())
-        .replace("RandomChoiceGroupA_Exit", generate_random_uuid())
-        .replace("RandomChoiceGroupB_Exit", generate_random_uuid())
-        .replace("AssignToGroupANode_UUID", generate_random_uuid())
-        .replace("AssignToGroupBNode_UUID", generate_random_uuid())
-        .replace("GroupA_name", groupA_name)
-        .replace("GroupB_name", groupB_name)
+        for i in range(weight):
+            category_name = name if weight == 1 else "{} {}".format(name, i + 1)
+            _add_category(random_node, category_name, assign_node["uuid"])
+    _add_category(entry_node, "Other", random_node["uuid"])
+    entry_node["router"]["default_category_uuid"] = entry_node["router"]["categories"][
+        -1
+    ]["uuid"]
+
+    xcenter = 90 + 110 * (len(groups) - 1)
+    layout = {
+        entry_node["uuid"]: {
+            "type": "split_by_groups",
+            "position": {"left": xcenter, "top": 40},
+            "config": {"cases": {}},
+        },
+        random_node["uuid"]: {
+            "type": "split_by_random",
+            "position": {"left": xcenter + 60, "top": 140},
+            "config": None,
+        },
+    }
+    for i, assign_node in enumerate(assign_nodes):
+        layout[assign_node["uuid"]] = {
+            "position": {"left": 160 + 220 * i, "top": 260},
+            "type": "execute_actions",
+        }
+    return [entry_node, random_node] + assign_nodes, layout
+
+
+def _add_category(node, name, destination_uuid):
+    exit = {"uuid": generate_random_uuid(), "destination_uuid": destination_uuid}
+    node["exits"].append(exit)
+    node["router"]["categories"].append(
+        {"uuid": generate_random_uuid(), "name": name, "exit_uuid": exit["uuid"]}
     )
-    n_one_time_uuids = template.count("OneTimeUse_UUID")
-    for _ in range(n_one_time_uuids):
-        # Each time, only replace first instance.
-        template = template.replace("OneTimeUse_UUID", generate_random_uuid(), 1)
-    data = json.loads(template)
-    return data["nodes"], data["_ui"]["nodes"]
 
 
 def get_assign_to_fixed_group_gadget(group_name, group_uuid, destination_uuid):
@@ -68,6 +151,45 @@ def get_assign_to_fixed_group_gadget(group_name, group_uuid, destination_uuid):
     return data["nodes"], data["_ui"]["nodes"]
 
 
+def get_gadget_groups(node):
+    """Checks whether node is the entry of a gadget assigning contacts to
+    groups, as created by `get_assign_to_group_gadget` or
+    `get_assign_to_fixed_group_gadget`.
+
+    Returns:
+        (set of group uuids, destination uuid) of the gadget.
+        None if node is not the entry of a gadget.
+    """
+
+    if "router" not in node:
+        if (
+            len(node["actions"]) == 1
+            and node["actions"][0]["type"] == "add_contact_groups"
+            and len(node["exits"]) == 1
+        ):
+            groups = node["actions"][0]["groups"]
+            return {group["uuid"] for group in groups}, node["exits"][0].get(
+                "destination_uuid"
+            )
+        return None
+    router = node["router"]
+    if (
+        router["type"] != "switch"
+        or router["operand"] != "@contact.groups"
+        or node["actions"]
+        or len(router.get("cases", [])) < 2
+        or any(case["type"] != "has_group" for case in router["cases"])
+        or len(node["exits"]) != len(router["cases"]) + 1
+    ):
+        return None
+    destination_uuid = node["exits"][0].get("destination_uuid")
+    if any(
+        exit.get("destination_uuid") != destination_uuid for exit in node["exits"][:-1]
+    ):
+        return None
+    return {case["arguments"][0] for case in router["cases"]}, destination_uuid
+
+
 def get_switch_node(edit_op, dest_uuids):
     """
     Create a router node with N cases as specified in the edit_op,
@@ -151,9 +273,15 @@ def find_node_by_uuid(flow, node_uuid):
 def get_unique_node_copy(node):
     """Given a node, creates a new node with unique uuids wherever appropriate.
 
+    Only the containers holding uuids (the node, its actions, exits,
+    categories and cases and the lists of these) are copied. Everything else,
+    e.g. message texts, attachments, quick replies and case arguments,
+    is shared with the original node. Therefore, such values must be replaced
+    rather than modified in place when editing either of the nodes.
+
     TODO: Make this work for any kind of node. (Check specification.)"""
 
-    node_new = copy.deepcopy(node)
+    node_new = dict(node)
     # Generate new uuids for everything that should have a unique one.
     # TODO: There are 3 action types with fields where this is unclear.
     #   "call_classifier" -- has a "classifier" with uuid
@@ -161,40 +289,88 @@ def get_unique_node_copy(node):
     #   "set_contact_channel" -- has a field "channel" with uuid
     #   Which of these have to be unique?
     node_new["uuid"] = generate_random_uuid()
-    for action in node_new["actions"]:
-        action["uuid"] = generate_random_uuid()
+    node_new["actions"] = []
+    for action in node["actions"]:
+        action_new = dict(action)
+        action_new["uuid"] = generate_random_uuid()
         # send_msg actions can have a templating field with templates.
         # The templating uuid should be unique, while the templates
         # themselves refer to external objects with a fixed uuid.
         if "templating" in action:
-            action["templating"]["uuid"] = generate_random_uuid()
+            action_new["templating"] = dict(action["templating"])
+            action_new["templating"]["uuid"] = generate_random_uuid()
         # attachments, quick_replies don't have unique uuids.
+        node_new["actions"].append(action_new)
     uuid_map = dict()
-    for exit in node_new["exits"]:
-        new_uuid = generate_random_uuid()
-        uuid_map[exit["uuid"]] = new_uuid
-        exit["uuid"] = new_uuid
+    node_new["exits"] = []
+    for exit in node["exits"]:
+        exit_new = dict(exit)
+        exit_new["uuid"] = generate_random_uuid()
+        uuid_map[exit["uuid"]] = exit_new["uuid"]
         # Note: exit["destination_uuid"] is NOT modified because all variations
         # should exit into the same destination as the original.
-    if "router" in node_new:
-        for category in node_new["router"]["categories"]:
-            new_uuid = generate_random_uuid()
-            uuid_map[category["uuid"]] = new_uuid
-            category["uuid"] = new_uuid
-            category["exit_uuid"] = uuid_map[category["exit_uuid"]]
-        if "cases" in node_new["router"]:
-            for case in node_new["router"]["cases"]:
-                new_uuid = generate_random_uuid()
-                uuid_map[case["uuid"]] = new_uuid
-                case["uuid"] = new_uuid
-                case["category_uuid"] = uuid_map[case["category_uuid"]]
-        node_new["router"]["default_category_uuid"] = uuid_map[
-            node_new["router"]["default_category_uuid"]
+        node_new["exits"].append(exit_new)
+    if "router" in node:
+        router_new = dict(node["router"])
+        router_new["categories"] = []
+        for category in node["router"]["categories"]:
+            category_new = dict(category)
+            category_new["uuid"] = generate_random_uuid()
+            uuid_map[category["uuid"]] = category_new["uuid"]
+            category_new["exit_uuid"] = uuid_map[category["exit_uuid"]]
+            router_new["categories"].append(category_new)
+        if "cases" in router_new:
+            router_new["cases"] = []
+            for case in node["router"]["cases"]:
+                case_new = dict(case)
+                case_new["uuid"] = generate_random_uuid()
+                uuid_map[case["uuid"]] = case_new["uuid"]
+                case_new["category_uuid"] = uuid_map[case["category_uuid"]]
+                router_new["cases"].append(case_new)
+        router_new["default_category_uuid"] = uuid_map[
+            router_new["default_category_uuid"]
         ]
+        node_new["router"] = router_new
 
     return node_new
 
 
+def get_content_key(node):
+    """Returns a key identifying the content of a node.
+
+    Two nodes have the same key if and only if they are identical apart
+    from the uuids of the node and its elements (actions, exits, categories,
+    cases), e.g. two variations of a node with the same replacements.
+    References to other nodes and external objects (e.g. groups) are part
+    of the content.
+    """
+
+    local_uuids = [node["uuid"]]
+    for action in node["actions"]:
+        local_uuids.append(action["uuid"])
+        if "templating" in action:
+            local_uuids.append(action["templating"]["uuid"])
+    local_uuids += [exit["uuid"] for exit in node["exits"]]
+    if "router" in node:
+        router = node["router"]
+        local_uuids += [category["uuid"] for category in router["categories"]]
+        local_uuids += [case["uuid"] for case in router.get("cases", [])]
+    # Replace each uuid by its position, so references within the node
+    # (e.g. from categories to exits) are preserved.
+    positions = {uuid: "#{}".format(i) for i, uuid in enumerate(local_uuids)}
+
+    def canonical(value):
+        if isinstance(value, dict):
+            return {key: canonical(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [canonical(item) for item in value]
+        if isinstance(value, str):
+            return positions.get(value, value)
+        return value
+
+    return json.dumps(canonical(node), sort_keys=True)
+
+
 def find_incoming_edges(flow, uuid):
     """
     For a given node uuid, returns a list of exits from other nodes
@@ -217,6 +393,58 @@ def find_incoming_edges(flow, uuid):
     return exits
 
 
+def get_reachable_uuids(flow):
+    """Returns the set of uuids of the nodes that can be reached from
+    the flow entry (the first node)."""
+
+    if not flow["nodes"]:
+        return set()
+    nodes_by_uuid = {node["uuid"]: node for node in flow["nodes"]}
+    reachable = {flow["nodes"][0]["uuid"]}
+    stack = [flow["nodes"][0]]
+    while stack:
+        node = stack.pop()
+        for exit in node["exits"]:
+            destination_uuid = exit.get("destination_uuid")
+            if destination_uuid in nodes_by_uuid and destination_uuid not in reachable:
+                reachable.add(destination_uuid)
+                stack.append(nodes_by_uuid[destination_uuid])
+    return reachable
+
+
+def remove_nodes(flow, uuids):
+    """Remove the nodes with the given uuids from the flow, together with
+    their layout and translations. Edges into these nodes are not modified."""
+
+    removed_nodes = [node for node in flow["nodes"] if node["uuid"] in uuids]
+    flow["nodes"] = [node for node in flow["nodes"] if node["uuid"] not in uuids]
+    ui_nodes = flow.get("_ui", dict()).get("nodes", dict())
+    localizable_uuids = set()
+    for node in removed_nodes:
+        ui_nodes.pop(node["uuid"], None)
+        localizable_uuids.update(get_localizable_uuids(node))
+    for translations in flow.get("localization", dict()).values():
+        for uuid in localizable_uuids:
+            translations.pop(uuid, None)
+
+
+def remove_unreachable_nodes(flow):
+    """Remove the nodes that cannot be reached from the flow entry
+    (the first node), together with their layout and translations.
+
+    Returns:
+        list of the uuids of the removed nodes.
+    """
+
+    reachable = get_reachable_uuids(flow)
+    unreachable_uuids = [
+        node["uuid"] for node in flow["nodes"] if node["uuid"] not in reachable
+    ]
+    if unreachable_uuids:
+        remove_nodes(flow, set(unreachable_uuids))
+    return unreachable_uuids
+
+
 def get_localizable_uuids(node):
     # Returns UUIDs of node elements the can potentially be translated
     localizable_uuids = {}
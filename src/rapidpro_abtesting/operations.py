@@ -1,18 +1,34 @@
 import copy
+import functools
 import json
 import logging
 import re
 from abc import ABC, abstractmethod
 
+from rapidpro_abtesting.flow_index import (
+    freeze,
+    saved_value_key,
+    switch_router_signature,
+    wait_for_response_signature,
+)
 from rapidpro_abtesting.nodes_layout import NodesLayout, make_tree_layout
 from rapidpro_abtesting.node_tools import (
     find_incoming_edges,
+    find_node_by_uuid,
     get_assign_to_fixed_group_gadget,
-    get_assign_to_group_gadget,
+    get_assign_to_random_group_gadget,
+    get_content_key,
+    get_gadget_groups,
     get_localizable_uuids,
     get_switch_node,
     get_unique_node_copy,
 )
+from rapidpro_abtesting.regex_tools import (
+    DEFAULT_REGEX_TIME_BUDGET,
+    BudgetedRegex,
+    TimeBudget,
+)
+from rapidpro_abtesting.text_matcher import can_create_occurrence
 from rapidpro_abtesting.uuid_tools import generate_random_uuid
 
 
@@ -20,6 +36,7 @@ logger = logging.getLogger(__name__)
 
 
 REGEX_PREFIX = "regex:"
+WHITESPACE_REGEX = re.compile(r"\s+")
 
 
 class FlowSnippet(object):
@@ -95,7 +112,8 @@ class GenericEditOp(ABC):
             logger.warning(debug_string + "invalid node identifier.")
             return None
 
-        return class_name(
+        return cls.create_parsed_edit_op(
+            op_type,
             flow_id,
             row_id,
             parsed_node_identifier,
@@ -109,6 +127,44 @@ class GenericEditOp(ABC):
             config,
         )
 
+    @classmethod
+    def create_parsed_edit_op(
+        cls,
+        op_type,
+        flow_id,
+        row_id,
+        node_identifier,
+        bit_of_text,
+        split_by,
+        default_text,
+        debug_string,
+        has_node_for_other_category=True,
+        assign_to_group=False,
+        uuid_lookup=None,
+        config=None,
+    ):
+        """Like `create_edit_op`, but for a valid op_type and a node_identifier
+        that has already been parsed by `parse_node_identifier`."""
+
+        class_name = cls.get_operation_types()[op_type]
+        try:
+            return class_name(
+                flow_id,
+                row_id,
+                node_identifier,
+                bit_of_text,
+                split_by,
+                default_text,
+                debug_string,
+                has_node_for_other_category,
+                assign_to_group,
+                uuid_lookup,
+                config,
+            )
+        except re.error as error:
+            logger.warning(debug_string + "invalid regular expression: " + str(error))
+            return None
+
     def __init__(
         self,
         flow_id,
@@ -124,22 +180,38 @@ class GenericEditOp(ABC):
         config=None,
     ):
         self._row_id = row_id
+        self._config = config or {}
+        # Total time all regular expressions of this op may take to match
+        self._regex_budget = TimeBudget(
+            self._config.get("regex_time_budget", DEFAULT_REGEX_TIME_BUDGET)
+        )
+        # All patterns are compiled once here rather than for every flow/node.
         if get_regex_pattern(flow_id):
             self._flow_id = get_regex_pattern(flow_id)
             self._flow_match_regex = True
+            self._flow_regex = BudgetedRegex(self._flow_id, budget=self._regex_budget)
         else:
             self._flow_id = flow_id
             self._flow_match_regex = False
+        self._normalized_node_identifier = None
         if isinstance(node_identifier, str) and get_regex_pattern(node_identifier):
             self._node_identifier = get_regex_pattern(node_identifier)
             self._node_match_regex = True
+            self._node_regex = BudgetedRegex(
+                self._node_identifier, re.DOTALL, self._regex_budget
+            )
         else:
             self._node_identifier = node_identifier
             self._node_match_regex = False
+            if isinstance(node_identifier, str):
+                self._normalized_node_identifier = normalize_whitespace(node_identifier)
         self._debug_string = debug_string
         self._bit_of_text = bit_of_text
+        self._text_patterns = dict()
+        self._bit_of_text_pattern = None
+        if isinstance(bit_of_text, str):
+            self._bit_of_text_pattern = self._text_pattern(bit_of_text)
         self._default_text = default_text
-        self._config = config or {}
 
     @classmethod
     @abstractmethod
@@ -147,13 +219,18 @@ class GenericEditOp(ABC):
         pass
 
     @abstractmethod
-    def apply_operation(self, flow, node):
+    def apply_operation(self, flow, node, reported_occurrences=None):
         pass
 
     @abstractmethod
     def is_match_for_node(self, node):
         pass
 
+    def find_matching_nodes(self, flow_index):
+        """Returns the nodes of a flow (given by its `FlowIndex`) that
+        the operation applies to."""
+        return [node for node in flow_index.nodes() if self.is_match_for_node(node)]
+
     def _process_uuid_lookup(self, uuid_lookup):
         pass
 
@@ -180,18 +257,50 @@ class GenericEditOp(ABC):
     def default_text(self):
         return self._default_text
 
+    def _text_pattern(self, string):
+        if string not in self._text_patterns:
+            self._text_patterns[string] = TextPattern(string, self._regex_budget)
+        return self._text_patterns[string]
+
     def matches_unique_flow(self):
         return not self._flow_match_regex
 
     def is_match_for_flow(self, flow_name):
         if self._flow_match_regex:
-            return bool(re.fullmatch(self._flow_id, flow_name))
+            return bool(self._flow_regex.fullmatch(flow_name))
         else:
             return flow_name == self._flow_id
 
     def matches_unique_node_identifier(self):
         return not self._node_match_regex
 
+    def literal_text_to_replace_in_message(self):
+        """Literal string this op replaces within send_msg texts, if any.
+
+        Used to count the occurrences of many ops in a node in a single pass.
+        """
+        return None
+
+    def may_introduce_message_text(self, text):
+        """Can applying the op create occurrences of text in the send_msg
+        texts of a node that did not contain them before?"""
+        return False
+
+    def max_variations(self):
+        """Upper bound of the number of variations the op turns a node into."""
+        return 1
+
+    def max_added_nodes(self):
+        """Upper bound of the number of nodes (switch and group assignment
+        gadget) the op inserts in front of the variations of a node."""
+        return 0
+
+    def missing_shared_gadget(self, flow):
+        """The group assignment gadget the op would insert at the entry of
+        flow, as (frozenset of group uuids, upper bound of its number of
+        nodes), or None if it does not share a gadget or the flow has it."""
+        return None
+
     def _matches_entered_flow(self, node):
         # TODO: Check row_id once implemented
         if len(node["actions"]) == 0:
@@ -210,114 +319,50 @@ class GenericEditOp(ABC):
         """Ignores whitespace differences by replacing groups of
         whitespace with a single space and stipping whitespace
         from the beginning and end of the text."""
-        return re.sub(r"\s+", " ", text1).strip() == re.sub(r"\s+", " ", text2).strip()
+        return normalize_whitespace(text1) == normalize_whitespace(text2)
 
     def _matches_message_text(self, node):
         # TODO: Check row_id once implemented
         # TODO: If there are multiple exits, warn and return False
-        result = False
         for action in node["actions"]:
             if action["type"] == "send_msg":
                 if self._node_match_regex:
-                    result |= bool(
-                        re.fullmatch(
-                            self.node_identifier(), action["text"], flags=re.DOTALL
-                        )
-                    )
-                else:
-                    result |= self._lenient_text_match(
-                        action["text"], self.node_identifier()
-                    )
-        return result
-
-    def _construct_match_cases(self, node):
-        router = node["router"]
-        cases = []
-        for node_case in router["cases"]:
-            category = next(
-                cat
-                for cat in router["categories"]
-                if cat["uuid"] == node_case["category_uuid"]
-            )
-            case = {
-                "type": node_case["type"],
-                "arguments": node_case["arguments"],
-                "category_name": category["name"],
-            }
-            cases.append(case)
-        return cases
+                    if self._node_regex.fullmatch(action["text"]):
+                        return True
+                elif (
+                    normalize_whitespace(action["text"])
+                    == self._normalized_node_identifier
+                ):
+                    return True
+        return False
 
     def _matches_wait_for_response_cases(self, node):
-        if "router" not in node:
-            return False
-        router = node["router"]
-        if (
-            "wait" not in router
-            or router["type"] != "switch"
-            or not router["operand"].startswith("@input")
-        ):
-            return False
-
-        cases = self._construct_match_cases(node)
-        return cases == self.node_identifier()
+        signature = wait_for_response_signature(node)
+        return signature is not None and signature == freeze(self.node_identifier())
 
     def _matches_switch_router_identifier(self, node):
-        if "router" not in node:
-            return False
-        router = node["router"]
-        if router["type"] != "switch":
-            return False
-        cases = self._construct_match_cases(node)
-        match_router = {"operand": router["operand"], "cases": cases}
-
-        return match_router == self.node_identifier()
+        signature = switch_router_signature(node)
+        return signature is not None and signature == freeze(self.node_identifier())
 
     def _matches_save_value(self, node):
         return self._matching_save_value_action_id(node) != -1
 
     def _matching_save_value_action_id(self, node):
         # TODO: Check row_id once implemented
+        key = (self.node_identifier(), str(self.bit_of_text()))
         for i, action in enumerate(node["actions"]):
-            if (
-                action["type"] == "set_run_result"
-                and "@results." + action["name"].lower().replace(" ", "_")
-                == self.node_identifier()
-                and str(self.bit_of_text()) == str(action["value"])
-            ):
-                return i
-            if (
-                action["type"] == "set_contact_field"
-                and "@fields." + action["field"]["key"].lower()
-                == self.node_identifier()
-                and str(self.bit_of_text()) == str(action["value"])
-            ):
-                return i
-            if (
-                action["type"] == "set_contact_name"
-                and "@contact.name" == self.node_identifier()
-                and str(self.bit_of_text()) == str(action["name"])
-            ):
-                return i
-            if (
-                action["type"] == "set_contact_channel"
-                and "@contact.channel" == self.node_identifier()
-                and str(self.bit_of_text()) == str(action["channel"]["name"])
-            ):
-                return i
-            if (
-                action["type"] == "set_contact_language"
-                and "@contact.language" == self.node_identifier()
-                and str(self.bit_of_text()) == str(action["language"])
-            ):
-                return i
-            if (
-                action["type"] == "set_contact_status"
-                and "@contact.status" == self.node_identifier()
-                and str(self.bit_of_text()) == str(action["status"])
-            ):
+            if saved_value_key(action) == key:
                 return i
         return -1
 
+    def _find_save_value_nodes(self, flow_index):
+        return [
+            node
+            for node, _ in flow_index.saved_value_actions(
+                self.node_identifier(), self.bit_of_text()
+            )
+        ]
+
 
 class FlowEditOp(GenericEditOp):
     @classmethod
@@ -359,6 +404,9 @@ class FlowEditOp(GenericEditOp):
         self._categories = []
         self._has_node_for_other_category = has_node_for_other_category
         self._assign_to_group = assign_to_group  # to be removed
+        # Occurrences of the replaced text in the node the op is being applied
+        # to by op, for the ops whose occurrences have already been reported.
+        self._reported_occurrences = dict()
         self._process_uuid_lookup(uuid_lookup)
 
     def add_category(self, category, uuid_lookup=None):
@@ -369,11 +417,17 @@ class FlowEditOp(GenericEditOp):
         # lazily?
         self._categories.append(category)
 
-    def apply_operation(self, flow, node):
+    def apply_operation(self, flow, node, reported_occurrences=None):
         """Apply the operation to a given node.
 
         Replaces the node with an appropriate flow snippet.
 
+        Args:
+            reported_occurrences (dict): number of occurrences of the text
+                an op replaces in the input node, for the ops (this op or the
+                ops fused into it) whose occurrences have already been reported
+                (see `RapidProABTestCreator._report_text_occurrences`).
+
         Returns:
             list of nodes: variations of the input node that further
                 operations can be applied to.
@@ -383,10 +437,16 @@ class FlowEditOp(GenericEditOp):
         node_is_entrypoint = flow["nodes"][0]["uuid"] == uuid
         incoming_edges = find_incoming_edges(flow, uuid)
 
-        flow["nodes"].remove(node)
         nodes_layout = NodesLayout(flow.get("_ui", dict()).get("nodes"))
         node_layout = nodes_layout.get_node(uuid)
-        snippet = self._get_flow_snippet(node, node_layout)
+        # Create the snippet before modifying the flow, so that the flow
+        # remains consistent if this fails (e.g. a regex times out).
+        self._set_reported_occurrences(reported_occurrences or dict())
+        try:
+            snippet = self._get_flow_snippet(node, node_layout)
+        finally:
+            self._set_reported_occurrences(dict())
+        flow["nodes"].remove(node)
         nodes_layout.replace(uuid, snippet.nodes_layout())
         if "_ui" in flow:
             flow["_ui"]["nodes"] = nodes_layout.layout()
@@ -402,6 +462,9 @@ class FlowEditOp(GenericEditOp):
         for edge in incoming_edges:
             edge["destination_uuid"] = snippet.root_uuid()
 
+        if self.needs_group_assignment() and self._shares_group_assignment():
+            self._insert_shared_assigntogroup_gadget(flow)
+
         # Copy over translations of the original node elements to all its variations
         localization = flow.get("localization", {})
         # Get translatable elements of the original node and the variations
@@ -435,6 +498,73 @@ class FlowEditOp(GenericEditOp):
     def has_node_for_other_category(self):
         return self._has_node_for_other_category
 
+    def needs_group_assignment(self):
+        """Whether contacts need to be assigned to a group of the categories
+        before reaching the nodes the op is applied to."""
+        return self.assign_to_group()
+
+    def max_variations(self):
+        return max(
+            1, len(self.categories()) + (1 if self.has_node_for_other_category() else 0)
+        )
+
+    def max_added_nodes(self):
+        n_nodes = 1 if self.max_variations() > 1 else 0
+        if self.assign_to_group():
+            n_nodes += self._max_gadget_size()
+        return n_nodes
+
+    def _max_gadget_size(self):
+        # A shared gadget is not inserted in front of the node
+        if self._shares_group_assignment():
+            return 0
+        return self._gadget_size()
+
+    def _gadget_size(self):
+        if self._config.get("group_assignment", "random") in ["always A", "always B"]:
+            return 1
+        return 2 + len(self.categories())
+
+    def missing_shared_gadget(self, flow):
+        if not self.needs_group_assignment() or not self._shares_group_assignment():
+            return None
+        if self._has_shared_assigntogroup_gadget(flow, report=False):
+            return None
+        return frozenset(self._gadget_group_uuids()), self._gadget_size()
+
+    def _set_reported_occurrences(self, reported_occurrences):
+        self._reported_occurrences = reported_occurrences
+
+    def _replacement_texts(self):
+        return [self.default_text()] + [
+            category.replacement_text for category in self.categories()
+        ]
+
+    def fusion_key(self):
+        """Consecutive ops applied to the same node with the same (not None)
+        key create identical switches and can be fused into one switch,
+        see `fuse_edit_ops`. As the fused op assigns contacts to groups like
+        its first op, the ops also need the same group assignment config."""
+        return (
+            self.split_by(),
+            self.has_node_for_other_category(),
+            self._shares_group_assignment(),
+            self._config.get("group_assignment", "random"),
+            freeze(self._config.get("group_weights")),
+            tuple(
+                (
+                    category.name,
+                    category.condition_type,
+                    freeze(category.condition_arguments),
+                )
+                for category in self.categories()
+            ),
+        )
+
+    def _prepare_variations(self, input_node):
+        """Called before the variations of input_node are created."""
+        pass
+
     @abstractmethod
     def _get_flow_snippet(self, node, node_layout=None):
         pass
@@ -448,7 +578,8 @@ class FlowEditOp(GenericEditOp):
         elif action["type"] == "set_contact_name":
             action["name"] = value
         elif action["type"] == "set_contact_channel":
-            action["channel"]["name"] = value
+            # The channel may be shared with other node variations.
+            action["channel"] = dict(action["channel"], name=value)
         elif action["type"] == "set_contact_language":
             action["language"] = value
         elif action["type"] == "set_contact_status":
@@ -462,15 +593,31 @@ class FlowEditOp(GenericEditOp):
     def _replace_text_in_message(self, node, replacement_text):
         """Modifies the input node by replacing message text."""
         total_occurrences = 0
+        new_texts = []
         for action in node["actions"]:
             if action["type"] == "send_msg":
-                text = action["text"]
-                total_occurrences += count(text, self.bit_of_text())
-                text_new = replace(text, self.bit_of_text(), replacement_text)
-                action["text"] = text_new
+                text, occurrences = self._bit_of_text_pattern.subn(
+                    replacement_text, action["text"]
+                )
+                new_texts.append((action, text))
+                total_occurrences += occurrences
+        # Only modify the node once all replacements succeeded,
+        # as matching a regex may time out.
+        for action, text in new_texts:
+            action["text"] = text
         # TODO: If we don't just store the node uuid, but also action uuid
         #   where edit_op is applicable, we could give more helpful
         #   messages here by referring to the action text that doesn't match
+        expected_occurrences = self._reported_occurrences.get(self)
+        if expected_occurrences is not None:
+            # Occurrences in the input node have already been reported.
+            if total_occurrences == 0 and expected_occurrences > 0:
+                logger.warning(
+                    self.debug_string()
+                    + 'No occurrences of "{}" left in node after applying previous'
+                    " operations.".format(self.bit_of_text())
+                )
+            return
         if total_occurrences == 0:
             # This might happen if we're trying to replace text that has
             # already had a replacement applied to it.
@@ -516,16 +663,19 @@ class FlowEditOp(GenericEditOp):
                 the original values with.
         """
 
+        # Replace in copies of the lists and only modify the node once
+        # all replacements succeeded, as matching a regex may time out.
+        actions = [action for action in node["actions"] if action["type"] == "send_msg"]
+        new_lists = [list(action[action_field]) for action in actions]
         for bit_of_text, repl_text in zip(
             self._bit_of_text.split(";"), replacement_text.split(";")
         ):
+            pattern = self._text_pattern(bit_of_text)
             total_occurrences = 0
-            for action in node["actions"]:
-                if action["type"] == "send_msg":
-                    for i, text in enumerate(action[action_field]):
-                        total_occurrences += count(text, bit_of_text)
-                        text_new = replace(text, bit_of_text, repl_text)
-                        action[action_field][i] = text_new
+            for new_list in new_lists:
+                for i, text in enumerate(new_list):
+                    new_list[i], occurrences = pattern.subn(repl_text, text)
+                    total_occurrences += occurrences
             if total_occurrences == 0:
                 logger.warning(
                     self.debug_string()
@@ -536,6 +686,8 @@ class FlowEditOp(GenericEditOp):
                     self.debug_string()
                     + 'Multiple occurrences of "{}" found in node.'.format(bit_of_text)
                 )
+        for action, new_list in zip(actions, new_lists):
+            action[action_field] = new_list
 
     def _remove_in_action_list_field(self, node, action_field):
         """Modifies the input node by removing the content of a list-field
@@ -621,33 +773,114 @@ class FlowEditOp(GenericEditOp):
             node_case["arguments"] = case["arguments"]
 
     def _get_assigntogroup_gadget(self, node):
-        if len(self.categories()) != 2:
+        if len(self.categories()) < 2:
             logger.warning(
                 self.debug_string()
-                + "assign_to_group only for A/B tests (i.e. 2 groups)."
+                + "assign_to_group only for A/B tests (i.e. at least 2 groups)."
             )
             return None, None
-        groupA_uuid = self.categories()[0].condition_arguments[0]
-        groupA_name = self.categories()[0].condition_arguments[1]
-        groupB_uuid = self.categories()[1].condition_arguments[0]
-        groupB_name = self.categories()[1].condition_arguments[1]
+        # (name, uuid) of the group of each category
+        groups = [
+            (category.condition_arguments[1], category.condition_arguments[0])
+            for category in self.categories()
+        ]
         group_assignment = self._config.get("group_assignment", "random")
         if group_assignment == "always A":
             gadget, gadget_layout = get_assign_to_fixed_group_gadget(
-                groupA_name, groupA_uuid, node["uuid"]
+                *groups[0], node["uuid"]
             )
         elif group_assignment == "always B":
             gadget, gadget_layout = get_assign_to_fixed_group_gadget(
-                groupB_name, groupB_uuid, node["uuid"]
+                *groups[1], node["uuid"]
             )
         else:  # group_assignment == "random":
-            gadget, gadget_layout = get_assign_to_group_gadget(
-                groupA_name, groupA_uuid, groupB_name, groupB_uuid, node["uuid"]
+            gadget, gadget_layout = get_assign_to_random_group_gadget(
+                groups, node["uuid"], self._group_weights()
             )
 
         return gadget, NodesLayout(gadget_layout)
 
+    def _group_weights(self):
+        weights = self._config.get("group_weights")
+        if weights is None:
+            return None
+        if len(weights) != len(self.categories()) or not all(
+            isinstance(weight, int) and weight > 0 for weight in weights
+        ):
+            logger.warning(
+                self.debug_string()
+                + "group_weights {} should be {} positive integers. ".format(
+                    weights, len(self.categories())
+                )
+                + "Assigning groups with equal probability."
+            )
+            return None
+        return weights
+
+    def _shares_group_assignment(self):
+        """Whether a single gadget at the flow entry assigns contacts to groups,
+        instead of a gadget in front of each node the op is applied to."""
+        return self._config.get("group_assignment_gadget", "per_node") == "per_flow"
+
+    def _gadget_group_uuids(self):
+        """Uuids of the groups the gadget of the op assigns contacts to."""
+        group_uuids = [
+            category.condition_arguments[0] for category in self.categories()
+        ]
+        group_assignment = self._config.get("group_assignment", "random")
+        if group_assignment == "always A":
+            return set(group_uuids[:1])
+        if group_assignment == "always B":
+            return set(group_uuids[1:2])
+        return set(group_uuids)
+
+    def _has_shared_assigntogroup_gadget(self, flow, report=True):
+        group_uuids = self._gadget_group_uuids()
+        # Shared gadgets are chained at the flow entry.
+        node = flow["nodes"][0]
+        visited = set()
+        while node is not None and node["uuid"] not in visited:
+            visited.add(node["uuid"])
+            gadget_groups = get_gadget_groups(node)
+            if gadget_groups is None:
+                return False
+            gadget_group_uuids, destination_uuid = gadget_groups
+            if gadget_group_uuids == group_uuids:
+                return True
+            if report and gadget_group_uuids & group_uuids:
+                logger.warning(
+                    self.debug_string()
+                    + 'Flow "{}" already assigns contacts to some '.format(flow["name"])
+                    + "of the groups of this operation with different groups."
+                )
+            node = find_node_by_uuid(flow, destination_uuid)
+        return False
+
+    def _insert_shared_assigntogroup_gadget(self, flow):
+        if self._has_shared_assigntogroup_gadget(flow):
+            return
+        entry_node = flow["nodes"][0]
+        gadget, gadget_layout = self._get_assigntogroup_gadget(entry_node)
+        if gadget is None:
+            return
+        flow["nodes"] = gadget + flow["nodes"]
+        if "_ui" not in flow:
+            return
+        # Place the gadget above the entry node
+        nodes_layout = NodesLayout(flow["_ui"]["nodes"])
+        entry_layout = nodes_layout.get_node(entry_node["uuid"])
+        if entry_layout is not None:
+            _, _, _, ymax = gadget_layout.bounding_box()
+            xcenter, _ = gadget_layout.center()
+            gadget_layout.shift(
+                entry_layout["position"]["left"] - xcenter,
+                entry_layout["position"]["top"] - ymax - NodesLayout.VERTICAL_MARGIN,
+            )
+        nodes_layout.layout().update(gadget_layout.layout())
+
     def _get_assigntogroup_snippet(self, node, node_layout):
+        if self._shares_group_assignment():
+            return self._get_noop_snippet(node, node_layout)
         gadget, gadget_layout = self._get_assigntogroup_gadget(node)
         if gadget is None:
             return self._get_noop_snippet(node, node_layout)
@@ -661,7 +894,36 @@ class FlowEditOp(GenericEditOp):
     def _get_noop_snippet(self, node, node_layout):
         return FlowSnippet([node], node_layout, [node], node, node["uuid"])
 
+    def _merge_identical_variations(self, input_node, node_variations, uuids):
+        """Keep only one of each set of identical variations, preferably
+        input_node, and route all categories of the set to it.
+
+        Returns:
+            the remaining variations and the updated destination uuids.
+        """
+
+        keys = [get_content_key(node) for node in node_variations]
+        representatives = dict()
+        for key, node in zip(keys, node_variations):
+            if key not in representatives or node is input_node:
+                representatives[key] = node
+        if len(representatives) == len(node_variations):
+            return node_variations, uuids
+        replacements = {
+            node["uuid"]: representatives[key]["uuid"]
+            for key, node in zip(keys, node_variations)
+        }
+        return (
+            [
+                node
+                for node in node_variations
+                if replacements[node["uuid"]] == node["uuid"]
+            ],
+            [replacements[uuid] for uuid in uuids],
+        )
+
     def _get_variation_tree_snippet(self, input_node, node_layout):
+        self._prepare_variations(input_node)
         node_variations = []
         for category in self.categories():
             node = get_unique_node_copy(input_node)
@@ -682,6 +944,9 @@ class FlowEditOp(GenericEditOp):
             destination_uuids = [node["uuid"] for node in node_variations] + [
                 node_variations[0]["uuid"]
             ]
+        node_variations, destination_uuids = self._merge_identical_variations(
+            input_node, node_variations, destination_uuids
+        )
 
         if len(node_variations) == 1:
             # If there is only one possible outcome -> unconditional replace
@@ -699,7 +964,7 @@ class FlowEditOp(GenericEditOp):
                 self.split_by, switch_node["uuid"], node_variations, node_layout
             )
 
-        if self.assign_to_group():
+        if self.assign_to_group() and not self._shares_group_assignment():
             gadget, gadget_layout = self._get_assigntogroup_gadget(first_node)
             if gadget is not None:
                 first_node = gadget[0]
@@ -720,6 +985,9 @@ class ReplaceSavedValueFlowEditOp(FlowEditOp):
     def is_match_for_node(self, node):
         return self._matches_save_value(node)
 
+    def find_matching_nodes(self, flow_index):
+        return self._find_save_value_nodes(flow_index)
+
     def _replace_content_in_node(self, node, text):
         action_index = self._matching_save_value_action_id(node)
         self._replace_saved_value(node, text, action_index)
@@ -736,6 +1004,21 @@ class AssignToGroupBeforeSaveValueNodeFlowEditOp(FlowEditOp):
     def is_match_for_node(self, node):
         return self._matches_save_value(node)
 
+    def find_matching_nodes(self, flow_index):
+        return self._find_save_value_nodes(flow_index)
+
+    def needs_group_assignment(self):
+        return True
+
+    def max_variations(self):
+        return 1
+
+    def max_added_nodes(self):
+        return self._max_gadget_size()
+
+    def fusion_key(self):
+        return None
+
     def _get_flow_snippet(self, node, node_layout=None):
         return self._get_assigntogroup_snippet(node, node_layout)
 
@@ -748,6 +1031,18 @@ class AssignToGroupBeforeMsgNodeFlowEditOp(FlowEditOp):
     def is_match_for_node(self, node):
         return self._matches_message_text(node)
 
+    def needs_group_assignment(self):
+        return True
+
+    def max_variations(self):
+        return 1
+
+    def max_added_nodes(self):
+        return self._max_gadget_size()
+
+    def fusion_key(self):
+        return None
+
     def _get_flow_snippet(self, node, node_layout=None):
         return self._get_assigntogroup_snippet(node, node_layout)
 
@@ -757,6 +1052,18 @@ class ReplaceBitOfTextFlowEditOp(FlowEditOp):
     def is_match_for_node(self, node):
         return self._matches_message_text(node)
 
+    def literal_text_to_replace_in_message(self):
+        return self._bit_of_text_pattern.literal()
+
+    def may_introduce_message_text(self, text):
+        if self.literal_text_to_replace_in_message() is None:
+            # A regex replacement may refer to the matched text
+            return True
+        return any(
+            can_create_occurrence(text, replacement)
+            for replacement in self._replacement_texts()
+        )
+
     def _replace_content_in_node(self, node, text):
         self._replace_text_in_message(node, text)
 
@@ -851,6 +1158,9 @@ class ReplaceWaitForResponseCasesFlowEditOp(FlowEditOp):
     def is_match_for_node(self, node):
         return self._matches_wait_for_response_cases(node)
 
+    def find_matching_nodes(self, flow_index):
+        return flow_index.nodes_by_wait_for_response_cases(self.node_identifier())
+
     def _replace_content_in_node(self, node, text):
         self._replace_wait_for_response_cases(node, text)
 
@@ -869,6 +1179,9 @@ class ReplaceSplitOperandFlowEditOp(FlowEditOp):
     def is_match_for_node(self, node):
         return self._matches_switch_router_identifier(node)
 
+    def find_matching_nodes(self, flow_index):
+        return flow_index.nodes_by_switch_router(self.node_identifier())
+
     def _replace_content_in_node(self, node, text):
         self._replace_switch_router_operand(node, text)
 
@@ -884,6 +1197,9 @@ class PrependSendMsgActionFlowEditOp(FlowEditOp):
     def is_match_for_node(self, node):
         return self._matches_message_text(node)
 
+    def may_introduce_message_text(self, text):
+        return any(text in replacement for replacement in self._replacement_texts())
+
     def _replace_content_in_node(self, node, text):
         self._prepend_send_msg_action(node, text)
 
@@ -899,6 +1215,12 @@ class PrependSendMsgActionToSaveValueNodeFlowEditOp(FlowEditOp):
     def is_match_for_node(self, node):
         return self._matches_save_value(node)
 
+    def find_matching_nodes(self, flow_index):
+        return self._find_save_value_nodes(flow_index)
+
+    def may_introduce_message_text(self, text):
+        return any(text in replacement for replacement in self._replacement_texts())
+
     def _replace_content_in_node(self, node, text):
         self._prepend_send_msg_action(node, text)
 
@@ -906,6 +1228,104 @@ class PrependSendMsgActionToSaveValueNodeFlowEditOp(FlowEditOp):
         return self._get_variation_tree_snippet(node, node_layout)
 
 
+class FusedFlowEditOp(FlowEditOp):
+    """Multiple ops applied to the same node that split by the same operand
+    into the same categories, combined into a single op.
+
+    Instead of nesting a switch for each op in front of each variation
+    of the previous ops, which results in exponentially many nodes,
+    a single switch is created with one variation per category, to which
+    the replacements of all ops for that category are applied in order.
+
+    The replacement texts of the categories and the default text are
+    tuples with one entry per op.
+    """
+
+    def __init__(self, edit_ops):
+        first_op = edit_ops[0]
+        # The flow, node and text the fused op matches are those of the first op.
+        flow_id = first_op.flow_id()
+        if not first_op.matches_unique_flow():
+            flow_id = REGEX_PREFIX + flow_id
+        node_identifier = first_op.node_identifier()
+        if not first_op.matches_unique_node_identifier():
+            node_identifier = REGEX_PREFIX + node_identifier
+        super().__init__(
+            flow_id,
+            first_op.row_id(),
+            node_identifier,
+            first_op.bit_of_text(),
+            first_op.split_by(),
+            tuple(edit_op.default_text() for edit_op in edit_ops),
+            first_op.debug_string(),
+            first_op.has_node_for_other_category(),
+            first_op.assign_to_group(),
+            config=first_op._config,
+        )
+        self._edit_ops = edit_ops
+        for i, category in enumerate(first_op.categories()):
+            fused_category = copy.copy(category)
+            fused_category.replacement_text = tuple(
+                edit_op.categories()[i].replacement_text for edit_op in edit_ops
+            )
+            self._categories.append(fused_category)
+
+    def edit_ops(self):
+        return self._edit_ops
+
+    def is_match_for_node(self, node):
+        return self._edit_ops[0].is_match_for_node(node)
+
+    def _prepare_variations(self, input_node):
+        for edit_op in self._edit_ops:
+            edit_op._prepare_variations(input_node)
+
+    def _set_reported_occurrences(self, reported_occurrences):
+        for edit_op in self._edit_ops:
+            edit_op._set_reported_occurrences(reported_occurrences)
+
+    def _replace_content_in_node(self, node, texts):
+        for edit_op, text in zip(self._edit_ops, texts):
+            edit_op._replace_content_in_node(node, text)
+
+    def _get_flow_snippet(self, node, node_layout=None):
+        return self._get_variation_tree_snippet(node, node_layout)
+
+
+def fuse_edit_ops(edit_ops):
+    """Fuse consecutive ops with the same split and categories.
+
+    Applying the fused op to a node is equivalent to applying the ops
+    in sequence, because all switches of the ops would evaluate the same
+    operand and thus take the same category. An op assigning to groups
+    is not fused into preceding ops that don't, because its group assignment
+    has to precede the switch.
+
+    Args:
+        edit_ops: list of ops to be applied in order to a node.
+
+    Returns:
+        list of ops, where ops that can be fused are replaced by
+        a `FusedFlowEditOp`.
+    """
+
+    groups = []
+    for edit_op in edit_ops:
+        key = edit_op.fusion_key() if isinstance(edit_op, FlowEditOp) else None
+        if (
+            key is not None
+            and groups
+            and groups[-1][0] == key
+            and (not edit_op.assign_to_group() or groups[-1][1][0].assign_to_group())
+        ):
+            groups[-1][1].append(edit_op)
+        else:
+            groups.append((key, [edit_op]))
+    return [
+        FusedFlowEditOp(group) if len(group) > 1 else group[0] for _, group in groups
+    ]
+
+
 # In the future, each class has an ID string, and the dict is autogenerated?
 FLOWEDIT_OPERATION_TYPES = {
     "replace_bit_of_text": ReplaceBitOfTextFlowEditOp,
@@ -933,20 +1353,66 @@ def get_regex_pattern(string):
     return None
 
 
+def normalize_whitespace(text):
+    """Replace groups of whitespace with a single space and strip whitespace
+    from the beginning and end of the text."""
+    return WHITESPACE_REGEX.sub(" ", text).strip()
+
+
+class TextPattern(object):
+    """A bit of text to be found/replaced, either a literal string or
+    a regular expression (if prefixed with "regex:"), compiled once.
+
+    Args:
+        string (str): the bit of text
+        budget (`TimeBudget`): limits the time the regular expression may take.
+    """
+
+    def __init__(self, string, budget=None):
+        self._string = string
+        pattern = get_regex_pattern(string)
+        self._regex = BudgetedRegex(pattern, budget=budget) if pattern else None
+
+    def literal(self):
+        """The string to find if it is not a regex and not empty, else None."""
+        if self._regex is None and self._string:
+            return self._string
+        return None
+
+    def count(self, text):
+        if self._regex is not None:
+            return self._regex.count(text)
+        return text.count(self._string)
+
+    def replace(self, text, replacement):
+        return self.subn(replacement, text)[0]
+
+    def subn(self, replacement, text):
+        """Replace all occurrences in a single pass.
+
+        Returns:
+            (new text, number of occurrences replaced)
+        """
+
+        if self._regex is not None:
+            return self._regex.subn(replacement, text)
+        if not self._string:
+            return text.replace(self._string, replacement), text.count(self._string)
+        parts = text.split(self._string)
+        return replacement.join(parts), len(parts) - 1
+
+
+@functools.lru_cache(maxsize=4096)
+def get_text_pattern(string):
+    return TextPattern(string)
+
+
 def count(text, string):
-    pattern = get_regex_pattern(string)
-    if pattern:
-        return len(re.findall(pattern, text))
-    else:
-        return text.count(string)
+    return get_text_pattern(string).count(text)
 
 
 def replace(text, string, replacement):
-    pattern = get_regex_pattern(string)
-    if pattern:
-        return re.sub(pattern, replacement, text)
-    else:
-        return text.replace(string, replacement)
+    return get_text_pattern(string).replace(text, replacement)
 
 
 class TranslationEditOp(GenericEditOp):
@@ -987,20 +1453,21 @@ class TranslationEditOp(GenericEditOp):
     def _replace_translation(self, localization, node):
         pass
 
-    def apply_operation(self, flow, node):
+    def apply_operation(self, flow, node, reported_occurrences=None):
         localization = flow.get("localization", {}).get(self._language)
         if not localization:
             logger.warning(
                 f'{self._debug_string} Flow {flow["name"]} has no localization for'
                 f' language {self._language}.'
             )
-            [node]
+            return [node]
 
         self._replace_translation(localization, node)
         return [node]
 
     def _replace_text_in_message(self, localization, node):
         total_occurrences = 0
+        new_texts = []
         for action in node["actions"]:
             if action["type"] == "send_msg":
                 tr_action = localization.get(action["uuid"])
@@ -1016,12 +1483,16 @@ class TranslationEditOp(GenericEditOp):
                         + f'Translation of action "{action["uuid"]}" has no text.'
                     )
                     continue
-                text = tr_action["text"][
-                    0
-                ]  # not sure why in translations the text is a list.
-                total_occurrences += count(text, self.bit_of_text())
-                text_new = replace(text, self.bit_of_text(), self.default_text())
-                tr_action["text"][0] = text_new
+                # not sure why in translations the text is a list.
+                text, occurrences = self._bit_of_text_pattern.subn(
+                    self.default_text(), tr_action["text"][0]
+                )
+                new_texts.append((tr_action, text))
+                total_occurrences += occurrences
+        # Only modify the translations once all replacements succeeded,
+        # as matching a regex may time out.
+        for tr_action, text in new_texts:
+            tr_action["text"][0] = text
 
         if total_occurrences == 0:
             # This might happen if we're trying to replace text that has
@@ -1041,9 +1512,13 @@ class TranslationEditOp(GenericEditOp):
             )
 
     def _replace_in_action_list_field(self, localization, node, action_field):
+        # Replace in copies of the lists and only modify the translations once
+        # all replacements succeeded, as matching a regex may time out.
+        new_lists = dict()
         for bit_of_text, repl_text in zip(
             self.bit_of_text().split(";"), self.default_text().split(";")
         ):
+            pattern = self._text_pattern(bit_of_text)
             total_occurrences = 0
             for action in node["actions"]:
                 if action["type"] == "send_msg":
@@ -1060,10 +1535,15 @@ class TranslationEditOp(GenericEditOp):
                             f' "{action["uuid"]}" has no {action_field}.'
                         )
                         continue
-                    for i, text in enumerate(tr_action[action_field]):
-                        total_occurrences += count(text, bit_of_text)
-                        text_new = replace(text, bit_of_text, repl_text)
-                        tr_action[action_field][i] = text_new
+                    if action["uuid"] not in new_lists:
+                        new_lists[action["uuid"]] = (
+                            tr_action,
+                            list(tr_action[action_field]),
+                        )
+                    new_list = new_lists[action["uuid"]][1]
+                    for i, text in enumerate(new_list):
+                        new_list[i], occurrences = pattern.subn(repl_text, text)
+                        total_occurrences += occurrences
             if total_occurrences == 0:
                 logger.warning(
                     self.debug_string()
@@ -1078,6 +1558,8 @@ class TranslationEditOp(GenericEditOp):
                         bit_of_text
                     )
                 )
+        for tr_action, new_list in new_lists.values():
+            tr_action[action_field] = new_list
 
     def _replace_text_in_quick_replies(self, localization, node):
         self._replace_in_action_list_field(localization, node, "quick_replies")
@@ -1195,6 +1677,9 @@ class ReplaceWaitForResponseCasesTranslationEditOp(TranslationEditOp):
     def is_match_for_node(self, node):
         return self._matches_wait_for_response_cases(node)
 
+    def find_matching_nodes(self, flow_index):
+        return flow_index.nodes_by_wait_for_response_cases(self.node_identifier())
+
     def _replace_translation(self, localization, node):
         self._replace_wait_for_response_cases(localization, node)
 
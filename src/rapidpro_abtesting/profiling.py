@@ -0,0 +1,187 @@
+import json
+import logging
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+logger = logging.getLogger(__name__)
+
+
+class PhaseProfiler(object):
+    """Measures wall time and, optionally, memory usage of pipeline phases.
+
+    Phases are entered with the `phase` context manager and may be nested.
+    If memory tracing is enabled, tracemalloc is used to record for each phase
+    the peak traced memory, the memory retained after the phase has finished,
+    and the source lines that allocated the most retained memory.
+    Tracing starts when the profiler is created and lasts until `stop` is
+    called, so the peak of a phase includes the memory allocated before it
+    (e.g. the loaded input), while the increase of the peak is per phase.
+
+    Note: Resetting the peak between phases requires Python 3.9. On older
+    versions, the reported peak is the peak since tracing started.
+
+    Args:
+        trace_memory (bool): Record memory usage using tracemalloc.
+        top_sites (int): Number of top allocation sites to report per phase.
+    """
+
+    def __init__(self, trace_memory=False, top_sites=10):
+        self._trace_memory = trace_memory
+        self._top_sites = top_sites
+        self._phases = []
+        self._stack = []
+        self._started_tracing = False
+        if trace_memory:
+            self._start_tracing()
+
+    def _start_tracing(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+    def stop(self):
+        """Stop memory tracing if it was started by this profiler."""
+
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    @contextmanager
+    def phase(self, name):
+        record = {"name": name, "depth": len(self._stack)}
+        self._phases.append(record)
+        if self._trace_memory:
+            self._enter_memory_phase(record)
+        self._stack.append(record)
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["seconds"] = time.perf_counter() - start
+            self._stack.pop()
+            if self._trace_memory:
+                self._exit_memory_phase(record)
+
+    def _enter_memory_phase(self, record):
+        self._start_tracing()
+        current, peak = tracemalloc.get_traced_memory()
+        if self._stack:
+            # Remember the parent's peak before it gets reset for this phase
+            parent = self._stack[-1]
+            parent["_peak"] = max(parent["_peak"], peak)
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        record["_start"] = current
+        record["_peak"] = current
+        if self._top_sites:
+            record["_snapshot"] = _take_snapshot()
+
+    def _exit_memory_phase(self, record):
+        current, peak = tracemalloc.get_traced_memory()
+        peak = max(record.pop("_peak"), peak)
+        start = record.pop("_start")
+        record["peak_bytes"] = peak
+        record["peak_increase_bytes"] = peak - start
+        record["retained_bytes"] = current - start
+        if self._stack:
+            parent = self._stack[-1]
+            parent["_peak"] = max(parent["_peak"], peak)
+        snapshot = record.pop("_snapshot", None)
+        if snapshot is not None:
+            stats = _take_snapshot().compare_to(snapshot, "lineno")
+            record["top_allocations"] = [
+                {
+                    "site": "{}:{}".format(
+                        stat.traceback[0].filename, stat.traceback[0].lineno
+                    ),
+                    "size_diff_bytes": stat.size_diff,
+                    "count_diff": stat.count_diff,
+                }
+                for stat in stats[: self._top_sites]
+            ]
+
+    def phases(self):
+        return self._phases
+
+    def summary(self):
+        """Aggregate phases with the same name.
+
+        Returns:
+            dict mapping phase names to the total time spent in the phase,
+            the number of times it was entered, and (if memory is traced)
+            the maximum peak and total retained memory.
+        """
+
+        summary = dict()
+        for record in self._phases:
+            entry = summary.setdefault(record["name"], {"calls": 0, "seconds": 0.0})
+            entry["calls"] += 1
+            entry["seconds"] += record.get("seconds", 0.0)
+            if "peak_bytes" in record:
+                entry["peak_bytes"] = max(
+                    entry.get("peak_bytes", 0), record["peak_bytes"]
+                )
+                entry["retained_bytes"] = (
+                    entry.get("retained_bytes", 0) + record["retained_bytes"]
+                )
+        return summary
+
+    def report(self):
+        return {"phases": self._phases, "summary": self.summary()}
+
+    def export_to_json(self, filename):
+        with open(filename, "w") as fout:
+            json.dump(self.report(), fout, indent=2)
+
+    def memory_regressions(self, baseline, tolerance=0.1, max_peak_bytes=None):
+        """Compare the peak memory of each phase against a baseline.
+
+        Args:
+            baseline (dict): report (as produced by `report`) of an earlier run.
+                May be None to only check max_peak_bytes.
+            tolerance (float): relative increase of the peak that is accepted.
+            max_peak_bytes (int): absolute limit for the peak of any phase.
+
+        Returns:
+            list of str: description of each phase that exceeds its budget.
+        """
+
+        regressions = []
+        baseline_summary = (baseline or {}).get("summary", {})
+        for name, entry in self.summary().items():
+            if "peak_bytes" not in entry:
+                continue
+            peak = entry["peak_bytes"]
+            if max_peak_bytes is not None and peak > max_peak_bytes:
+                regressions.append(
+                    "Phase {}: peak {} bytes exceeds limit of {} bytes.".format(
+                        name, peak, max_peak_bytes
+                    )
+                )
+            baseline_peak = baseline_summary.get(name, {}).get("peak_bytes")
+            if baseline_peak is not None and peak > baseline_peak * (1 + tolerance):
+                regressions.append(
+                    "Phase {}: peak {} bytes exceeds baseline of {} bytes by more"
+                    " than {:.0%}.".format(name, peak, baseline_peak, tolerance)
+                )
+        return regressions
+
+
+class NullProfiler(object):
+    """Profiler that does not record anything."""
+
+    @contextmanager
+    def phase(self, name):
+        yield None
+
+
+def _take_snapshot():
+    snapshot = tracemalloc.take_snapshot()
+    return snapshot.filter_traces(
+        [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        ]
+    )
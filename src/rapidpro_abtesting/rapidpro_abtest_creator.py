@@ -1,9 +1,19 @@
 import json
 import copy
+import hashlib
 import logging
+import math
 from collections import defaultdict
+from .flow_index import FlowIndex
 from .uuid_tools import UUIDLookup
 from .nodes_layout import normalize_flow_layout
+from .node_tools import remove_unreachable_nodes
+from .operations import fuse_edit_ops
+from .profiling import NullProfiler
+from .redundant_switches import bypass_redundant_switches
+from .regex_tools import RegexTimeoutError
+from .text_matcher import MultiPatternMatcher
+from .validation import validate_rapidpro_data
 
 
 logger = logging.getLogger(__name__)
@@ -33,25 +43,119 @@ class RapidProABTestCreator(object):
     - No ui_ output yet, RapidPro will lay it out in a single column.
     """
 
-    def __init__(self, json_filename):
+    def __init__(
+        self,
+        json_filename,
+        profiler=None,
+        track_changes=False,
+        max_node_expansion=None,
+        max_flow_growth=None,
+    ):
         """Args:
         json_filename (str): Filename of the RapidPro json to be processed.
+        profiler (`PhaseProfiler`): Records time/memory usage of the phases.
+        track_changes (bool): Remember the input flows and groups, so that
+            only the changes can be exported with `export_delta_to_json`.
+        max_node_expansion (int): Maximum number of nodes that the edits
+            of a single node may turn it into.
+        max_flow_growth (float): Maximum factor by which the edits may grow
+            the number of nodes of a flow.
+
+        The edits of a node that would exceed either limit are skipped.
         """
 
+        self._profiler = profiler or NullProfiler()
         # data_ (dict): data loaded from RapidPro json. Nested dictionary.
-        with open(json_filename, "r", encoding="utf-8") as file:
-            self._data = json.load(file)
+        with self._profiler.phase("load_input"):
+            with open(json_filename, "r", encoding="utf-8") as file:
+                data = json.load(file)
+        self._setup(data, track_changes, max_node_expansion, max_flow_growth)
+
+    @classmethod
+    def from_data(
+        cls,
+        data,
+        profiler=None,
+        track_changes=False,
+        max_node_expansion=None,
+        max_flow_growth=None,
+    ):
+        """Create a creator for RapidPro data that has already been loaded,
+        e.g. to process the same input several times without reading it again.
+
+        The data is modified in place, so pass a copy to keep the original.
+        See the constructor for the other arguments.
+        """
 
+        creator = cls.__new__(cls)
+        creator._profiler = profiler or NullProfiler()
+        creator._setup(data, track_changes, max_node_expansion, max_flow_growth)
+        return creator
+
+    def _setup(self, data, track_changes, max_node_expansion, max_flow_growth):
+        self._data = data
         self._uuid_lookup = UUIDLookup()
+        # Flows by name, and the flows matching each regex flow_id of an op
+        self._flows_by_name = defaultdict(list)
+        self._flows_by_pattern = dict()
         for flow in self._data["flows"]:
             self._uuid_lookup.add_flow(flow["name"], flow["uuid"])
+            self._flows_by_name[flow["name"]].append(flow)
         for group in self._data["groups"]:
             self._uuid_lookup.add_group(group["name"], group["uuid"])
+        # Uuids of the flows in which edit ops were applied to nodes
+        self._edited_flow_uuids = set()
+        # Uuids of the flows edit ops may be applied to. None for all flows.
+        self._editable_flow_uuids = None
+
+        self._max_node_expansion = max_node_expansion
+        self._max_flow_growth = max_flow_growth
+        self._input_node_counts = {
+            flow["uuid"]: len(flow["nodes"]) for flow in self._data["flows"]
+        }
+        self._skipped_nodes = []
+
+        # Structural hashes of the input flows by flow uuid, and the
+        # (uuid, name) of the input groups
+        self._input_flow_hashes = None
+        self._input_groups = None
+        if track_changes:
+            with self._profiler.phase("hash_input"):
+                self._input_flow_hashes = {
+                    flow["uuid"]: structural_hash(flow) for flow in self._data["flows"]
+                }
+                self._input_groups = {
+                    (group["uuid"], group["name"]) for group in self._data["groups"]
+                }
 
     def get_uuid_lookup(self):
         return self._uuid_lookup
 
-    def _find_matching_nodes(self, edit_op):
+    def get_flows(self):
+        return self._data["flows"]
+
+    def get_data(self):
+        return self._data
+
+    def restrict_edits_to_flows(self, flow_uuids):
+        """Only apply edit ops to the flows with the given uuids, e.g. because
+        the other flows already contain the edits. Ops that only match other
+        flows are skipped without warnings."""
+        self._editable_flow_uuids = set(flow_uuids)
+
+    def _only_matches_uneditable_flows(self, edit_op):
+        if self._editable_flow_uuids is None:
+            return False
+        flows = self._find_matching_flows(edit_op)
+        return bool(flows) and not any(map(self._is_editable, flows))
+
+    def _is_editable(self, flow):
+        return (
+            self._editable_flow_uuids is None
+            or flow["uuid"] in self._editable_flow_uuids
+        )
+
+    def _find_matching_nodes(self, edit_op, flow_indices=None):
         """
         Go through entire data to find nodes matching the specifications.
 
@@ -59,65 +163,372 @@ class RapidProABTestCreator(object):
 
         Args:
             edit_op:
+            flow_indices (dict): `FlowIndex` of each flow (by uuid) to reuse
+                across ops. Missing indices are added.
         """
+        if flow_indices is None:
+            flow_indices = dict()
         results = []
-        node_flows = []
-        for flow in self._data["flows"]:
-            if edit_op.is_match_for_flow(flow["name"]):
-                node_flows.append(flow)
+        node_flows = self._find_matching_flows(edit_op)
         if not node_flows:
             logger.warning(
                 edit_op.debug_string()
                 + 'No flow that matches "{}" found.'.format(edit_op.flow_id())
             )
             return []
-        for node_flow in node_flows:
-            for node in node_flow["nodes"]:
-                if edit_op.is_match_for_node(node):
-                    if not node["uuid"] in results:  # only need one instance per node
-                        results.append(node["uuid"])
+        found_uuids = set()
+        for node_flow in filter(self._is_editable, node_flows):
+            flow_index = flow_indices.get(node_flow["uuid"])
+            if flow_index is None:
+                flow_index = FlowIndex(node_flow)
+                flow_indices[node_flow["uuid"]] = flow_index
+            for node in edit_op.find_matching_nodes(flow_index):
+                if node["uuid"] not in found_uuids:  # only need one instance per node
+                    found_uuids.add(node["uuid"])
+                    results.append(node["uuid"])
         return results
 
+    def _find_matching_flows(self, edit_op):
+        """Returns the flows matching the flow_id of edit_op.
+
+        Each distinct regex flow_id is only matched against the flow names once.
+        """
+
+        if edit_op.matches_unique_flow():
+            return self._flows_by_name.get(edit_op.flow_id(), [])
+        pattern = edit_op.flow_id()
+        if pattern not in self._flows_by_pattern:
+            names = {
+                name for name in self._flows_by_name if edit_op.is_match_for_flow(name)
+            }
+            self._flows_by_pattern[pattern] = [
+                flow for flow in self._data["flows"] if flow["name"] in names
+            ]
+        return self._flows_by_pattern[pattern]
+
     def get_edit_ops_by_node(self, editsheets):
         # Returns:
         #     Dictionary mapping each node (indexed by uuid) to the list of
-        #     `FlowEditOp`s that should be applied to the node.
+        #     `FlowEditOp`s that should be applied to the node, and dictionary
+        #     mapping each node to the reported occurrences of the texts its ops
+        #     replace (see `_report_text_occurrences`).
+        with self._profiler.phase("parse_rows"):
+            for sheet in editsheets:
+                sheet.parse_rows(self._uuid_lookup)
+        with self._profiler.phase("match_nodes"):
+            _, edit_ops_by_node, occurrences = self._match_edit_ops(editsheets)
+            reported_occurrences = self._report_text_occurrences(
+                occurrences, edit_ops_by_node
+            )
+            return edit_ops_by_node, reported_occurrences
+
+    def _match_edit_ops(self, editsheets):
+        """Find the nodes of the ops of editsheets, and count the occurrences
+        of the texts they replace in these nodes.
+
+        Returns:
+            (matches, edit_ops_by_node, occurrences): the result of
+            `_find_nodes_of_edit_ops`, the list of ops to apply to each node
+            by uuid, and the result of `_count_text_occurrences`.
+        """
+
+        matches = self._find_nodes_of_edit_ops(editsheets)
         edit_ops_by_node = defaultdict(list)
-        # Find nodes affected by operations in some way
+        # Ops replacing literal text in messages, with the uuids of their nodes
+        text_edit_ops = []
+        for edit_op, uuids in matches:
+            for uuid in uuids or []:
+                edit_ops_by_node[uuid].append(edit_op)
+            if uuids and edit_op.literal_text_to_replace_in_message():
+                text_edit_ops.append((edit_op, uuids))
+        occurrences = self._count_text_occurrences(text_edit_ops)
+        return matches, edit_ops_by_node, occurrences
+
+    def _find_nodes_of_edit_ops(self, editsheets, report=True):
+        """Find the nodes affected by the ops of editsheets in some way.
+
+        Args:
+            report (bool): Warn about ops matching no or multiple nodes.
+
+        Returns:
+            list of (edit_op, list of node uuids) for each op, in sheet order.
+            The uuids are None if matching the op timed out.
+        """
+
+        results = []
+        # The flows are not modified while matching, so indices can be shared.
+        flow_indices = dict()
         for sheet in editsheets:
-            sheet.parse_rows(self._uuid_lookup)
             for edit_op in sheet.edit_ops():
-                uuids = self._find_matching_nodes(edit_op)
-                if len(uuids) == 0:
+                try:
+                    if self._only_matches_uneditable_flows(edit_op):
+                        continue
+                    uuids = self._find_matching_nodes(edit_op, flow_indices)
+                except RegexTimeoutError as error:
+                    logger.warning(
+                        edit_op.debug_string() + str(error) + " Skipping operation."
+                    )
+                    results.append((edit_op, None))
+                    continue
+                if report:
+                    self._report_matching_nodes(edit_op, uuids)
+                results.append((edit_op, uuids))
+        return results
+
+    def _report_matching_nodes(self, edit_op, uuids):
+        if len(uuids) == 0:
+            logger.warning(
+                edit_op.debug_string() + "No node found where operation is applicable."
+            )
+        if (
+            len(uuids) >= 2
+            and edit_op.matches_unique_flow()
+            and edit_op.matches_unique_node_identifier()
+        ):
+            logger.warning(
+                edit_op.debug_string()
+                + "Multiple nodes found where operation is applicable."
+            )
+
+    def find_affected_nodes(self, editsheets):
+        """Uuids of the nodes the ops of editsheets would be applied to,
+        without applying them. Matching problems are not reported.
+
+        If matching an op times out, all nodes of its flows are included.
+        """
+
+        for sheet in editsheets:
+            sheet.parse_rows(self._uuid_lookup)
+        node_uuids = set()
+        for edit_op, uuids in self._find_nodes_of_edit_ops(editsheets, report=False):
+            if uuids is None:
+                for flow in self._find_matching_flows(edit_op):
+                    node_uuids.update(node["uuid"] for node in flow["nodes"])
+            else:
+                node_uuids.update(uuids)
+        return node_uuids
+
+    def plan_editsheets(self, editsheets):
+        """Report which nodes the ops of editsheets would be applied to,
+        without applying them. Only the rows are parsed and matched,
+        the flows are not modified.
+
+        Returns:
+            dict with the keys
+            "operations": for each op, its type, flow_id, node_identifier and
+                the matched "nodes" (dicts with "flow", "node" and, for ops
+                replacing text, the "occurrences" of the text in the node).
+            "collisions": nodes matched by multiple ops, with the ops and the
+                predicted number of nodes the node expands into.
+            "unmatched": ops that match no node.
+        """
+
+        with self._profiler.phase("parse_rows"):
+            for sheet in editsheets:
+                sheet.parse_rows(self._uuid_lookup)
+        with self._profiler.phase("match_nodes"):
+            matches, edit_ops_by_node, occurrences = self._match_edit_ops(editsheets)
+            self._report_text_occurrences(occurrences, edit_ops_by_node)
+
+        with self._profiler.phase("plan"):
+            matched_uuids = {uuid for _, uuids in matches for uuid in uuids or []}
+            flow_names = {
+                node["uuid"]: flow["name"]
+                for flow in self._data["flows"]
+                for node in flow["nodes"]
+                if node["uuid"] in matched_uuids
+            }
+            operations = []
+            unmatched = []
+            for edit_op, uuids in matches:
+                operation = {
+                    "operation": _describe_edit_op(edit_op),
+                    "type": _edit_op_type(edit_op),
+                    "flow_id": edit_op.flow_id(),
+                    "node_identifier": edit_op.node_identifier(),
+                    "nodes": [],
+                }
+                if uuids is None:
+                    operation["error"] = "Matching timed out."
+                for uuid in uuids or []:
+                    node = {"flow": flow_names[uuid], "node": uuid}
+                    if edit_op.literal_text_to_replace_in_message():
+                        node["occurrences"] = occurrences[uuid][edit_op]
+                    operation["nodes"].append(node)
+                operations.append(operation)
+                if not uuids:
+                    unmatched.append(_describe_edit_op(edit_op))
+
+            collisions = [
+                {
+                    "flow": flow_names[uuid],
+                    "node": uuid,
+                    "operations": [_describe_edit_op(edit_op) for edit_op in edit_ops],
+                    "expansion": predict_node_expansion(edit_ops),
+                }
+                for uuid, edit_ops in edit_ops_by_node.items()
+                if len(edit_ops) >= 2
+            ]
+        return {
+            "operations": operations,
+            "collisions": collisions,
+            "unmatched": unmatched,
+        }
+
+    def _count_text_occurrences(self, text_edit_ops):
+        """Count the occurrences of the text each op replaces in each of its
+        matching input nodes.
+
+        Instead of searching each node once per op, all texts are searched for
+        at once, so each node is only scanned once.
+
+        Args:
+            text_edit_ops: list of (edit_op, list of node uuids)
+
+        Returns:
+            dict mapping node uuids to the number of occurrences by op.
+        """
+
+        occurrences = defaultdict(dict)
+        if not text_edit_ops:
+            return occurrences
+        matcher = MultiPatternMatcher(
+            edit_op.literal_text_to_replace_in_message() for edit_op, _ in text_edit_ops
+        )
+        node_uuids = {uuid for _, uuids in text_edit_ops for uuid in uuids}
+        counts_by_node = dict()
+        for flow in self._data["flows"]:
+            for node in flow["nodes"]:
+                if node["uuid"] not in node_uuids:
+                    continue
+                counts = [0] * len(text_edit_ops)
+                for action in node["actions"]:
+                    if action["type"] == "send_msg":
+                        matcher.count_occurrences(action["text"], counts)
+                counts_by_node[node["uuid"]] = counts
+
+        for index, (edit_op, uuids) in enumerate(text_edit_ops):
+            for uuid in uuids:
+                occurrences[uuid][edit_op] = counts_by_node[uuid][index]
+        return occurrences
+
+    def _report_text_occurrences(self, occurrences, edit_ops_by_node):
+        """Report the occurrences of the text each op replaces in its input
+        nodes (see `_count_text_occurrences`).
+
+        If an op applied to the node before may create occurrences of the text,
+        the input node does not show the text the op will see. These
+        occurrences are reported when the op is applied instead.
+
+        Returns:
+            dict mapping node uuids to the reported occurrences by op.
+        """
+
+        reported_occurrences = defaultdict(dict)
+        for uuid, counts in occurrences.items():
+            edit_ops = edit_ops_by_node[uuid]
+            for edit_op, count in counts.items():
+                text = edit_op.literal_text_to_replace_in_message()
+                previous_ops = edit_ops[: edit_ops.index(edit_op)]
+                if any(op.may_introduce_message_text(text) for op in previous_ops):
+                    continue
+                reported_occurrences[uuid][edit_op] = count
+                if count == 0:
                     logger.warning(
                         edit_op.debug_string()
-                        + "No node found where operation is applicable."
+                        + 'No occurrences of "{}" found in node {}.'.format(
+                            edit_op.bit_of_text(), uuid
+                        )
                     )
-                if (
-                    len(uuids) >= 2
-                    and edit_op.matches_unique_flow()
-                    and edit_op.matches_unique_node_identifier()
-                ):
+                elif count >= 2:
                     logger.warning(
                         edit_op.debug_string()
-                        + "Multiple nodes found where operation is applicable."
+                        + 'Multiple occurrences of "{}" found in node {}.'.format(
+                            edit_op.bit_of_text(), uuid
+                        )
                     )
-                for uuid in uuids:
-                    edit_ops_by_node[uuid].append(edit_op)
-        return edit_ops_by_node
+        return reported_occurrences
 
     def apply_editsheets(self, editsheets, normalize_layout=False):
-        edit_ops_by_node = self.get_edit_ops_by_node(editsheets)
-        # For each nodes affected by A/B tests, apply the test operations
-        for flow in self._data["flows"]:
-            # Iterate over copy of node list because the real list of nodes
-            # is modified in the process.
-            for node in copy.copy(flow["nodes"]):
-                if node["uuid"] in edit_ops_by_node:
-                    edit_ops = edit_ops_by_node[node["uuid"]]
-                    apply_editops_to_node(flow, node, edit_ops)
-            # Make sure all flow nodes have positive coordinates
-            normalize_flow_layout(flow)
+        edit_ops_by_node, reported_occurrences = self.get_edit_ops_by_node(
+            editsheets
+        )
+        with self._profiler.phase("apply_edits"):
+            # For each nodes affected by A/B tests, apply the test operations
+            for flow in filter(self._is_editable, self._data["flows"]):
+                # Iterate over copy of node list because the real list of nodes
+                # is modified in the process.
+                for node in copy.copy(flow["nodes"]):
+                    if node["uuid"] in edit_ops_by_node:
+                        edit_ops = edit_ops_by_node[node["uuid"]]
+                        if not self._is_within_growth_budget(flow, node, edit_ops):
+                            continue
+                        apply_editops_to_node(
+                            flow, node, edit_ops, reported_occurrences.get(node["uuid"])
+                        )
+                        self._edited_flow_uuids.add(flow["uuid"])
+                # Make sure all flow nodes have positive coordinates
+                normalize_flow_layout(flow)
+
+    def _is_within_growth_budget(self, flow, node, edit_ops):
+        """Check that applying edit_ops to node does not exceed the limits
+        on the growth of the node and the flow. Otherwise, log the ops
+        responsible and record the node as skipped."""
+
+        if self._max_node_expansion is None and self._max_flow_growth is None:
+            return True
+        expansion = predict_node_expansion(edit_ops)
+        exceeded = []
+        if self._max_node_expansion is not None:
+            if expansion > self._max_node_expansion:
+                exceeded.append(
+                    "the node expansion limit of {}".format(self._max_node_expansion)
+                )
+        if self._max_flow_growth is not None:
+            input_count = self._input_node_counts.get(flow["uuid"], len(flow["nodes"]))
+            max_count = self._max_flow_growth * input_count
+            # Gadgets shared by the ops are inserted once at the flow entry
+            shared_gadgets = dict(
+                gadget
+                for gadget in map(lambda op: op.missing_shared_gadget(flow), edit_ops)
+                if gadget is not None
+            )
+            n_nodes = len(flow["nodes"]) - 1 + expansion + sum(shared_gadgets.values())
+            if n_nodes > max_count:
+                exceeded.append(
+                    "the flow size limit of {} nodes".format(math.floor(max_count))
+                )
+        if not exceeded:
+            return True
+
+        logger.warning(
+            'Skipping the edits of node {} of flow "{}": '.format(
+                node["uuid"], flow["name"]
+            )
+            + "It would expand into up to {} nodes, exceeding {}. ".format(
+                expansion, " and ".join(exceeded)
+            )
+            + "Variations per operation: "
+            + ", ".join(
+                "{}{}".format(edit_op.debug_string(), edit_op.max_variations())
+                for edit_op in edit_ops
+            )
+        )
+        self._skipped_nodes.append(
+            {
+                "flow": flow["name"],
+                "node": node["uuid"],
+                "expansion": expansion,
+                "operations": [edit_op.debug_string() for edit_op in edit_ops],
+            }
+        )
+        return False
+
+    def skipped_nodes(self):
+        """Nodes whose edits were skipped because of the growth limits,
+        as a list of dicts with the keys "flow", "node", "expansion"
+        (predicted number of nodes) and "operations"."""
+        return self._skipped_nodes
 
     def apply_abtests(self, floweditsheets):
         """Modify the internal RapidPro flow data by apply the A/B tests."""
@@ -129,16 +540,160 @@ class RapidProABTestCreator(object):
         for group in self._uuid_lookup.all_groups():
             self._data["groups"].append(group.to_json_group())
 
+    def remove_unreachable_nodes(self):
+        """Remove the nodes of the edited flows that cannot be reached from
+        the flow entry, e.g. nodes that edits have made obsolete, together
+        with their layout and translations. Flows without edits are kept
+        as they are.
+
+        Returns:
+            number of nodes removed.
+        """
+
+        n_removed = 0
+        with self._profiler.phase("remove_unreachable_nodes"):
+            for flow in self._data["flows"]:
+                if flow["uuid"] not in self._edited_flow_uuids:
+                    continue
+                removed_uuids = remove_unreachable_nodes(flow)
+                if removed_uuids:
+                    logger.info(
+                        "Removed {} unreachable nodes from flow {}.".format(
+                            len(removed_uuids), flow["name"]
+                        )
+                    )
+                n_removed += len(removed_uuids)
+        return n_removed
+
+    def bypass_redundant_switches(self):
+        """In the edited flows, reroute paths around switches whose outcome
+        is determined by an identical switch earlier on the path, e.g. switches
+        on the same A/B test groups of consecutive nodes. Switches that are
+        bypassed on all paths are removed.
+
+        Returns:
+            number of switches removed.
+        """
+
+        n_removed = 0
+        with self._profiler.phase("bypass_redundant_switches"):
+            for flow in self._data["flows"]:
+                if flow["uuid"] not in self._edited_flow_uuids:
+                    continue
+                removed_uuids = bypass_redundant_switches(flow)
+                if removed_uuids:
+                    logger.info(
+                        "Removed {} redundant switches from flow {}.".format(
+                            len(removed_uuids), flow["name"]
+                        )
+                    )
+                n_removed += len(removed_uuids)
+        return n_removed
+
     def apply_translationedits(self, translationeditsheets):
         """Modify the internal RapidPro flow data by applying Translation changes."""
         self.apply_editsheets(translationeditsheets)
 
+    def validate(self):
+        """Check that the output is structurally consistent.
+
+        Returns:
+            list of str: description of each issue found.
+        """
+
+        with self._profiler.phase("validate"):
+            return validate_rapidpro_data(self._data)
+
     def export_to_json(self, filename):
-        with open(filename, "w") as fout:
-            json.dump(self._data, fout, indent=2)
+        with self._profiler.phase("export"):
+            with open(filename, "w") as fout:
+                json.dump(self._data, fout, indent=2)
+
+    def changed_flows(self):
+        """Returns the flows that differ from the input, including new flows.
+
+        Requires the creator to be constructed with track_changes=True.
+        """
+
+        if self._input_flow_hashes is None:
+            raise ValueError("Changes are only tracked if track_changes=True.")
+        return [
+            flow
+            for flow in self._data["flows"]
+            if self._input_flow_hashes.get(flow["uuid"]) != structural_hash(flow)
+        ]
+
+    def changed_groups(self):
+        """Returns the groups that are new or were renamed compared to the input.
+
+        Requires the creator to be constructed with track_changes=True.
+        """
+
+        if self._input_groups is None:
+            raise ValueError("Changes are only tracked if track_changes=True.")
+        return [
+            group.to_json_group()
+            for group in self._uuid_lookup.all_groups()
+            if (group.uuid, group.name) not in self._input_groups
+        ]
+
+    def export_delta_to_json(self, filename):
+        """Export only the flows that were modified and the groups that were
+        created, so that importing the output only touches what has changed.
+
+        The remaining top-level metadata (e.g. version and site) is kept, while
+        other lists of objects (e.g. campaigns, triggers, fields) are left empty.
+        """
+
+        with self._profiler.phase("export"):
+            with open(filename, "w") as fout:
+                json.dump(self.get_delta(), fout, indent=2)
+
+    def get_delta(self):
+        """The data exported by `export_delta_to_json`."""
+
+        delta = dict()
+        for key, value in self._data.items():
+            delta[key] = [] if isinstance(value, list) else value
+        delta["flows"] = self.changed_flows()
+        delta["groups"] = self.changed_groups()
+        return delta
+
+
+def structural_hash(data):
+    """Hash of a json-serializable object that is independent of key order."""
+
+    serialized = json.dumps(data, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+def _describe_edit_op(edit_op):
+    # Debug strings have the form "<sheet> row <n>: "
+    return edit_op.debug_string().rstrip(": ")
+
+
+def _edit_op_type(edit_op):
+    """The type of edit_op as written in the type_of_edit column."""
+
+    for op_type, class_name in edit_op.get_operation_types().items():
+        if type(edit_op) is class_name:
+            return op_type
+    return type(edit_op).__name__
+
+
+def predict_node_expansion(edit_ops):
+    """Upper bound of the number of nodes that applying edit_ops
+    to a node (see `apply_editops_to_node`) turns it into."""
+
+    n_variations = 1
+    n_nodes = 0
+    for edit_op in fuse_edit_ops(edit_ops):
+        n_nodes += n_variations * edit_op.max_added_nodes()
+        n_variations *= edit_op.max_variations()
+    return n_nodes + n_variations
 
 
-def apply_editops_to_node(flow, node, edit_ops):
+def apply_editops_to_node(flow, node, edit_ops, reported_occurrences=None):
     """
     Apply edit_ops to a given node.
 
@@ -151,11 +706,25 @@ def apply_editops_to_node(flow, node, edit_ops):
         flow: flow the node belongs to
         node: node to apply edit_ops to
         edit_ops (`FlowEditOp`):
+        reported_occurrences (dict): occurrences of the texts the ops replace
+            in node by op, for the ops whose occurrences have been reported.
     """
     operable_nodes = [node]
-    for edit_op in edit_ops:
+    # Ops with the same split share a single switch
+    for edit_op in fuse_edit_ops(edit_ops):
         new_operable_nodes = []
         for onode in operable_nodes:
-            new_operable_nodes += edit_op.apply_operation(flow, onode)
+            try:
+                new_operable_nodes += edit_op.apply_operation(
+                    flow, onode, reported_occurrences
+                )
+            except RegexTimeoutError as error:
+                # The operation leaves the node unchanged in this case.
+                logger.warning(
+                    edit_op.debug_string()
+                    + str(error)
+                    + " Operation not applied to node {}.".format(onode["uuid"])
+                )
+                new_operable_nodes.append(onode)
         operable_nodes = new_operable_nodes
     return operable_nodes  # Return value only used for testing
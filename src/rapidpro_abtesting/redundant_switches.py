@@ -0,0 +1,183 @@
+from .flow_index import freeze
+from .node_tools import get_reachable_uuids, remove_nodes
+
+# Actions that don't modify the contact or run, so that switches evaluate
+# to the same outcome before and after them. Any other action (e.g. setting
+# a field, adding a group or entering a flow) invalidates all known outcomes.
+PURE_ACTION_TYPES = {
+    "add_input_labels",
+    "say_msg",
+    "send_broadcast",
+    "send_email",
+    "send_msg",
+}
+
+# Operands whose value only changes through actions of the flow
+STABLE_OPERAND_PREFIXES = ("@contact.", "@fields.", "@results.")
+
+
+def switch_signature(node):
+    """Hashable signature of the operand and cases of a switch router
+    that does not wait for input, or None if the node has no such router.
+
+    Two such switches with the same signature take the same case (or the
+    default category) for a contact in the same state.
+    """
+
+    router = node.get("router")
+    if (
+        router is None
+        or router["type"] != "switch"
+        or "wait" in router
+        or not router["operand"].startswith(STABLE_OPERAND_PREFIXES)
+    ):
+        return None
+    cases = tuple((case["type"], freeze(case["arguments"])) for case in router["cases"])
+    return (router["operand"], cases)
+
+
+def switch_outcome_exits(node):
+    """Exit uuid for each outcome of a switch router. The outcomes are the
+    indices of the cases, and the number of cases for the default category.
+
+    Returns None if the router refers to missing categories."""
+
+    router = node["router"]
+    exit_uuids = {
+        category["uuid"]: category["exit_uuid"] for category in router["categories"]
+    }
+    category_uuids = [case["category_uuid"] for case in router["cases"]]
+    category_uuids.append(router["default_category_uuid"])
+    if any(uuid not in exit_uuids for uuid in category_uuids):
+        return None
+    return [exit_uuids[uuid] for uuid in category_uuids]
+
+
+def bypass_redundant_switches(flow):
+    """Reroute paths around switches whose outcome is already determined
+    by an identical switch earlier on the same path.
+
+    Which outcomes are possible for each switch signature at each node is
+    computed by a forward dataflow analysis, where the outcomes at a node are
+    the union of the outcomes of its incoming edges (and unknown if unknown
+    for any incoming edge). Edges into a switch whose possible outcomes all
+    lead to the same destination are rerouted to that destination.
+    Switches that are bypassed on all paths are removed.
+
+    Only switches without actions and result name are bypassed. Paths are not
+    duplicated, so a switch is only bypassed if no node where paths with
+    different outcomes join lies between it and the identical switch.
+
+    Returns:
+        list of the uuids of the removed switch nodes.
+    """
+
+    if not flow["nodes"]:
+        return []
+    nodes_by_uuid = {node["uuid"]: node for node in flow["nodes"]}
+    outcome_exits = dict()
+    for node in flow["nodes"]:
+        if switch_signature(node) is not None:
+            exits = switch_outcome_exits(node)
+            if exits is not None:
+                outcome_exits[node["uuid"]] = exits
+
+    def edge_facts(node, facts):
+        """Known outcomes (by switch signature) after each exit of the node."""
+
+        if any(action["type"] not in PURE_ACTION_TYPES for action in node["actions"]):
+            facts = dict()
+        router = node.get("router")
+        if router is not None and "wait" in router:
+            facts = dict()
+        if router is not None and router.get("result_name"):
+            facts = {
+                signature: outcomes
+                for signature, outcomes in facts.items()
+                if not signature[0].startswith("@results")
+            }
+        signature = switch_signature(node)
+        if node["uuid"] not in outcome_exits or (
+            router.get("result_name") and signature[0].startswith("@results")
+        ):
+            return [(exit, facts) for exit in node["exits"]]
+        known = facts.get(signature)
+        results = []
+        for exit in node["exits"]:
+            outcomes = frozenset(
+                i
+                for i, exit_uuid in enumerate(outcome_exits[node["uuid"]])
+                if exit_uuid == exit["uuid"] and (known is None or i in known)
+            )
+            exit_facts = dict(facts)
+            exit_facts[signature] = outcomes
+            results.append((exit, exit_facts))
+        return results
+
+    # Facts at the start of each node reached so far
+    entry_uuid = flow["nodes"][0]["uuid"]
+    node_facts = {entry_uuid: dict()}
+    worklist = [entry_uuid]
+    while worklist:
+        node = nodes_by_uuid[worklist.pop()]
+        for exit, facts in edge_facts(node, node_facts[node["uuid"]]):
+            destination_uuid = exit.get("destination_uuid")
+            if destination_uuid not in nodes_by_uuid:
+                continue
+            old_facts = node_facts.get(destination_uuid)
+            if old_facts is None:
+                new_facts = facts
+            else:
+                new_facts = {
+                    signature: outcomes | facts[signature]
+                    for signature, outcomes in old_facts.items()
+                    if signature in facts
+                }
+            if new_facts != old_facts:
+                node_facts[destination_uuid] = new_facts
+                worklist.append(destination_uuid)
+
+    def bypass_destination(destination_uuid, facts):
+        """The node reached from destination_uuid by skipping switches
+        whose outcome is determined by the facts, and the skipped switches."""
+
+        skipped = []
+        while destination_uuid in outcome_exits and destination_uuid not in skipped:
+            switch = nodes_by_uuid[destination_uuid]
+            if switch["actions"] or switch["router"].get("result_name"):
+                break
+            outcomes = facts.get(switch_signature(switch))
+            if not outcomes:
+                break
+            exit_destinations = {
+                exit["uuid"]: exit.get("destination_uuid") for exit in switch["exits"]
+            }
+            exit_uuids = {outcome_exits[destination_uuid][i] for i in outcomes}
+            if not exit_uuids <= exit_destinations.keys():
+                break
+            destinations = {exit_destinations[exit_uuid] for exit_uuid in exit_uuids}
+            if len(destinations) != 1:
+                break
+            skipped.append(destination_uuid)
+            (destination_uuid,) = destinations
+        return destination_uuid, skipped
+
+    bypassed_uuids = set()
+    for uuid, facts in node_facts.items():
+        for exit, exit_facts in edge_facts(nodes_by_uuid[uuid], facts):
+            destination_uuid, skipped = bypass_destination(
+                exit.get("destination_uuid"), exit_facts
+            )
+            if skipped:
+                bypassed_uuids.update(skipped)
+                exit["destination_uuid"] = destination_uuid
+
+    reachable = get_reachable_uuids(flow)
+    removed_uuids = [
+        node["uuid"]
+        for node in flow["nodes"]
+        if node["uuid"] in bypassed_uuids and node["uuid"] not in reachable
+    ]
+    if removed_uuids:
+        remove_nodes(flow, set(removed_uuids))
+    return removed_uuids
@@ -0,0 +1,133 @@
+import re
+import signal
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    # Supports a timeout natively, also outside of the main thread.
+    import regex
+except ImportError:
+    regex = None
+
+
+# Default time (in seconds) that the regular expressions of an operation
+# may run in total.
+DEFAULT_REGEX_TIME_BUDGET = 5.0
+
+
+class RegexTimeoutError(Exception):
+    """Raised when matching a regular expression exceeds its time budget."""
+
+
+class TimeBudget(object):
+    """Total time that may be spent matching regular expressions.
+
+    Args:
+        seconds (float): The budget. None for an unlimited budget.
+    """
+
+    def __init__(self, seconds=DEFAULT_REGEX_TIME_BUDGET):
+        self._remaining = seconds
+
+    def is_limited(self):
+        return self._remaining is not None
+
+    def remaining(self):
+        return self._remaining
+
+    def exhausted(self):
+        return self._remaining is not None and self._remaining <= 0
+
+    def spend(self, seconds):
+        if self._remaining is not None:
+            self._remaining -= seconds
+
+
+class BudgetedRegex(object):
+    """A compiled regular expression whose matching time is limited.
+
+    Matches are interrupted once the budget (which may be shared by multiple
+    regular expressions) runs out, raising a `RegexTimeoutError`.
+
+    If the `regex` module is installed, its timeout is used. Otherwise, the
+    standard `re` module is interrupted by a timer signal, which is only
+    possible on Unix in the main thread. Elsewhere, the time spent is
+    only checked after each match.
+
+    Args:
+        pattern (str): regular expression (compatible with `re`)
+        flags (int): `re` flags
+        budget (`TimeBudget`): None for an unlimited budget.
+    """
+
+    def __init__(self, pattern, flags=0, budget=None):
+        self.pattern = pattern
+        # Always compile with re, so that invalid patterns raise re.error
+        self._re = re.compile(pattern, flags)
+        self._regex = None
+        if regex is not None and budget is not None and budget.is_limited():
+            self._regex = regex.compile(pattern, flags)
+        self._budget = budget
+
+    def fullmatch(self, text):
+        return self._run("fullmatch", text)
+
+    def subn(self, replacement, text):
+        return self._run("subn", replacement, text)
+
+    def count(self, text):
+        return self._run("count", text)
+
+    def _run(self, method, *args):
+        if self._budget is None or not self._budget.is_limited():
+            return _call(self._re, method, *args)
+        remaining = self._budget.remaining()
+        if remaining <= 0:
+            raise RegexTimeoutError(self._timeout_message())
+        start = time.perf_counter()
+        try:
+            if self._regex is not None:
+                return _call(self._regex, method, *args, timeout=remaining)
+            with _alarm(remaining):
+                return _call(self._re, method, *args)
+        except (TimeoutError, _AlarmTimeout):
+            raise RegexTimeoutError(self._timeout_message()) from None
+        finally:
+            self._budget.spend(time.perf_counter() - start)
+
+    def _timeout_message(self):
+        return 'Regular expression "{}" exceeded its time budget.'.format(self.pattern)
+
+
+def _call(compiled, method, *args, **kwargs):
+    if method == "count":
+        return sum(1 for _ in compiled.finditer(*args, **kwargs))
+    return getattr(compiled, method)(*args, **kwargs)
+
+
+class _AlarmTimeout(Exception):
+    pass
+
+
+def _raise_alarm_timeout(signum, frame):
+    raise _AlarmTimeout()
+
+
+@contextmanager
+def _alarm(seconds):
+    """Interrupt the block after the given number of seconds, if possible."""
+
+    if (
+        not hasattr(signal, "setitimer")
+        or threading.current_thread() is not threading.main_thread()
+    ):
+        yield
+        return
+    previous_handler = signal.signal(signal.SIGALRM, _raise_alarm_timeout)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous_handler)
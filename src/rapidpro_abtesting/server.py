@@ -0,0 +1,328 @@
+import argparse
+import glob
+import hashlib
+import json
+import logging
+import marshal
+import os.path
+import socketserver
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from .compiled_sheets import (
+    CompiledSheetsVersionError,
+    compile_sheet_groups,
+    sheet_groups_from_compiled,
+)
+from .main import load_sheet_groups, plan_sheet_groups, process_sheet_groups
+from .rapidpro_abtest_creator import RapidProABTestCreator
+
+logger = logging.getLogger(__name__)
+
+
+def file_hash(filename):
+    with open(filename, "rb") as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+class LRUCache(object):
+    """Dict keeping only the most recently used entries."""
+
+    def __init__(self, max_size):
+        self._max_size = max_size
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        if key not in self._entries:
+            return None
+        self._entries.move_to_end(key)
+        return self._entries[key]
+
+    def put(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RequestError(Exception):
+    """Raised for invalid requests."""
+
+
+class _WarningCollector(logging.Handler):
+    def __init__(self):
+        super().__init__(level=logging.WARNING)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class BuildService(object):
+    """Applies sheets to RapidPro exports, keeping the parsed exports
+    and the parsed sheets in memory between requests.
+
+    Exports are cached by their path, size and modification time, and sheets
+    in files by the hash of their content, so a changed file is loaded again.
+    The cached exports are serialized with marshal, which restores a fresh
+    copy for each request faster than copying or parsing the JSON again.
+    Sheets from Google Sheets are cached by their ids until a request asks
+    to reload them. Warnings about the rows of the sheets are only reported
+    to the request that parsed them.
+    """
+
+    def __init__(self, max_cached=16):
+        self._inputs = LRUCache(max_cached)
+        self._sheets = LRUCache(max_cached)
+
+    def status(self):
+        return {"cached_inputs": len(self._inputs), "cached_sheets": len(self._sheets)}
+
+    def clear(self):
+        self._inputs.clear()
+        self._sheets.clear()
+
+    def _load_input(self, filename):
+        """The data of a RapidPro export, which the caller may modify."""
+
+        stat = os.stat(filename)
+        key = (os.path.abspath(filename), stat.st_size, stat.st_mtime_ns)
+        serialized = self._inputs.get(key)
+        if serialized is not None:
+            return marshal.loads(serialized)
+        with open(filename, "r", encoding="utf-8") as file:
+            data = json.load(file)
+        self._inputs.put(key, marshal.dumps(data))
+        return data
+
+    def _sheets_key(self, main_sheets, sheet_format):
+        if sheet_format == "google_sheets":
+            return (sheet_format, tuple(main_sheets))
+        filenames = list(main_sheets)
+        if sheet_format == "csv":
+            # The master sheets refer to the other CSV files in their directory
+            for main_sheet in main_sheets:
+                directory = os.path.dirname(main_sheet)
+                filenames += sorted(glob.glob(os.path.join(directory, "*.csv")))
+        return (
+            sheet_format,
+            tuple((filename, file_hash(filename)) for filename in filenames),
+        )
+
+    def _load_sheets(self, main_sheets, sheet_format, reload=False):
+        key = self._sheets_key(main_sheets, sheet_format)
+        compiled_sheets = None if reload else self._sheets.get(key)
+        if compiled_sheets is None:
+            compiled_sheets = compile_sheet_groups(
+                load_sheet_groups(main_sheets, sheet_format)
+            )
+            self._sheets.put(key, compiled_sheets)
+        return compiled_sheets
+
+    def apply(self, request):
+        """Apply sheets to a RapidPro export.
+
+        Args:
+            request (dict): with the keys
+                "input": RapidPro JSON file,
+                "sheets": list of master sheets (see `main.load_sheet_groups`),
+                "format": format of the master sheets,
+            and optionally
+                "config": config of each sheet by sheet name,
+                "reload": parse the sheets even if they are cached,
+                "plan": only plan the edits (see `main.plan_sheet_groups`),
+                "delta", "prune_unreachable", "bypass_switches",
+                "max_node_expansion", "max_flow_growth", "validate":
+                as the options of `main.apply_abtests`.
+
+        Returns:
+            dict with the "output" (the RapidPro data, its delta or the plan),
+            the validation "issues", the "skipped_nodes" and the logged
+            "warnings".
+
+        Raises:
+            RequestError: if the request is invalid or refers to missing files.
+        """
+
+        for key in ["input", "sheets", "format"]:
+            if key not in request:
+                raise RequestError('Missing "{}".'.format(key))
+        if request["format"] not in ["csv", "google_sheets", "json", "compiled"]:
+            raise RequestError('Invalid format "{}".'.format(request["format"]))
+        if not isinstance(request["sheets"], list):
+            raise RequestError('"sheets" must be a list.')
+        filenames = [request["input"]]
+        if request["format"] != "google_sheets":
+            filenames += request["sheets"]
+        for filename in filenames:
+            if not os.path.isfile(filename):
+                raise RequestError('File "{}" not found.'.format(filename))
+
+        collector = _WarningCollector()
+        package_logger = logging.getLogger("rapidpro_abtesting")
+        package_logger.addHandler(collector)
+        try:
+            compiled_sheets = self._load_sheets(
+                request["sheets"], request["format"], request.get("reload", False)
+            )
+            flow_edit_sheet_groups = sheet_groups_from_compiled(
+                compiled_sheets, request.get("config")
+            )
+            data = self._load_input(request["input"])
+            rpx = RapidProABTestCreator.from_data(
+                data,
+                track_changes=request.get("delta", False),
+                max_node_expansion=request.get("max_node_expansion"),
+                max_flow_growth=request.get("max_flow_growth"),
+            )
+            issues = []
+            if request.get("plan", False):
+                output = plan_sheet_groups(rpx, flow_edit_sheet_groups)
+            else:
+                process_sheet_groups(
+                    rpx,
+                    flow_edit_sheet_groups,
+                    prune_unreachable=request.get("prune_unreachable", False),
+                    bypass_switches=request.get("bypass_switches", False),
+                )
+                if request.get("validate", False):
+                    issues = rpx.validate()
+                if request.get("delta", False):
+                    output = rpx.get_delta()
+                else:
+                    output = rpx.get_data()
+        finally:
+            package_logger.removeHandler(collector)
+        return {
+            "output": output,
+            "issues": issues,
+            "skipped_nodes": rpx.skipped_nodes(),
+            "warnings": collector.messages,
+        }
+
+
+class BuildRequestHandler(BaseHTTPRequestHandler):
+    """HTTP interface of a `BuildService`:
+
+    - POST /apply with a JSON request (see `BuildService.apply`)
+    - GET /status returns the number of cached exports and sheets
+    - POST /clear empties the caches
+    """
+
+    def do_GET(self):
+        if self.path == "/status":
+            self._respond(200, self.server.service.status())
+        else:
+            self._respond(404, {"error": "Not found."})
+
+    def do_POST(self):
+        if self.path == "/clear":
+            self.server.service.clear()
+            self._respond(200, self.server.service.status())
+        elif self.path == "/apply":
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length))
+                if not isinstance(request, dict):
+                    raise RequestError("The request must be a JSON object.")
+            except (RequestError, ValueError) as error:
+                self._respond(400, {"error": str(error)})
+                return
+            try:
+                response = self.server.service.apply(request)
+            except (RequestError, CompiledSheetsVersionError) as error:
+                self._respond(400, {"error": str(error)})
+            except Exception as error:
+                logger.exception("Request failed.")
+                self._respond(500, {"error": str(error)})
+            else:
+                self._respond(200, response)
+        else:
+            self._respond(404, {"error": "Not found."})
+
+    def _respond(self, status, content):
+        body = json.dumps(content).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.info(format % args)
+
+
+class UnixHTTPServer(socketserver.UnixStreamServer):
+    """HTTP server listening on a Unix socket."""
+
+    def server_bind(self):
+        socketserver.UnixStreamServer.server_bind(self)
+        self.server_name = self.server_address
+        self.server_port = 0
+
+
+def create_server(service, host="127.0.0.1", port=8000, socket_path=None):
+    """Create a server for the service, listening on the Unix socket
+    socket_path if given, and on host and port otherwise.
+
+    Requests are handled one at a time in the calling thread, so regular
+    expression timeouts can interrupt the matching (see `BudgetedRegex`).
+    """
+
+    if socket_path is not None:
+        server = UnixHTTPServer(socket_path, BuildRequestHandler)
+    else:
+        server = HTTPServer((host, port), BuildRequestHandler)
+    server.service = service
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Serve requests to apply FlowEdits/ABTests to RapidPro JSON files, "
+            "keeping parsed files in memory between requests."
+        )
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="Host to listen on.")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on.")
+    parser.add_argument(
+        "--socket",
+        help="Unix socket to listen on instead of the host and port.",
+    )
+    parser.add_argument(
+        "--max-cached",
+        type=int,
+        default=16,
+        help="Number of exports and of sets of sheets to keep in memory.",
+    )
+    parser.add_argument(
+        "--logfile",
+        help="File to log warnings and errors to.",
+    )
+    args = parser.parse_args()
+
+    if args.logfile:
+        logging.basicConfig(filename=args.logfile, level=logging.WARNING)
+
+    server = create_server(
+        BuildService(args.max_cached), args.host, args.port, args.socket
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket:
+            os.remove(args.socket)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,424 @@
+import itertools
+import re
+
+
+class Context(object):
+    """State of a contact traversing a flow.
+
+    Attributes:
+        group_names: names of the groups the contact is in.
+        inputs: messages the contact sends when a flow waits for a response.
+            Consumed in order.
+        random_choices: category indices picked by random routers.
+            Consumed in order.
+        variables: values of router operands other than
+            `@contact.groups` and `@input.text`, e.g. `@fields.gender`.
+    """
+
+    def __init__(
+        self, group_names=None, inputs=None, random_choices=None, variables=None
+    ):
+        if group_names is not None:
+            self.group_names = group_names
+        else:
+            self.group_names = []
+
+        if inputs is not None:
+            self.inputs = inputs
+        else:
+            self.inputs = []
+
+        if random_choices is not None:
+            self.random_choices = random_choices
+        else:
+            self.random_choices = []
+
+        if variables is not None:
+            self.variables = variables
+        else:
+            self.variables = dict()
+
+
+# List of actions: https://app.rapidpro.io/mr/docs/flows.html#actions
+action_value_fields = {
+    "add_contact_groups": (lambda x: x["groups"][0]["name"]),
+    "add_contact_urn": (lambda x: x["path"]),
+    "add_input_labels": (lambda x: x["labels"][0]["name"]),
+    "call_classifier": (lambda x: x["classified"]["name"]),
+    "call_resthook": (lambda x: x["resthook"]),
+    "call_webhook": (lambda x: x["url"]),
+    "enter_flow": (lambda x: x["flow"]["name"]),
+    "open_ticket": (lambda x: x["subject"]),
+    "play_audio": (lambda x: x["audio_url"]),
+    "remove_contact_groups": (lambda x: x["groups"][0]["name"]),
+    "say_msg": (lambda x: x["text"]),
+    "send_broadcast": (lambda x: x["text"]),
+    "send_email": (lambda x: x["subject"]),
+    "send_msg": (lambda x: x["text"]),
+    "set_contact_channel": (lambda x: x["channel"]["name"]),
+    "set_contact_field": (lambda x: x["field"]["name"]),
+    "set_contact_language": (lambda x: x["language"]),
+    "set_contact_name": (lambda x: x["name"]),
+    "set_contact_status": (lambda x: x["status"]),
+    "set_contact_timezone": (lambda x: x["timezone"]),
+    "set_run_result": (lambda x: x["name"]),
+    "start_session": (lambda x: x["flow"]["name"]),
+    "transfer_airtime": (lambda x: "Amount"),
+}
+
+
+def _has_group(arguments, operand):
+    # Note: We ignore the Group UUID here.
+    return arguments[1] in operand
+
+
+def _has_phrase(arguments, operand):
+    return arguments[0].lower() in operand.lower()
+
+
+def _has_only_text(arguments, operand):  # case sensitive
+    return arguments[0] == operand
+
+
+def _has_any_word(arguments, operand):
+    input_words = {word.lower() for word in operand.split()}
+    return any(word.lower() in input_words for word in arguments[0].split())
+
+
+def _has_text(arguments, operand):
+    if arguments != []:
+        raise ValueError("has_text case type must not have arguments")
+    return operand.strip() != ""
+
+
+_EMAIL_REGEX = re.compile(r"[\w]+@[\w]+\.[\w]+")
+
+
+def _has_email(arguments, operand):
+    if arguments != []:
+        raise ValueError("has_email case type must not have arguments")
+    # This might differ from the RapidPro implementation.
+    return _EMAIL_REGEX.search(operand) is not None
+
+
+def _has_number_between(arguments, operand):
+    # This might differ from the RapidPro implementation.
+    if len(arguments) != 2:
+        raise ValueError("has_number_between must have 2 arguments")
+    try:
+        number = float(operand)
+    except ValueError:
+        return False
+    return float(arguments[0]) <= number <= float(arguments[1])
+
+
+# Case types that the simulator can evaluate. Cases of other types never match.
+CASE_TESTS = {
+    "has_group": _has_group,
+    "has_phrase": _has_phrase,
+    "has_only_text": _has_only_text,
+    "has_any_word": _has_any_word,
+    "has_text": _has_text,
+    "has_email": _has_email,
+    "has_number_between": _has_number_between,
+}
+
+
+class InvalidPath(object):
+    """Destination of a router branch that cannot be resolved.
+
+    Only raises an error once a contact actually takes the branch."""
+
+    def __init__(self, message):
+        self.message = message
+
+
+class CompiledNode(object):
+    """A node with its actions and router branches pre-resolved.
+
+    Each branch of the router is resolved to the uuid of the destination
+    node, so no category or exit lookups are needed during simulation.
+    The names of the categories of the branches are recorded in
+    `case_categories`, `default_category` and `random_categories`.
+    """
+
+    __slots__ = [
+        "uuid",
+        "outputs",
+        "added_groups",
+        "router_type",
+        "operand",
+        "cases",
+        "default_destination",
+        "random_destinations",
+        "destination",
+        "case_categories",
+        "default_category",
+        "random_categories",
+    ]
+
+    def __init__(self, node):
+        self.uuid = node["uuid"]
+        self.outputs = []
+        self.added_groups = []
+        for action in node["actions"]:
+            action_type = action["type"]
+            if action_type not in action_value_fields:
+                raise ValueError(
+                    "Node {}: Unsupported action type {}.".format(
+                        self.uuid, action_type
+                    )
+                )
+            try:
+                action_value = action_value_fields[action_type](action)
+            except (KeyError, IndexError, TypeError):
+                # Action with missing fields, e.g. without groups
+                action_value = None
+            self.outputs.append((action_type, action_value))
+            # We only support a very small subset of actions.
+            if action_type == "add_contact_groups":
+                for group in action["groups"]:
+                    self.added_groups.append(group["name"])
+
+        # By default, choose the first exit.
+        exits = node["exits"]
+        self.destination = exits[0].get("destination_uuid") if exits else None
+        self.router_type = None
+        self.operand = None
+        self.cases = []
+        self.default_destination = None
+        self.random_destinations = []
+        self.case_categories = []
+        self.default_category = None
+        self.random_categories = []
+        if "router" not in node:
+            return
+
+        router = node["router"]
+        exit_destinations = {
+            exit["uuid"]: exit.get("destination_uuid", None) for exit in exits
+        }
+        category_destinations = {}
+        category_names = {}
+        for category in router["categories"]:
+            category_names[category["uuid"]] = category.get("name")
+            exit_uuid = category["exit_uuid"]
+            if exit_uuid in exit_destinations:
+                destination = exit_destinations[exit_uuid]
+            else:
+                destination = InvalidPath(
+                    "No valid destination_uuid in router of node with uuid " + self.uuid
+                )
+            category_destinations[category["uuid"]] = destination
+
+        def category_destination(category_uuid):
+            if category_uuid in category_destinations:
+                return category_destinations[category_uuid]
+            return InvalidPath(
+                "No valid exit_uuid in router of node with uuid " + self.uuid
+            )
+
+        self.router_type = router["type"]
+        if self.router_type == "switch":
+            self.operand = router["operand"]
+            for case in router["cases"]:
+                test = CASE_TESTS.get(case["type"])
+                if test is None:
+                    continue
+                self.cases.append(
+                    (
+                        test,
+                        case["arguments"],
+                        category_destination(case["category_uuid"]),
+                    )
+                )
+                self.case_categories.append(category_names.get(case["category_uuid"]))
+            self.default_destination = category_destination(
+                router["default_category_uuid"]
+            )
+            self.default_category = category_names.get(router["default_category_uuid"])
+        else:  # router["type"] == "random"
+            self.random_destinations = [
+                category_destination(category["uuid"])
+                for category in router["categories"]
+            ]
+            self.random_categories = [
+                category.get("name") for category in router["categories"]
+            ]
+
+    def process_actions(self, context):
+        """Returns the (action type, value) pairs of the node's actions.
+
+        May modify the context."""
+
+        context.group_names.extend(self.added_groups)
+        return list(self.outputs)
+
+    def find_destination_uuid(self, context):
+        """
+        Find the next node that is visited and return its uuid.
+
+        Returns:
+            uuid of the node visited after this node.
+            Maybe be None if it is the last node.
+        """
+
+        if self.router_type is None:
+            return self.destination
+        if self.router_type == "switch":
+            # Get value of the operand
+            if self.operand == "@contact.groups":
+                operand = context.group_names
+            elif self.operand == "@input.text":
+                operand = context.inputs.pop(0)
+            else:
+                operand = context.variables.get(self.operand)
+
+            # The "Other" option (default)
+            destination = self.default_destination
+            if operand is not None:
+                # The arguments are not parsed (e.g. no variable substitution)
+                for test, arguments, case_destination in self.cases:
+                    if test(arguments, operand):
+                        destination = case_destination
+                        break
+        else:
+            # Take the exit of a random category
+            random_choice = context.random_choices.pop(0)
+            destination = self.random_destinations[random_choice]
+        if isinstance(destination, InvalidPath):
+            raise ValueError(destination.message)
+        return destination
+
+
+class FlowSimulator(object):
+    """Simulates contacts traversing a RapidPro flow.
+
+    The flow is compiled once into nodes indexed by uuid, so that it can be
+    traversed by many contexts quickly.
+
+    Only a subset of RapidPro is supported: actions are recorded and
+    `add_contact_groups` actions update the context, and switch routers
+    can only evaluate the case types in `CASE_TESTS`.
+
+    Args:
+        flow: RapidPro flow
+        max_steps: maximum number of nodes visited in a single traversal,
+            to detect cycles.
+    """
+
+    def __init__(self, flow, max_steps=10000):
+        self._max_steps = max_steps
+        self._entry_uuid = flow["nodes"][0]["uuid"] if flow["nodes"] else None
+        self._nodes = {node["uuid"]: CompiledNode(node) for node in flow["nodes"]}
+
+    def node(self, uuid):
+        return self._nodes.get(uuid)
+
+    def entry_uuid(self):
+        return self._entry_uuid
+
+    def run(self, context, start_uuid=None):
+        """
+        Traverse the flow, starting at the entry node (or the given node).
+
+        Traversal ends once we reach an exit with destination_uuid None.
+
+        If we encounter a destination_uuid leading to a node not contained
+        in the flow, the flow is considered erroneous and an error is raised.
+
+        Returns:
+            A list of (action type, value) pairs of the actions
+            encountered while traversing through the flow.
+        """
+
+        outputs = []
+        current_node = self._nodes.get(start_uuid or self._entry_uuid)
+        steps = 0
+        while current_node is not None:
+            steps += 1
+            if steps > self._max_steps:
+                raise ValueError(
+                    "Exceeded {} steps. The flow may contain a cycle.".format(
+                        self._max_steps
+                    )
+                )
+            outputs += current_node.process_actions(context)
+            destination_uuid = current_node.find_destination_uuid(context)
+            if destination_uuid is None:  # we've reached the exit
+                break
+            current_node = self._nodes.get(destination_uuid)
+            if current_node is None:
+                raise ValueError(
+                    "Destination_uuid {} is invalid.".format(destination_uuid)
+                )
+        return outputs
+
+    def final_destination(self, context, start_uuid):
+        """Starting at the given node, traverse the flow until we reach a
+        destination that is not contained inside the flow.
+
+        Returns:
+            uuid of the destination outside the flow
+        """
+
+        current_node = self._nodes.get(start_uuid)
+        destination_uuid = start_uuid
+        steps = 0
+        while current_node is not None:
+            steps += 1
+            if steps > self._max_steps:
+                raise ValueError(
+                    "Exceeded {} steps. The flow may contain a cycle.".format(
+                        self._max_steps
+                    )
+                )
+            current_node.process_actions(context)
+            destination_uuid = current_node.find_destination_uuid(context)
+            current_node = self._nodes.get(destination_uuid)
+        return destination_uuid
+
+    def run_many(self, contexts):
+        """Traverse the flow once for each of the given contexts."""
+
+        return [self.run(context) for context in contexts]
+
+    def run_combinations(
+        self,
+        group_name_sets=((),),
+        input_sequences=((),),
+        random_choice_sequences=((),),
+        variable_sets=({},),
+    ):
+        """Traverse the flow for every combination of the given contact states.
+
+        Useful to verify a generated flow for every group, input
+        and random choice a contact may have.
+
+        Returns:
+            list of dicts, one per combination, with the keys
+            "group_names", "inputs", "random_choices", "variables" describing
+            the combination, and either "outputs" with the list of actions
+            encountered, or "error" if the traversal failed.
+        """
+
+        results = []
+        for group_names, inputs, random_choices, variables in itertools.product(
+            group_name_sets, input_sequences, random_choice_sequences, variable_sets
+        ):
+            result = {
+                "group_names": list(group_names),
+                "inputs": list(inputs),
+                "random_choices": list(random_choices),
+                "variables": dict(variables),
+            }
+            context = Context(
+                list(group_names), list(inputs), list(random_choices), dict(variables)
+            )
+            try:
+                result["outputs"] = self.run(context)
+            except (ValueError, IndexError) as error:
+                # IndexError: ran out of inputs or random choices
+                result["error"] = str(error) or type(error).__name__
+            results.append(result)
+        return results
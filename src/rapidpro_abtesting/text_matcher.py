@@ -0,0 +1,106 @@
+from collections import deque
+
+
+class MultiPatternMatcher(object):
+    """Counts occurrences of many literal strings in a text in a single pass.
+
+    Builds an Aho-Corasick automaton over the patterns, so that the time to
+    scan a text is linear in the length of the text (plus the number of
+    occurrences), independent of the number of patterns.
+
+    Occurrences are counted like `str.count`, i.e. for each pattern
+    the non-overlapping occurrences found scanning from left to right.
+
+    Args:
+        patterns: list of non-empty strings. Duplicates are allowed.
+    """
+
+    def __init__(self, patterns):
+        self._patterns = list(patterns)
+        # Each state is a dict of transitions; state 0 is the root.
+        self._goto = [dict()]
+        self._fail = [0]
+        # Indices of the patterns ending in each state, including those
+        # reachable via failure links.
+        self._output = [[]]
+        for index, pattern in enumerate(self._patterns):
+            if not pattern:
+                raise ValueError("Patterns must not be empty.")
+            state = 0
+            for char in pattern:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append(dict())
+                    self._fail.append(0)
+                    self._output.append([])
+                state = next_state
+            self._output[state].append(index)
+        self._build_failure_links()
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._output[next_state] += self._output[self._fail[next_state]]
+
+    def patterns(self):
+        return self._patterns
+
+    def count_occurrences(self, text, counts=None):
+        """Count the occurrences of each pattern in text.
+
+        Args:
+            counts: list of counts per pattern index to add to.
+                If None, a new list is created.
+
+        Returns:
+            list with the number of occurrences of each pattern
+        """
+
+        if counts is None:
+            counts = [0] * len(self._patterns)
+        # End of the last counted occurrence of each pattern,
+        # to skip overlapping occurrences.
+        last_ends = dict()
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+        state = 0
+        for position, char in enumerate(text, 1):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for index in output[state]:
+                start = position - len(self._patterns[index])
+                if start >= last_ends.get(index, 0):
+                    last_ends[index] = position
+                    counts[index] += 1
+        return counts
+
+
+def can_create_occurrence(pattern, replacement):
+    """Can replacing a part of a text with replacement create an occurrence
+    of pattern that the text did not contain before?
+
+    A new occurrence has to overlap with the replacement, unless the
+    replacement is empty and the parts around the removed text are joined.
+    """
+
+    if not replacement:
+        return True
+    if pattern in replacement or replacement in pattern:
+        return True
+    for length in range(1, min(len(pattern), len(replacement))):
+        if replacement.endswith(pattern[:length]) or replacement.startswith(
+            pattern[-length:]
+        ):
+            return True
+    return False
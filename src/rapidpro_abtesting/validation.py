@@ -0,0 +1,144 @@
+from collections import Counter, defaultdict
+
+UUID_KINDS = ["node", "action", "exit", "category", "case"]
+
+
+def validate_rapidpro_data(data):
+    """Check that RapidPro data is structurally consistent and thus importable.
+
+    Runs in time linear in the size of the data by indexing all
+    uuids of each flow once.
+
+    Returns:
+        list of str: human-readable description of each issue found.
+    """
+
+    issues = []
+    flows = data.get("flows", [])
+    flow_uuids = Counter(flow["uuid"] for flow in flows)
+    for uuid, count in flow_uuids.items():
+        if count > 1:
+            issues.append("Flow uuid {} is used by {} flows.".format(uuid, count))
+    # Names of the flows using each uuid, by kind of uuid
+    uuid_flows = {kind: defaultdict(list) for kind in UUID_KINDS}
+    for flow in flows:
+        for kind, uuid_counts in count_flow_uuids(flow).items():
+            for uuid in uuid_counts:
+                uuid_flows[kind][uuid].append(flow.get("name"))
+    for kind, flow_names in uuid_flows.items():
+        for uuid, names in flow_names.items():
+            if len(names) > 1:
+                issues.append(
+                    "{} uuid {} is used by multiple flows: {}.".format(
+                        kind.capitalize(), uuid, ", ".join(map(str, names))
+                    )
+                )
+    for flow in flows:
+        issues += validate_flow(flow)
+    return issues
+
+
+def count_flow_uuids(flow):
+    """Count the uuids of the nodes, actions, exits, categories and cases
+    of a flow.
+
+    Returns:
+        dict mapping each kind of uuid to a `Counter` of the uuids.
+    """
+
+    counts = {kind: Counter() for kind in UUID_KINDS}
+    for node in flow["nodes"]:
+        counts["node"][node["uuid"]] += 1
+        for action in node.get("actions", []):
+            counts["action"][action["uuid"]] += 1
+        for exit in node.get("exits", []):
+            counts["exit"][exit["uuid"]] += 1
+        router = node.get("router", {})
+        for category in router.get("categories", []):
+            counts["category"][category["uuid"]] += 1
+        for case in router.get("cases", []):
+            counts["case"][case["uuid"]] += 1
+    return counts
+
+
+def validate_flow(flow):
+    """Check a single flow. See `validate_rapidpro_data`."""
+
+    prefix = "Flow {}: ".format(flow.get("name"))
+    issues = []
+    counts = count_flow_uuids(flow)
+    for kind, uuid_counts in counts.items():
+        for uuid, count in uuid_counts.items():
+            if count > 1:
+                issues.append(
+                    prefix + "{} uuid {} is not unique ({}x).".format(kind, uuid, count)
+                )
+
+    node_uuids = counts["node"]
+    for node in flow["nodes"]:
+        node_prefix = prefix + "Node {}: ".format(node["uuid"])
+        exit_uuids = set()
+        for exit in node.get("exits", []):
+            exit_uuids.add(exit["uuid"])
+            destination_uuid = exit.get("destination_uuid")
+            if destination_uuid is not None and destination_uuid not in node_uuids:
+                issues.append(
+                    node_prefix
+                    + "exit {} has dangling destination {}.".format(
+                        exit["uuid"], destination_uuid
+                    )
+                )
+        if "router" not in node:
+            continue
+        router = node["router"]
+        category_uuids = set()
+        for category in router.get("categories", []):
+            category_uuids.add(category["uuid"])
+            if category.get("exit_uuid") not in exit_uuids:
+                issues.append(
+                    node_prefix
+                    + "category {} has unknown exit_uuid {}.".format(
+                        category["uuid"], category.get("exit_uuid")
+                    )
+                )
+        for case in router.get("cases", []):
+            if case.get("category_uuid") not in category_uuids:
+                issues.append(
+                    node_prefix
+                    + "case {} has unknown category_uuid {}.".format(
+                        case["uuid"], case.get("category_uuid")
+                    )
+                )
+        if (
+            "default_category_uuid" in router
+            and router["default_category_uuid"] not in category_uuids
+        ):
+            issues.append(
+                node_prefix
+                + "unknown default_category_uuid {}.".format(
+                    router["default_category_uuid"]
+                )
+            )
+
+    if "_ui" in flow:
+        ui_nodes = flow["_ui"].get("nodes", {})
+        for uuid in ui_nodes:
+            if uuid not in node_uuids:
+                issues.append(
+                    prefix + "_ui entry {} does not match a node.".format(uuid)
+                )
+        for uuid in node_uuids:
+            if uuid not in ui_nodes:
+                issues.append(prefix + "node {} has no _ui entry.".format(uuid))
+
+    localizable_uuids = set(counts["action"])
+    localizable_uuids.update(counts["category"])
+    localizable_uuids.update(counts["case"])
+    for language, translations in flow.get("localization", {}).items():
+        for uuid in translations:
+            if uuid not in localizable_uuids:
+                issues.append(
+                    prefix + "localization {} key {} does not match an action, case or"
+                    " category.".format(language, uuid)
+                )
+    return issues
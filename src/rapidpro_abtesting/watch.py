@@ -0,0 +1,283 @@
+import copy
+import difflib
+import glob
+import json
+import logging
+import os.path
+import re
+import time
+from collections import defaultdict
+
+from .compiled_sheets import SHEET_TYPES
+from .main import load_sheet_groups, process_sheet_groups
+from .operations import get_regex_pattern
+from .rapidpro_abtest_creator import RapidProABTestCreator
+
+logger = logging.getLogger(__name__)
+
+
+def flow_id_matches(flow_id, flow_name):
+    """Does the flow_id of a row (possibly a regex) match the flow name?"""
+
+    pattern = get_regex_pattern(flow_id)
+    if pattern is None:
+        return flow_id == flow_name
+    try:
+        return re.fullmatch(pattern, flow_name) is not None
+    except re.error:
+        return False
+
+
+def diff_sheet_rows(old_sheet, new_sheet):
+    """Compare two versions of a compiled sheet (see `FlowSheet.to_compiled`)
+    by the hashes of their rows.
+
+    Either version may be None if the sheet has been added or removed.
+    If the sheets differ in anything but their rows, all rows are changed.
+    Moved rows count as removed and added.
+
+    Returns:
+        (removed, added): the specs of the old sheet that are not in the new
+        sheet, and the specs of the new sheet that are not in the old sheet.
+    """
+
+    if old_sheet is None or new_sheet is None:
+        old_specs = old_sheet["operations"] if old_sheet is not None else []
+        new_specs = new_sheet["operations"] if new_sheet is not None else []
+        return list(old_specs), list(new_specs)
+    if any(
+        old_sheet[key] != new_sheet[key]
+        for key in ["sheet_type", "name", "config", "category_names"]
+    ):
+        return list(old_sheet["operations"]), list(new_sheet["operations"])
+
+    old_specs = old_sheet["operations"]
+    new_specs = new_sheet["operations"]
+    matcher = difflib.SequenceMatcher(
+        None,
+        [spec["row_hash"] for spec in old_specs],
+        [spec["row_hash"] for spec in new_specs],
+        autojunk=False,
+    )
+    removed = []
+    added = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag != "equal":
+            removed += old_specs[i1:i2]
+            added += new_specs[j1:j2]
+    return removed, added
+
+
+class IncrementalBuilder(object):
+    """Applies master sheets (in CSV or JSON format) to a RapidPro file,
+    and re-applies them after the sheets have changed.
+
+    The input is only loaded once. When rebuilding, only the rows that have
+    changed are parsed again (see `FlowSheet.compile_rows`), and the rows
+    that were added, removed or changed are determined by comparing the row
+    hashes with the previous build. Only the flows affected by these rows
+    are edited again, starting from the input flows. All other flows are
+    reused from the previous output.
+
+    The rows of the first group of sheets are matched against the input
+    flows, so the affected flows are those with a node matched by a changed
+    row. Later groups may match nodes created by earlier groups, so for
+    their rows all flows matching the flow_id are affected.
+
+    The groups of the previous output are kept, so that the reused flows
+    refer to existing groups. Groups of A/B tests that have been removed
+    from the sheets are therefore only dropped by a full build.
+    """
+
+    def __init__(
+        self,
+        input_flow,
+        main_sheets,
+        sheet_format,
+        config=None,
+        prune_unreachable=False,
+        bypass_switches=False,
+        max_node_expansion=None,
+        max_flow_growth=None,
+    ):
+        if sheet_format not in ["csv", "json"]:
+            raise ValueError("Only CSV and JSON sheets can be watched.")
+        with open(input_flow, "r", encoding="utf-8") as file:
+            self._input = json.load(file)
+        self._main_sheets = main_sheets
+        self._sheet_format = sheet_format
+        self._config = config or {}
+        self._prune_unreachable = prune_unreachable
+        self._bypass_switches = bypass_switches
+        self._max_node_expansion = max_node_expansion
+        self._max_flow_growth = max_flow_growth
+        # Compiled sheets of the previous build by (group index, index in group)
+        self._compiled_sheets = None
+        self._changes = None
+        self._output = None
+
+    def watched_files(self):
+        """The master sheets and the files the sheets may be read from."""
+
+        filenames = list(self._main_sheets)
+        if self._sheet_format == "csv":
+            for main_sheet in self._main_sheets:
+                directory = os.path.dirname(main_sheet)
+                filenames += glob.glob(os.path.join(directory, "*.csv"))
+        return sorted(set(filenames))
+
+    def output(self):
+        return self._output
+
+    def changes(self):
+        """The changes found by the last build, as a dict with the keys
+        "rows" (debug strings of the removed and added rows), "nodes" (uuids
+        of the input nodes matched by these rows in the first group of sheets)
+        and "flows" (names of the flows that were edited again).
+        None after the first build, which edits all flows."""
+        return self._changes
+
+    def build(self):
+        """Apply the current sheets, reusing as much of the previous build
+        as possible.
+
+        Returns:
+            list of the names of the flows that were edited again.
+        """
+
+        sheet_groups = load_sheet_groups(
+            self._main_sheets, self._sheet_format, self._config
+        )
+        # Specs of the rows of the previous build by sheet and row hash
+        cached_specs = defaultdict(dict)
+        for compiled in (self._compiled_sheets or {}).values():
+            for spec in compiled["operations"]:
+                key = (compiled["sheet_type"], compiled["name"])
+                cached_specs[key][spec["row_hash"]] = spec
+        compiled_sheets = dict()
+        for group_index, sheets in enumerate(sheet_groups):
+            for index, sheet in enumerate(sheets):
+                sheet.compile_rows(
+                    cached_specs.get((type(sheet).__name__, sheet.name()))
+                )
+                compiled_sheets[(group_index, index)] = sheet.to_compiled()
+
+        if self._compiled_sheets is None:
+            edited_flows = self._input["flows"]
+            self._changes = None
+        else:
+            edited_flows = self._find_affected_flows(compiled_sheets)
+
+        data = dict(self._input)
+        edited_uuids = {flow["uuid"] for flow in edited_flows}
+        data["flows"] = []
+        for index, flow in enumerate(self._input["flows"]):
+            if flow["uuid"] in edited_uuids:
+                data["flows"].append(copy.deepcopy(flow))
+            else:
+                data["flows"].append(self._output["flows"][index])
+        if self._output is not None:
+            data["groups"] = self._output["groups"]
+        data["groups"] = copy.deepcopy(data["groups"])
+
+        rpx = RapidProABTestCreator.from_data(
+            data,
+            max_node_expansion=self._max_node_expansion,
+            max_flow_growth=self._max_flow_growth,
+        )
+        rpx.restrict_edits_to_flows(edited_uuids)
+        process_sheet_groups(
+            rpx,
+            sheet_groups,
+            prune_unreachable=self._prune_unreachable,
+            bypass_switches=self._bypass_switches,
+        )
+
+        self._output = rpx.get_data()
+        self._compiled_sheets = compiled_sheets
+        return [flow["name"] for flow in edited_flows]
+
+    def _find_affected_flows(self, compiled_sheets):
+        """The input flows affected by the rows that differ between the
+        compiled sheets and the ones of the previous build."""
+
+        # Sheets with the removed and added rows in the first group of sheets
+        first_group_sheets = []
+        # flow_ids of the removed and added rows in later groups
+        flow_ids = set()
+        changed_rows = []
+        for position in sorted(compiled_sheets.keys() | self._compiled_sheets.keys()):
+            old_sheet = self._compiled_sheets.get(position)
+            new_sheet = compiled_sheets.get(position)
+            for sheet, specs in zip(
+                [old_sheet, new_sheet], diff_sheet_rows(old_sheet, new_sheet)
+            ):
+                if not specs:
+                    continue
+                changed_rows += [spec["debug_string"].rstrip(": ") for spec in specs]
+                if position[0] == 0:
+                    changed_sheet = dict(sheet, operations=specs)
+                    first_group_sheets.append(
+                        SHEET_TYPES[sheet["sheet_type"]].from_compiled(changed_sheet)
+                    )
+                else:
+                    flow_ids.update(spec["flow_id"] for spec in specs)
+
+        node_uuids = set()
+        if first_group_sheets:
+            # Matching does not modify the input
+            rpx = RapidProABTestCreator.from_data(self._input)
+            node_uuids = rpx.find_affected_nodes(first_group_sheets)
+        affected_flows = [
+            flow
+            for flow in self._input["flows"]
+            if any(node["uuid"] in node_uuids for node in flow["nodes"])
+            or any(flow_id_matches(flow_id, flow["name"]) for flow_id in flow_ids)
+        ]
+        self._changes = {
+            "rows": changed_rows,
+            "nodes": sorted(node_uuids),
+            "flows": [flow["name"] for flow in affected_flows],
+        }
+        return affected_flows
+
+
+def file_modification_times(filenames):
+    times = dict()
+    for filename in filenames:
+        try:
+            times[filename] = os.stat(filename).st_mtime_ns
+        except OSError:
+            pass
+    return times
+
+
+def watch(builder, output_flow, interval=0.5):
+    """Build the output, and rebuild it whenever a watched file of the
+    `IncrementalBuilder` changes. Runs until interrupted."""
+
+    modification_times = None
+    while True:
+        current_times = file_modification_times(builder.watched_files())
+        if current_times != modification_times:
+            modification_times = current_times
+            start = time.perf_counter()
+            try:
+                flow_names = builder.build()
+                with open(output_flow, "w") as fout:
+                    json.dump(builder.output(), fout, indent=2)
+            except Exception:
+                # The sheets may be saved incompletely, wait for the next change.
+                logger.exception("Build failed.")
+                print("Build failed, waiting for changes.")
+            else:
+                changes = builder.changes()
+                print(
+                    "Rebuilt {} flow(s) for {} changed row(s) in {:.2f}s: {}".format(
+                        len(flow_names),
+                        "all" if changes is None else len(changes["rows"]),
+                        time.perf_counter() - start,
+                        ", ".join(flow_names),
+                    )
+                )
+        time.sleep(interval)
@@ -7,11 +7,14 @@ from rapidpro_abtesting.node_tools import (
     find_node_by_uuid,
     get_assign_to_group_gadget,
     get_assign_to_fixed_group_gadget,
+    get_assign_to_random_group_gadget,
+    get_content_key,
     get_localizable_uuids,
     get_switch_node,
     get_unique_node_copy,
+    remove_unreachable_nodes,
 )
-from rapidpro_abtesting.abtest import SwitchCategory
+from rapidpro_abtesting.abtest import ABTest, SwitchCategory
 from rapidpro_abtesting.rapidpro_abtest_creator import (
     RapidProABTestCreator,
     apply_editops_to_node,
@@ -28,7 +31,10 @@ from rapidpro_abtesting.uuid_tools import UUIDLookup
 from rapidpro_abtesting.operations import (
     count,
     FlowEditOp,
+    FusedFlowEditOp,
+    fuse_edit_ops,
     get_regex_pattern,
+    get_text_pattern,
     RemoveAttachmentsFlowEditOp,
     replace,
     ReplaceAttachmentsFlowEditOp,
@@ -304,6 +310,55 @@ class TestNodeTools(unittest.TestCase):
         exp2 = [("enter_flow", "Flow Name")]
         self.assertEqual(msgs2, exp2)
 
+    def test_get_unique_node_copy_sharing(self):
+        original = copy.deepcopy(test_node)
+        copied = get_unique_node_copy(original)
+        # Containers with uuids are copied, other content is shared
+        self.assertIsNot(copied["actions"][0], original["actions"][0])
+        self.assertIsNot(copied["exits"][0], original["exits"][0])
+        self.assertIs(
+            copied["actions"][0]["attachments"], original["actions"][0]["attachments"]
+        )
+        copied["actions"][0]["text"] = "Good evening!"
+        copied["exits"][0]["destination_uuid"] = "somewhere"
+        self.assertEqual(original, test_node)
+
+    def test_get_content_key(self):
+        copied = get_unique_node_copy(test_enter_flow_node)
+        self.assertEqual(get_content_key(copied), get_content_key(test_enter_flow_node))
+        copied["exits"][0]["destination_uuid"] = "somewhere"
+        self.assertNotEqual(
+            get_content_key(copied), get_content_key(test_enter_flow_node)
+        )
+
+    def test_remove_unreachable_nodes(self):
+        entry = copy.deepcopy(test_node)
+        reachable = get_unique_node_copy(test_node)
+        unreachable = get_unique_node_copy(test_node)
+        entry["exits"][0]["destination_uuid"] = reachable["uuid"]
+        reachable["exits"][0]["destination_uuid"] = None
+        unreachable["exits"][0]["destination_uuid"] = reachable["uuid"]
+        nodes = [entry, reachable, unreachable]
+        layout = {"position": {"left": 0, "top": 0}}
+        flow = {
+            "nodes": nodes,
+            "_ui": {"nodes": {node["uuid"]: copy.deepcopy(layout) for node in nodes}},
+            "localization": {
+                "fra": {
+                    node["actions"][0]["uuid"]: {"text": ["Bonjour!"]} for node in nodes
+                }
+            },
+        }
+        removed = remove_unreachable_nodes(flow)
+        self.assertEqual(removed, [unreachable["uuid"]])
+        self.assertEqual(flow["nodes"], [entry, reachable])
+        self.assertEqual(set(flow["_ui"]["nodes"]), {entry["uuid"], reachable["uuid"]})
+        self.assertEqual(
+            set(flow["localization"]["fra"]),
+            {entry["actions"][0]["uuid"], reachable["actions"][0]["uuid"]},
+        )
+        self.assertEqual(remove_unreachable_nodes(flow), [])
+
     def test_get_group_switch_node(self):
         test_op = self.abtests[0].edit_op(1)
         switch = get_switch_node(test_op, ["dest1uuid", "dest2uuid", "dest2uuid"])
@@ -355,6 +410,24 @@ class TestNodeTools(unittest.TestCase):
         self.assertEqual(context2.group_names[0], "GBname")
         # print(json.dumps(gadget, indent=4))
 
+    def test_get_assign_to_random_group_gadget(self):
+        groups = [("G1", "G1uuid"), ("G2", "G2uuid"), ("G3", "G3uuid")]
+        gadget, gadget_ui = get_assign_to_random_group_gadget(
+            groups, "destuuid", [4, 2, 2]
+        )
+        self.assertEqual(set(gadget_ui), {node["uuid"] for node in gadget})
+        # Weights are reduced to 2:1:1
+        self.assertEqual(len(gadget[1]["router"]["categories"]), 4)
+        flow = {"nodes": gadget}
+        for random_choice, group_name in [(0, "G1"), (1, "G1"), (2, "G2"), (3, "G3")]:
+            context = Context(random_choices=[random_choice])
+            destination = find_final_destination(flow, gadget[0], context)
+            self.assertEqual(destination, "destuuid")
+            self.assertEqual(context.group_names, [group_name])
+        context = Context(["G3"])
+        find_final_destination(flow, gadget[0], context)
+        self.assertEqual(context.group_names, ["G3"])
+
     def test_get_assign_to_fixed_group_gadget(self):
         gadget, gadget_ui = get_assign_to_fixed_group_gadget(
             "GAname", "GAuuid", "destuuid"
@@ -427,6 +500,28 @@ class TestOperations(unittest.TestCase):
         msgs1 = traverse_flow(flow, Context())
         self.assertEqual(msgs1, [("send_msg", "OK morning!")])
 
+    def test_apply_replace_bit_of_text_identical_variations(self):
+        row = ["replace_bit_of_text", "", 0, "", "Good", "@fields.mood", "OK"]
+        edit_op = FlowEditOp.create_edit_op(
+            *row, "debug_str", has_node_for_other_category=True
+        )
+        edit_op.add_category(SwitchCategory("Cat1", "has_only_text", ["1"], "OK"))
+        edit_op.add_category(SwitchCategory("Cat2", "has_only_text", ["2"], "Bad"))
+        edit_op.add_category(SwitchCategory("Cat3", "has_only_text", ["3"], "Bad"))
+        flow_snippet = edit_op._get_flow_snippet(copy.deepcopy(self.test_node_x))
+        # One switch, one variation for Cat2/Cat3 and the original for Cat1/Other
+        self.assertEqual(len(flow_snippet.nodes()), 3)
+        self.assertEqual(len(flow_snippet.node_variations()), 2)
+        flow = {"nodes": flow_snippet.nodes()}
+        for mood, text in [
+            ("1", "OK morning!"),
+            ("2", "Bad morning!"),
+            ("3", "Bad morning!"),
+            ("4", "OK morning!"),
+        ]:
+            msgs = traverse_flow(flow, Context(variables={"@fields.mood": mood}))
+            self.assertEqual(msgs, [("send_msg", text)])
+
     def test_apply_replace_quick_replies(self):
         row = [
             "replace_quick_replies",
@@ -945,6 +1040,79 @@ class TestRapidProABTestCreatorMethods(unittest.TestCase):
             nodes[1]["actions"][1]["templating"]["uuid"],
         )
 
+    def test_generate_node_variations_fused(self):
+        # Both ops split by the same groups, so they share a single switch
+        test_ops = [
+            self.abtests[0].edit_op(0),
+            self.abtests[0].edit_op(1),
+        ]
+
+        flow = {"nodes": [copy.deepcopy(test_node_3actions)]}
+        flow["nodes"][0]["exits"][0]["destination_uuid"] = None
+        nodes = apply_editops_to_node(flow, flow["nodes"][0], test_ops)
+        self.assertEqual(len(nodes), 2)
+        self.assertEqual(nodes[0]["actions"], test_node_3actions["actions"])
+        self.assertEqual(
+            [action["text"] for action in nodes[1]["actions"]],
+            [
+                "The first personalizable message, Steve!",
+                "Good morning, Steve!",
+                "Good morning, Steve!",
+            ],
+        )
+        switch_nodes = [node for node in flow["nodes"] if "router" in node]
+        self.assertEqual(len(switch_nodes), 1)
+        self.assertEqual(flow["nodes"][0], switch_nodes[0])
+
+        groupA = self.abtests[0].groupA().name
+        groupB = self.abtests[0].groupB().name
+        for group_names, node in [
+            ([], nodes[0]),
+            ([groupA], nodes[0]),
+            ([groupB], nodes[1]),
+        ]:
+            msgs = traverse_flow(flow, Context(group_names))
+            expected = [("send_msg", action["text"]) for action in node["actions"]]
+            self.assertEqual(msgs, expected)
+
+    def test_fused_op_accessors(self):
+        test_ops = [
+            self.abtests[0].edit_op(0),
+            self.abtests[0].edit_op(1),
+        ]
+        (fused_op,) = fuse_edit_ops(test_ops)
+        self.assertIsInstance(fused_op, FusedFlowEditOp)
+        self.assertEqual(fused_op.flow_id(), test_ops[0].flow_id())
+        self.assertEqual(fused_op.row_id(), test_ops[0].row_id())
+        self.assertEqual(fused_op.node_identifier(), test_ops[0].node_identifier())
+        self.assertEqual(fused_op.bit_of_text(), test_ops[0].bit_of_text())
+        self.assertEqual(fused_op.debug_string(), test_ops[0].debug_string())
+        self.assertEqual(
+            fused_op.default_text(), tuple(op.default_text() for op in test_ops)
+        )
+        self.assertTrue(fused_op.matches_unique_flow())
+        self.assertTrue(fused_op.is_match_for_flow(test_ops[0].flow_id()))
+        self.assertFalse(fused_op.is_match_for_flow("Other flow"))
+        self.assertTrue(fused_op.matches_unique_node_identifier())
+        self.assertEqual(fused_op.split_by(), test_ops[0].split_by())
+        self.assertEqual(len(fused_op.categories()), len(test_ops[0].categories()))
+
+        regex_op = FlowEditOp.create_edit_op(
+            "replace_bit_of_text",
+            "regex:ABTesting_.*",
+            "",
+            "regex:.*morning.*",
+            "morning",
+            "@contact.groups",
+            "evening",
+            "Debug_str",
+        )
+        fused_op = FusedFlowEditOp([regex_op, regex_op])
+        self.assertFalse(fused_op.matches_unique_flow())
+        self.assertTrue(fused_op.is_match_for_flow("ABTesting_Pre"))
+        self.assertFalse(fused_op.matches_unique_node_identifier())
+        self.assertEqual(fused_op.node_identifier(), ".*morning.*")
+
 
 class TestRapidProABTestCreatorLinear(unittest.TestCase):
     def setUp(self):
@@ -1014,6 +1182,19 @@ class TestRapidProABTestCreatorLinear(unittest.TestCase):
         self.assertEqual(msgs4, exp4)
 
 
+class TestRapidProABTestCreatorRemoveUnreachableNodes(unittest.TestCase):
+    def test_remove_unreachable_nodes(self):
+        rpx = RapidProABTestCreator("testdata/Linear_OneNodePerAction.json")
+        abtest = abtest_from_csv("testdata/Test2_Some1337.csv")
+        rpx.apply_abtests([abtest])
+        flow = rpx._data["flows"][0]
+        n_nodes = len(flow["nodes"])
+        flow["nodes"].append(get_unique_node_copy(flow["nodes"][-1]))
+        self.assertEqual(rpx.remove_unreachable_nodes(), 1)
+        self.assertEqual(len(flow["nodes"]), n_nodes)
+        self.assertEqual(rpx.validate(), [])
+
+
 class TestRapidProABTestCreatorTwoFlowsWithMatchingNode(unittest.TestCase):
     def setUp(self):
         abtest1 = abtest_from_csv("testdata/RegexMatchFlowNode.csv")
@@ -1087,6 +1268,19 @@ class TestRapidProABTestCreatorRegexReplace(unittest.TestCase):
         self.assertEqual(replace("abcabc", "regex:abc", "xyz"), "xyzxyz")
         self.assertEqual(replace("abcabc", "abc", "xyz"), "xyzxyz")
 
+    def test_text_pattern_subn(self):
+        pattern = get_text_pattern("regex:a(.)")
+        self.assertEqual(pattern.subn("x\\1", "abac"), ("xbxc", 2))
+        self.assertEqual(get_text_pattern("aa").subn("b", "aaaaa"), ("bba", 2))
+        self.assertEqual(get_text_pattern("abc").subn("x", "def"), ("def", 0))
+        self.assertEqual(get_text_pattern("").subn("x", "ab"), ("xaxbx", 3))
+
+    def test_invalid_regex(self):
+        edit_op = FlowEditOp.create_edit_op(
+            "replace_bit_of_text", "Flow", "", "regex:(", "a", "", "b", "Row 1: "
+        )
+        self.assertIsNone(edit_op)
+
 
 class TestRapidProABTestCreatorWaitForResponse(unittest.TestCase):
     def setUp(self):
@@ -1664,6 +1858,212 @@ class TestMasterSheetWithConfig(unittest.TestCase):
         # msgs4 = traverse_flow(flows, Context([self.group1A_name, self.group2A_name]))
         # This one is different, because the user is now in both groups A and B
 
+    def test_shared_group_assignment_gadget(self):
+        content = [
+            ["type_of_edit", "flow_id", "original_row_id", "node_identifier"]
+            + ["change", "change:1337", "assign_to_group"],
+            ["replace_bit_of_text", "ABTesting_Pre", "", "Good morning!"]
+            + ["Good morning", "g00d m0rn1ng", "TRUE"],
+            ["replace_bit_of_text", "ABTesting_Pre", "", "This is a test."]
+            + ["test", "t3st", "TRUE"],
+        ]
+        abtest = ABTest("Shared", content, {"group_assignment_gadget": "per_flow"})
+        rpx = RapidProABTestCreator("testdata/Linear_OneNodePerAction.json")
+        rpx.apply_abtests([abtest])
+
+        flow = rpx._data["flows"][0]
+        random_routers = [
+            node
+            for node in flow["nodes"]
+            if node.get("router", {}).get("type") == "random"
+        ]
+        self.assertEqual(len(random_routers), 1)
+        self.assertEqual(set(flow["_ui"]["nodes"]), {n["uuid"] for n in flow["nodes"]})
+        exp = [
+            ("add_contact_groups", "ABTest_Shared_1337"),
+            ("send_msg", "The first personalizable message."),
+            ("send_msg", "Some generic message."),
+            ("send_msg", "g00d m0rn1ng!"),
+            ("send_msg", "This is a t3st."),
+        ]
+        self.assertEqual(traverse_flow(flow, Context(random_choices=[1])), exp)
+        exp = [
+            ("send_msg", "The first personalizable message."),
+            ("send_msg", "Some generic message."),
+            ("send_msg", "Good morning!"),
+            ("send_msg", "This is a test."),
+        ]
+        self.assertEqual(traverse_flow(flow, Context([abtest.groupA().name])), exp)
+
+    def test_shared_gadgets_with_some_common_groups(self):
+        header = ["type_of_edit", "flow_id", "original_row_id", "node_identifier"]
+        row = ["replace_bit_of_text", "ABTesting_Pre", "", "Good morning!"]
+        config = {"group_assignment_gadget": "per_flow"}
+        two_arms = ABTest(
+            "Shared",
+            [
+                header + ["change", "change:1337", "assign_to_group"],
+                row + ["Good", "G00d", "TRUE"],
+            ],
+            config,
+        )
+        three_arms = ABTest(
+            "Shared",
+            [
+                header + ["change", "change:1337", "change:Steve", "assign_to_group"],
+                row + ["morning", "m0rn1ng", "morning, Steve", "TRUE"],
+            ],
+            config,
+        )
+        rpx = RapidProABTestCreator("testdata/Linear_OneNodePerAction.json")
+        with self.assertLogs("rapidpro_abtesting", level="WARNING") as logs:
+            rpx.apply_abtests([two_arms, three_arms])
+        self.assertIn("already assigns contacts to some", logs.output[0])
+
+        flow = rpx._data["flows"][0]
+        random_routers = [
+            node
+            for node in flow["nodes"]
+            if node.get("router", {}).get("type") == "random"
+        ]
+        # The gadget of the two arms does not cover the third arm
+        self.assertEqual(len(random_routers), 2)
+        msgs = traverse_flow(flow, Context(random_choices=[2, 1]))
+        self.assertIn(("add_contact_groups", "ABTest_Shared_Steve"), msgs)
+
+    def test_no_fusion_with_different_group_assignment(self):
+        header = ["type_of_edit", "flow_id", "original_row_id", "node_identifier"]
+        header += ["change", "change:1337", "assign_to_group"]
+        row = ["replace_bit_of_text", "ABTesting_Pre", "", "Good morning!"]
+        per_node = ABTest("Shared", [header, row + ["Good", "G00d", "TRUE"]])
+        per_flow = ABTest(
+            "Shared",
+            [header, row + ["morning", "m0rn1ng", "TRUE"]],
+            {"group_assignment_gadget": "per_flow"},
+        )
+        uuid_lookup = UUIDLookup()
+        per_node.parse_rows(uuid_lookup)
+        per_flow.parse_rows(uuid_lookup)
+        edit_ops = [per_node.edit_op(0), per_flow.edit_op(0)]
+        self.assertEqual(fuse_edit_ops(edit_ops), edit_ops)
+
+        rpx = RapidProABTestCreator("testdata/Linear_OneNodePerAction.json")
+        rpx.apply_abtests([per_node, per_flow])
+        flow = rpx._data["flows"][0]
+        # The gadget in front of the node and the one at the flow entry
+        random_routers = [
+            node
+            for node in flow["nodes"]
+            if node.get("router", {}).get("type") == "random"
+        ]
+        self.assertEqual(len(random_routers), 2)
+
+
+class TestABTestMultipleArms(unittest.TestCase):
+    def setUp(self):
+        content = [
+            ["type_of_edit", "flow_id", "original_row_id", "node_identifier"]
+            + ["change", "change:1337", "change:Steve", "assign_to_group"],
+            ["replace_bit_of_text", "ABTesting_Pre", "", "Good morning!"]
+            + ["Good morning", "g00d m0rn1ng", "Good morning, Steve", "TRUE"],
+        ]
+        self.abtest = ABTest("Arms", content, {"group_weights": [2, 1, 1]})
+
+    def test_groups(self):
+        self.abtest.parse_rows(UUIDLookup())
+        self.assertEqual(
+            [group.name for group in self.abtest.groups()],
+            ["ABTest_Arms_Default", "ABTest_Arms_1337", "ABTest_Arms_Steve"],
+        )
+        self.assertEqual(self.abtest.group_pair(), tuple(self.abtest.groups()[:2]))
+        self.assertTrue(self.abtest.edit_op(0).assign_to_group())
+        self.assertEqual(len(self.abtest.edit_op(0).categories()), 3)
+
+    def test_missing_arm_content(self):
+        content = [
+            ["type_of_edit", "flow_id", "original_row_id", "node_identifier"]
+            + ["change", "change:1337", "change:Steve"],
+            ["replace_bit_of_text", "ABTesting_Pre", "", "Good morning!"]
+            + ["Good morning", "g00d m0rn1ng"],
+        ]
+        abtest = ABTest("Arms", content)
+        with self.assertLogs("rapidpro_abtesting", level="WARNING") as logs:
+            abtest.parse_rows(UUIDLookup())
+        self.assertIn("too few entries.", logs.output[0])
+        self.assertEqual(abtest.edit_ops(), [])
+
+    def test_apply_abtests(self):
+        rpx = RapidProABTestCreator("testdata/Linear_OneNodePerAction.json")
+        rpx.apply_abtests([self.abtest])
+        flow = rpx._data["flows"][0]
+        random_routers = [
+            node
+            for node in flow["nodes"]
+            if node.get("router", {}).get("type") == "random"
+        ]
+        self.assertEqual(len(random_routers), 1)
+        self.assertEqual(len(random_routers[0]["router"]["categories"]), 4)
+
+        def expected(text):
+            return [
+                ("send_msg", "The first personalizable message."),
+                ("send_msg", "Some generic message."),
+                ("send_msg", text),
+                ("send_msg", "This is a test."),
+            ]
+
+        groups = [group.name for group in self.abtest.groups()]
+        texts = ["Good morning!", "g00d m0rn1ng!", "Good morning, Steve!"]
+        for group_name, text in zip(groups, texts):
+            msgs = traverse_flow(flow, Context([group_name]))
+            self.assertEqual(msgs, expected(text))
+        msgs = traverse_flow(flow, Context(random_choices=[3]))
+        self.assertEqual(
+            msgs[2:], [("add_contact_groups", groups[2])] + expected(texts[2])[2:]
+        )
+
+
+class TestRowHashes(unittest.TestCase):
+    def setUp(self):
+        self.header = ["type_of_edit", "flow_id", "original_row_id", "node_identifier"]
+        self.header += ["change", "change:Steve", "assign_to_group"]
+        self.rows = [
+            ["replace_bit_of_text", "ABTesting_Pre", "", "Good morning!"]
+            + ["Good morning", "Good morning, Steve", "FALSE"],
+            ["replace_bit_of_text", "ABTesting_Pre", "", "This is a test."]
+            + ["test", "Steve test", "FALSE"],
+        ]
+
+    def test_row_hashes(self):
+        specs = ABTest("Hashes", [self.header] + self.rows).compile_rows()
+        # Hashes don't depend on the position of the row
+        new_row = ["replace_bit_of_text", "ABTesting_Pre", "", "Some generic message."]
+        new_row += ["generic", "Steve", "FALSE"]
+        new_sheet = ABTest("Hashes", [self.header, new_row] + self.rows)
+        new_specs = new_sheet.compile_rows()
+        self.assertEqual(
+            [spec["row_hash"] for spec in new_specs[1:]],
+            [spec["row_hash"] for spec in specs],
+        )
+        self.assertNotEqual(new_specs[0]["row_hash"], specs[0]["row_hash"])
+        # The header is part of the hash
+        header = self.header[:5] + ["change:Bob"] + self.header[6:]
+        other_specs = ABTest("Hashes", [header] + self.rows).compile_rows()
+        self.assertNotEqual(other_specs[0]["row_hash"], specs[0]["row_hash"])
+
+    def test_cached_specs(self):
+        specs = ABTest("Hashes", [self.header] + self.rows).compile_rows()
+        cached_specs = {spec["row_hash"]: spec for spec in specs}
+        # Pretend the cached spec has different content to see it is reused
+        cached_specs[specs[1]["row_hash"]] = dict(specs[1], bit_of_text="cached")
+        sheet = ABTest("Hashes", [self.header] + self.rows[::-1])
+        new_specs = sheet.compile_rows(cached_specs)
+        self.assertEqual(new_specs[0]["bit_of_text"], "cached")
+        self.assertEqual(new_specs[0]["debug_string"], "ABTest Hashes row 2: ")
+        self.assertEqual(
+            new_specs[1], dict(specs[0], debug_string="ABTest Hashes row 3: ")
+        )
+
 
 class TestNodesLayout(unittest.TestCase):
 
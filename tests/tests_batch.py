@@ -0,0 +1,75 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from rapidpro_abtesting.batch import run_batch
+from rapidpro_abtesting.compiled_sheets import compile_sheet_groups
+from rapidpro_abtesting.main import load_sheet_groups
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        # A master sheet with an A/B test that assigns contacts to groups
+        master_sheet = self.path("master_sheet.csv")
+        with open(master_sheet, "w") as fout:
+            fout.write("flow_type,flow_name,sheet_name,status\n")
+            fout.write("flow_testing,,Test2Assign_Some1337,released\n")
+        shutil.copy("testdata/Test2Assign_Some1337.csv", self.tmpdir.name)
+        sheet_groups = load_sheet_groups([master_sheet], "csv")
+        self.compiled_sheets = compile_sheet_groups(sheet_groups)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def path(self, filename):
+        return os.path.join(self.tmpdir.name, filename)
+
+    def test_run_batch(self):
+        config_fp = self.path("config.json")
+        with open(config_fp, "w") as config_file:
+            json.dump(
+                {"Test2Assign_Some1337": {"group_assignment": "always A"}}, config_file
+            )
+        jobs = [
+            {
+                "input": "testdata/Linear_OneNodePerAction.json",
+                "output": self.path("out1.json"),
+            },
+            {
+                "input": "testdata/Linear_OneNodePerAction.json",
+                "output": self.path("out2.json"),
+                "config": config_fp,
+            },
+            {"input": self.path("missing.json"), "output": self.path("out3.json")},
+        ]
+        with self.assertLogs("rapidpro_abtesting", level="WARNING"):
+            summaries = run_batch(jobs, self.compiled_sheets, {"validate": True})
+
+        self.assertEqual([summary["status"] for summary in summaries[:2]], ["ok"] * 2)
+        for summary in summaries[:2]:
+            self.assertEqual(summary["issues"], 0)
+            self.assertTrue(os.path.isfile(summary["output"]))
+        # The group assignment gadget of the second job is smaller
+        self.assertLess(summaries[1]["nodes"], summaries[0]["nodes"])
+
+        self.assertEqual(summaries[2]["status"], "failed")
+        self.assertIn("FileNotFoundError", summaries[2]["error"])
+        self.assertFalse(os.path.exists(self.path("out3.json")))
+
+    def test_process_pool(self):
+        jobs = [
+            {
+                "input": "testdata/Linear_OneNodePerAction.json",
+                "output": self.path("out{}.json".format(i)),
+            }
+            for i in range(2)
+        ]
+        summaries = run_batch(jobs, self.compiled_sheets, {}, processes=2)
+        self.assertEqual(
+            [summary["output"] for summary in summaries],
+            [job["output"] for job in jobs],
+        )
+        self.assertEqual(summaries[0]["nodes"], summaries[1]["nodes"])
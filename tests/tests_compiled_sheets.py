@@ -0,0 +1,68 @@
+import json
+import unittest
+
+from rapidpro_abtesting.compiled_sheets import (
+    COMPILED_SHEETS_VERSION,
+    compile_sheet_groups,
+    sheet_groups_from_compiled,
+)
+from rapidpro_abtesting.rapidpro_abtest_creator import RapidProABTestCreator
+from rapidpro_abtesting.simulator import FlowSimulator
+from rapidpro_abtesting.sheets import CSVMasterSheetParser
+
+
+class TestCompiledSheets(unittest.TestCase):
+    def load_sheet_groups(self):
+        parser = CSVMasterSheetParser(["testdata/master_sheet.csv"])
+        return parser.get_flow_edit_sheet_groups()
+
+    def apply(self, sheet_groups):
+        rpx = RapidProABTestCreator("testdata/Linear_OneNodePerAction.json")
+        for sheets in sheet_groups:
+            rpx.apply_abtests(sheets)
+        return rpx
+
+    def run_flow(self, rpx):
+        group_names = [group["name"] for group in rpx._data["groups"]]
+        return FlowSimulator(rpx._data["flows"][0]).run_combinations(
+            [()] + [(name,) for name in group_names],
+            variable_sets=[{}, {"@fields.gender": "man"}],
+        )
+
+    def test_round_trip(self):
+        with self.assertLogs("rapidpro_abtesting", level="WARNING"):
+            sheet_groups = self.load_sheet_groups()
+        # The compiled sheets survive serialization
+        compiled = json.loads(json.dumps(compile_sheet_groups(sheet_groups)))
+        self.assertEqual(compiled["version"], COMPILED_SHEETS_VERSION)
+        compiled_groups = sheet_groups_from_compiled(compiled)
+        self.assertEqual(
+            [[sheet.to_compiled() for sheet in sheets] for sheets in compiled_groups],
+            compiled["sheet_groups"],
+        )
+
+        rpx1 = self.apply(sheet_groups)
+        rpx2 = self.apply(compiled_groups)
+        self.assertEqual(
+            [group["name"] for group in rpx1._data["groups"]],
+            [group["name"] for group in rpx2._data["groups"]],
+        )
+        self.assertEqual(self.run_flow(rpx1), self.run_flow(rpx2))
+
+    def test_reuse(self):
+        # The same compiled sheets can be applied to several inputs
+        with self.assertLogs("rapidpro_abtesting", level="WARNING"):
+            sheet_groups = self.load_sheet_groups()
+        compiled_groups = sheet_groups_from_compiled(compile_sheet_groups(sheet_groups))
+        rpx1 = self.apply(compiled_groups)
+        rpx2 = self.apply(compiled_groups)
+        self.assertEqual(self.run_flow(rpx1), self.run_flow(rpx2))
+        # The ops are created anew for each input
+        self.assertIsNot(
+            rpx1._data["flows"][0]["nodes"][0], rpx2._data["flows"][0]["nodes"][0]
+        )
+
+    def test_version_mismatch(self):
+        compiled = {"version": COMPILED_SHEETS_VERSION + 1, "sheet_groups": []}
+        with self.assertRaises(ValueError):
+            sheet_groups_from_compiled(compiled)
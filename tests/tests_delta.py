@@ -0,0 +1,47 @@
+import json
+import os
+import tempfile
+import unittest
+
+from rapidpro_abtesting.abtest import ABTest
+from rapidpro_abtesting.rapidpro_abtest_creator import RapidProABTestCreator
+
+
+class TestDeltaExport(unittest.TestCase):
+    def setUp(self):
+        self.rpx = RapidProABTestCreator(
+            "testdata/RegexMatchFlowNode.json", track_changes=True
+        )
+        self.content = [
+            ["type_of_edit", "flow_id", "original_row_id", "node_identifier"]
+            + ["change", "change:Stevefied", "assign_to_group"],
+            ["replace_bit_of_text", "Flow_2", "", "Regex:.*"]
+            + ["Good morning!", "Good morning, Steve!", "FALSE"],
+        ]
+
+    def export_delta(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "delta.json")
+            self.rpx.export_delta_to_json(filename)
+            with open(filename, "r") as delta_file:
+                return json.load(delta_file)
+
+    def test_unchanged(self):
+        delta = self.export_delta()
+        self.assertEqual(delta["flows"], [])
+        self.assertEqual(delta["groups"], [])
+        self.assertEqual(delta["version"], self.rpx._data["version"])
+
+    def test_changed_flow(self):
+        self.rpx.apply_abtests([ABTest("Delta", self.content)])
+        delta = self.export_delta()
+        self.assertEqual([flow["name"] for flow in delta["flows"]], ["Flow_2"])
+        self.assertEqual(
+            sorted(group["name"] for group in delta["groups"]),
+            ["ABTest_Delta_Default", "ABTest_Delta_Stevefied"],
+        )
+
+    def test_requires_tracking(self):
+        rpx = RapidProABTestCreator("testdata/RegexMatchFlowNode.json")
+        with self.assertRaises(ValueError):
+            rpx.changed_flows()
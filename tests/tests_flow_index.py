@@ -0,0 +1,90 @@
+import json
+import unittest
+
+from rapidpro_abtesting.flow_index import FlowIndex, freeze
+from rapidpro_abtesting.operations import FlowEditOp
+from rapidpro_abtesting.rapidpro_abtest_creator import RapidProABTestCreator
+
+
+class TestFreeze(unittest.TestCase):
+    def test_freeze(self):
+        self.assertEqual(freeze({"a": [1, {"b": "c"}]}), freeze({"a": [1, {"b": "c"}]}))
+        self.assertEqual(freeze({"a": 1, "b": 2}), freeze({"b": 2, "a": 1}))
+        self.assertNotEqual(freeze({"a": [1, 2]}), freeze({"a": [2, 1]}))
+        self.assertNotEqual(freeze([{"a": 1}]), freeze([{"a": 1, "b": 2}]))
+
+
+class TestFlowIndex(unittest.TestCase):
+    def setUp(self):
+        with open("testdata/SplitByExample.json", "r") as input_file:
+            self.flow = json.load(input_file)["flows"][0]
+        self.index = FlowIndex(self.flow)
+
+    def test_switch_router(self):
+        cases = [
+            # Key order of the identifier does not matter
+            {"category_name": "Yes", "type": "has_any_word", "arguments": ["yes"]},
+            {"arguments": ["no"], "category_name": "No", "type": "has_any_word"},
+        ]
+        nodes = self.index.nodes_by_switch_router(
+            {"operand": "@fields.something", "cases": cases}
+        )
+        self.assertEqual(len(nodes), 1)
+        self.assertEqual(nodes[0]["router"]["operand"], "@fields.something")
+        nodes = self.index.nodes_by_switch_router(
+            {"operand": "@fields.something_else", "cases": cases}
+        )
+        self.assertEqual(nodes, [])
+        nodes = self.index.nodes_by_switch_router(
+            {"operand": "@fields.something", "cases": cases[:1]}
+        )
+        self.assertEqual(nodes, [])
+
+    def test_wait_for_response(self):
+        with open("testdata/WaitForResponse.json", "r") as input_file:
+            flow = json.load(input_file)["flows"][0]
+        node = next(node for node in flow["nodes"] if "wait" in node.get("router", {}))
+        categories = {
+            category["uuid"]: category["name"]
+            for category in node["router"]["categories"]
+        }
+        cases = [
+            {
+                "type": case["type"],
+                "arguments": case["arguments"],
+                "category_name": categories[case["category_uuid"]],
+            }
+            for case in node["router"]["cases"]
+        ]
+        index = FlowIndex(flow)
+        self.assertEqual(index.nodes_by_wait_for_response_cases(cases), [node])
+        self.assertEqual(index.nodes_by_wait_for_response_cases(cases[1:]), [])
+
+    def test_saved_value(self):
+        with open("testdata/FlowWithSaveValue.json", "r") as input_file:
+            flow = json.load(input_file)["flows"][0]
+        index = FlowIndex(flow)
+        actions = index.saved_value_actions("@fields.type_of_media", "high medium low")
+        self.assertEqual(len(actions), 1)
+        node, action_index = actions[0]
+        self.assertEqual(node["actions"][action_index]["type"], "set_contact_field")
+        self.assertEqual(index.saved_value_actions("@fields.type_of_media", "low"), [])
+        self.assertEqual(index.saved_value_actions("@contact.name", "low"), [])
+
+
+class TestFlowResolution(unittest.TestCase):
+    def make_op(self, flow_id):
+        row = ["replace_bit_of_text", flow_id, "", "Hello", "", "", "", ""]
+        return FlowEditOp.create_edit_op(*row, "Debug_str")
+
+    def test_find_matching_flows(self):
+        rpx = RapidProABTestCreator("testdata/RegexMatchFlowNode.json")
+        flows = rpx._find_matching_flows(self.make_op("Flow_2"))
+        self.assertEqual([flow["name"] for flow in flows], ["Flow_2"])
+        self.assertEqual(rpx._find_matching_flows(self.make_op("Flow_3")), [])
+        flows = rpx._find_matching_flows(self.make_op("regex:Flow_.*"))
+        self.assertEqual([flow["name"] for flow in flows], ["Flow_1", "Flow_2"])
+        flows = rpx._find_matching_flows(self.make_op("regex:.*1"))
+        self.assertEqual([flow["name"] for flow in flows], ["Flow_1"])
+        # Patterns are only resolved once
+        self.assertEqual(set(rpx._flows_by_pattern), {"Flow_.*", ".*1"})
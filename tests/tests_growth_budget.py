@@ -0,0 +1,83 @@
+import unittest
+
+from rapidpro_abtesting.abtest import ABTest
+from rapidpro_abtesting.rapidpro_abtest_creator import (
+    RapidProABTestCreator,
+    predict_node_expansion,
+)
+from rapidpro_abtesting.sheets import abtest_from_csv
+from rapidpro_abtesting.uuid_tools import UUIDLookup
+
+
+class TestGrowthBudget(unittest.TestCase):
+    def setUp(self):
+        # Test1 edits the first and third node, Test2 the third node
+        self.abtests = [
+            abtest_from_csv("testdata/Test1_Personalization.csv"),
+            abtest_from_csv("testdata/Test2_Some1337.csv"),
+        ]
+
+    def count_nodes(self, rpx):
+        return len(rpx._data["flows"][0]["nodes"])
+
+    def test_predict_node_expansion(self):
+        for abtest in self.abtests:
+            abtest.parse_rows(UUIDLookup())
+        # A switch with 2 variations
+        self.assertEqual(predict_node_expansion([self.abtests[0].edit_op(1)]), 3)
+        # Each of the 2 variations gets a switch with 2 variations
+        edit_ops = [self.abtests[0].edit_op(1), self.abtests[1].edit_op(0)]
+        self.assertEqual(predict_node_expansion(edit_ops), 7)
+
+    def test_unlimited(self):
+        rpx = RapidProABTestCreator("testdata/Linear_OneNodePerAction.json")
+        rpx.apply_abtests(self.abtests)
+        self.assertEqual(self.count_nodes(rpx), 4 + 2 + 6)
+        self.assertEqual(rpx.skipped_nodes(), [])
+
+    def test_max_node_expansion(self):
+        rpx = RapidProABTestCreator(
+            "testdata/Linear_OneNodePerAction.json", max_node_expansion=5
+        )
+        with self.assertLogs("rapidpro_abtesting", level="WARNING") as logs:
+            rpx.apply_abtests(self.abtests)
+        # Only the edits of the first node are applied
+        self.assertEqual(self.count_nodes(rpx), 4 + 2)
+        (skipped,) = rpx.skipped_nodes()
+        self.assertEqual(skipped["expansion"], 7)
+        self.assertEqual(len(skipped["operations"]), 2)
+        self.assertIn("node expansion limit of 5", "\n".join(logs.output))
+        self.assertIn("Test2_Some1337", "\n".join(logs.output))
+
+    def test_max_flow_growth(self):
+        rpx = RapidProABTestCreator(
+            "testdata/Linear_OneNodePerAction.json", max_flow_growth=2.5
+        )
+        with self.assertLogs("rapidpro_abtesting", level="WARNING"):
+            rpx.apply_abtests(self.abtests)
+        self.assertEqual(self.count_nodes(rpx), 4 + 2)
+        self.assertEqual(len(rpx.skipped_nodes()), 1)
+
+    def test_max_flow_growth_shared_gadget(self):
+        content = [
+            ["type_of_edit", "flow_id", "original_row_id", "node_identifier"]
+            + ["change", "change:1337", "assign_to_group"],
+            ["replace_bit_of_text", "ABTesting_Pre", "", "Good morning!"]
+            + ["Good morning", "g00d m0rn1ng", "TRUE"],
+        ]
+        config = {"group_assignment_gadget": "per_flow"}
+        # The gadget at the flow entry adds 4 nodes, the switch 2 nodes
+        rpx = RapidProABTestCreator(
+            "testdata/Linear_OneNodePerAction.json", max_flow_growth=2.5
+        )
+        rpx.apply_abtests([ABTest("Shared", content, config)])
+        self.assertEqual(self.count_nodes(rpx), 4 + 2 + 4)
+        self.assertEqual(rpx.skipped_nodes(), [])
+
+        rpx = RapidProABTestCreator(
+            "testdata/Linear_OneNodePerAction.json", max_flow_growth=2
+        )
+        with self.assertLogs("rapidpro_abtesting", level="WARNING"):
+            rpx.apply_abtests([ABTest("Shared", content, config)])
+        self.assertEqual(self.count_nodes(rpx), 4)
+        self.assertEqual(len(rpx.skipped_nodes()), 1)
@@ -0,0 +1,63 @@
+import unittest
+
+from rapidpro_abtesting import monte_carlo
+from rapidpro_abtesting.monte_carlo import MonteCarloSimulator
+from rapidpro_abtesting.rapidpro_abtest_creator import RapidProABTestCreator
+from rapidpro_abtesting.sheets import abtest_from_csv
+
+
+class TestMonteCarloSimulator(unittest.TestCase):
+    def setUp(self):
+        self.abtest = abtest_from_csv("testdata/Test1Assign_Personalization.csv")
+        rpx = RapidProABTestCreator("testdata/Linear_OneNodePerAction.json")
+        rpx.apply_abtests([self.abtest])
+        self.flow = rpx._data["flows"][0]
+
+    def run_simulation(self, use_numpy):
+        groupA = self.abtest.groupA().name
+        simulator = MonteCarloSimulator(
+            self.flow, groups=[([], 3), ([groupA], 1)], seed=1, use_numpy=use_numpy
+        )
+        report = simulator.run(10000)
+        self.assertEqual(report["completed"], 10000)
+        self.assertEqual(report["errors"] + report["aborted"], 0)
+        self.assertEqual(report["node_visits"][self.flow["nodes"][0]["uuid"]], 10000)
+
+        # Everyone ends up in exactly one of the groups
+        groupB = self.abtest.groupB().name
+        groups = report["groups"]
+        self.assertEqual(groups[groupA] + groups[groupB], 10000)
+        # About 3/4 of the contacts are randomly assigned, half of them to A
+        self.assertAlmostEqual(groups[groupA] / 10000, 0.625, delta=0.03)
+
+        (random_split,) = report["random_categories"].values()
+        self.assertAlmostEqual(sum(random_split.values()) / 10000, 0.75, delta=0.03)
+
+        messages = {value: count for _, value, count in report["actions"]}
+        self.assertEqual(messages["The first personalizable message."], groups[groupA])
+        self.assertEqual(
+            messages["The first personalizable message, Steve!"], groups[groupB]
+        )
+        self.assertEqual(messages["Some generic message."], 10000)
+
+    def test_fallback_sampler(self):
+        self.run_simulation(use_numpy=False)
+
+    @unittest.skipIf(monte_carlo.np is None, "NumPy is not installed.")
+    def test_numpy_sampler(self):
+        self.run_simulation(use_numpy=True)
+
+    def test_inputs_and_variables(self):
+        rpx = RapidProABTestCreator("testdata/SplitByExample.json")
+        flow = rpx._data["flows"][0]
+        simulator = MonteCarloSimulator(
+            flow,
+            variables={"@fields.something": [("Yes", 1), ("No", 1), ("X", 2)]},
+            seed=2,
+            use_numpy=False,
+        )
+        report = simulator.run(4000)
+        messages = {value: count for _, value, count in report["actions"]}
+        self.assertEqual(messages["Start"], 4000)
+        self.assertEqual(messages["Yes"] + messages["No"] + messages["Other"], 4000)
+        self.assertAlmostEqual(messages["Other"] / 4000, 0.5, delta=0.05)
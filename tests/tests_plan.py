@@ -0,0 +1,53 @@
+import copy
+import unittest
+
+from rapidpro_abtesting.abtest import ABTest
+from rapidpro_abtesting.rapidpro_abtest_creator import RapidProABTestCreator
+from rapidpro_abtesting.sheets import abtest_from_csv
+
+
+class TestPlanEditSheets(unittest.TestCase):
+    def setUp(self):
+        content = [
+            ["type_of_edit", "flow_id", "original_row_id", "node_identifier"]
+            + ["change", "change:Steve", "assign_to_group"],
+            ["replace_bit_of_text", "ABTesting_Pre", "", "Missing message."]
+            + ["Missing", "Steve", "FALSE"],
+        ]
+        self.abtests = [
+            abtest_from_csv("testdata/Test1_Personalization.csv"),
+            abtest_from_csv("testdata/Test2_Some1337.csv"),
+            ABTest("Unmatched", content),
+        ]
+        self.rpx = RapidProABTestCreator("testdata/Linear_OneNodePerAction.json")
+
+    def test_plan(self):
+        input_data = copy.deepcopy(self.rpx._data)
+        with self.assertLogs("rapidpro_abtesting", level="WARNING"):
+            plan = self.rpx.plan_editsheets(self.abtests)
+        # The flows are not modified
+        self.assertEqual(self.rpx._data, input_data)
+
+        operations = plan["operations"]
+        self.assertEqual(len(operations), 4)
+        self.assertEqual(
+            operations[0]["operation"], "ABTest Test1_Personalization row 2"
+        )
+        self.assertEqual(operations[0]["type"], "replace_bit_of_text")
+        self.assertEqual(
+            operations[0]["node_identifier"], "The first personalizable message."
+        )
+        self.assertEqual(len(operations[0]["nodes"]), 1)
+        node = operations[0]["nodes"][0]
+        self.assertEqual(node["flow"], "ABTesting_Pre")
+        self.assertEqual(node["occurrences"], 1)
+        self.assertEqual(operations[3]["nodes"], [])
+
+        # Test1 and Test2 both edit the "Good morning!" node
+        (collision,) = plan["collisions"]
+        self.assertEqual(collision["node"], operations[1]["nodes"][0]["node"])
+        self.assertEqual(collision["node"], operations[2]["nodes"][0]["node"])
+        self.assertEqual(len(collision["operations"]), 2)
+        self.assertEqual(collision["expansion"], 7)
+
+        self.assertEqual(plan["unmatched"], ["ABTest Unmatched row 2"])
@@ -0,0 +1,65 @@
+import unittest
+
+from rapidpro_abtesting.profiling import PhaseProfiler
+from rapidpro_abtesting.rapidpro_abtest_creator import RapidProABTestCreator
+from rapidpro_abtesting.sheets import abtest_from_csv
+
+
+class TestPhaseProfiler(unittest.TestCase):
+    def test_phases_with_memory(self):
+        profiler = PhaseProfiler(trace_memory=True, top_sites=3)
+        rpx = RapidProABTestCreator(
+            "testdata/Linear_OneNodePerAction.json", profiler=profiler
+        )
+        with profiler.phase("apply"):
+            rpx.apply_abtests([abtest_from_csv("testdata/Test1_Personalization.csv")])
+        profiler.stop()
+
+        names = [record["name"] for record in profiler.phases()]
+        self.assertEqual(
+            names, ["load_input", "apply", "parse_rows", "match_nodes", "apply_edits"]
+        )
+        summary = profiler.summary()
+        for name in names:
+            self.assertIn("peak_bytes", summary[name])
+            self.assertIn("retained_bytes", summary[name])
+        # The enclosing phase peaks at least as high as its sub-phases
+        self.assertGreaterEqual(
+            summary["apply"]["peak_bytes"], summary["apply_edits"]["peak_bytes"]
+        )
+        self.assertLessEqual(len(profiler.phases()[0]["top_allocations"]), 3)
+
+    def test_memory_regressions(self):
+        profiler = PhaseProfiler(trace_memory=True, top_sites=0)
+        with profiler.phase("grow"):
+            data = [list(range(100)) for _ in range(100)]
+        profiler.stop()
+        self.assertGreater(len(data), 0)
+        peak = profiler.summary()["grow"]["peak_bytes"]
+
+        baseline = {"summary": {"grow": {"peak_bytes": peak}}}
+        self.assertEqual(profiler.memory_regressions(baseline), [])
+        baseline = {"summary": {"grow": {"peak_bytes": peak // 2}}}
+        self.assertEqual(len(profiler.memory_regressions(baseline)), 1)
+        self.assertEqual(len(profiler.memory_regressions(None, 0.1, peak - 1)), 1)
+
+    def test_peak_includes_earlier_phases(self):
+        profiler = PhaseProfiler(trace_memory=True, top_sites=0)
+        with profiler.phase("load"):
+            data = [list(range(100)) for _ in range(100)]
+        with profiler.phase("process"):
+            total = sum(len(row) for row in data)
+        profiler.stop()
+        self.assertEqual(total, 10000)
+        load, process = profiler.phases()
+        # The data loaded earlier is still traced in the later phase
+        self.assertGreaterEqual(process["peak_bytes"], load["retained_bytes"])
+        self.assertLess(process["peak_increase_bytes"], load["retained_bytes"])
+
+    def test_time_only(self):
+        profiler = PhaseProfiler()
+        with profiler.phase("a"):
+            pass
+        self.assertIn("seconds", profiler.phases()[0])
+        self.assertNotIn("peak_bytes", profiler.summary()["a"])
+        self.assertEqual(profiler.memory_regressions(None, 0.1, 0), [])
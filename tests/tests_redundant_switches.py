@@ -0,0 +1,78 @@
+import copy
+import unittest
+
+from rapidpro_abtesting.abtest import ABTest
+from rapidpro_abtesting.rapidpro_abtest_creator import RapidProABTestCreator
+from rapidpro_abtesting.redundant_switches import bypass_redundant_switches
+from rapidpro_abtesting.simulator import FlowSimulator
+
+
+def count_switches(flow):
+    return sum(
+        1 for node in flow["nodes"] if node.get("router", {}).get("type") == "switch"
+    )
+
+
+class TestBypassRedundantSwitches(unittest.TestCase):
+    def make_abtest(self, assign_to_group):
+        content = [
+            ["type_of_edit", "flow_id", "original_row_id", "node_identifier"]
+            + ["change", "change:Steve", "assign_to_group"],
+            ["replace_bit_of_text", "ABTesting_Pre", "", "Some generic message."]
+            + ["generic", "Steve", "FALSE"],
+            ["replace_bit_of_text", "ABTesting_Pre", "", "Good morning!"]
+            + ["Good morning!", "Good morning, Steve!", assign_to_group],
+        ]
+        return ABTest("Bypass", content)
+
+    def apply(self, abtest):
+        rpx = RapidProABTestCreator("testdata/Linear_OneNodePerAction.json")
+        rpx.apply_abtests([abtest])
+        return rpx
+
+    def assert_equivalent(self, flow1, flow2, abtest):
+        group_name_sets = [(), (abtest.groupA().name,), (abtest.groupB().name,)]
+        random_choice_sequences = [(0,), (1,)]
+        self.assertEqual(
+            FlowSimulator(flow1).run_combinations(
+                group_name_sets, random_choice_sequences=random_choice_sequences
+            ),
+            FlowSimulator(flow2).run_combinations(
+                group_name_sets, random_choice_sequences=random_choice_sequences
+            ),
+        )
+
+    def test_consecutive_switches(self):
+        abtest = self.make_abtest("FALSE")
+        rpx = self.apply(abtest)
+        flow = rpx._data["flows"][0]
+        original_flow = copy.deepcopy(flow)
+        self.assertEqual(count_switches(flow), 2)
+
+        self.assertEqual(rpx.bypass_redundant_switches(), 1)
+        self.assertEqual(count_switches(flow), 1)
+        self.assert_equivalent(flow, original_flow, abtest)
+        self.assertEqual(rpx.validate(), [])
+
+    def test_group_assignment_in_between(self):
+        abtest = self.make_abtest("TRUE")
+        rpx = self.apply(abtest)
+        flow = rpx._data["flows"][0]
+        original_flow = copy.deepcopy(flow)
+        n_switches = count_switches(flow)
+
+        # Contacts may be assigned to a group after the first switch,
+        # so the second switch on the groups is still needed.
+        self.assertEqual(bypass_redundant_switches(flow), [])
+        self.assertEqual(count_switches(flow), n_switches)
+        self.assert_equivalent(flow, original_flow, abtest)
+
+    def test_actions_invalidate(self):
+        abtest = self.make_abtest("FALSE")
+        rpx = self.apply(abtest)
+        flow = rpx._data["flows"][0]
+        for node in flow["nodes"]:
+            for action in node["actions"]:
+                if action["type"] == "send_msg" and "Some" in action["text"]:
+                    action["type"] = "set_contact_field"
+        self.assertEqual(bypass_redundant_switches(flow), [])
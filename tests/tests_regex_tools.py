@@ -0,0 +1,71 @@
+import time
+import unittest
+
+from rapidpro_abtesting.abtest import FlowEditSheet
+from rapidpro_abtesting.rapidpro_abtest_creator import RapidProABTestCreator
+from rapidpro_abtesting.regex_tools import BudgetedRegex, RegexTimeoutError, TimeBudget
+
+# Takes exponential time to fail on a long string without "x"
+CATASTROPHIC_PATTERN = r"(.|.)*x"
+
+
+class TestBudgetedRegex(unittest.TestCase):
+    def test_within_budget(self):
+        budget = TimeBudget(1.0)
+        regex = BudgetedRegex("a(.)", budget=budget)
+        self.assertEqual(regex.subn("x\\1", "abac"), ("xbxc", 2))
+        self.assertEqual(regex.count("abac"), 2)
+        self.assertTrue(regex.fullmatch("ab"))
+        self.assertFalse(budget.exhausted())
+
+    def test_timeout(self):
+        budget = TimeBudget(0.1)
+        regex = BudgetedRegex(CATASTROPHIC_PATTERN, budget=budget)
+        start = time.perf_counter()
+        with self.assertRaises(RegexTimeoutError):
+            regex.fullmatch("a" * 40)
+        self.assertLess(time.perf_counter() - start, 5)
+        self.assertTrue(budget.exhausted())
+        # The budget is shared and exhausted, so even simple matches fail.
+        with self.assertRaises(RegexTimeoutError):
+            BudgetedRegex("a", budget=budget).fullmatch("a")
+
+    def test_unlimited(self):
+        regex = BudgetedRegex("a", budget=TimeBudget(None))
+        self.assertTrue(regex.fullmatch("a"))
+
+
+class TestRegexTimeoutInOperation(unittest.TestCase):
+    def test_operation_skipped(self):
+        rpx = RapidProABTestCreator("testdata/Linear_OneNodePerAction.json")
+        header = ["type_of_edit", "flow_id", "original_row_id", "node_identifier"]
+        header += ["change", "condition_var", "category"]
+        header += ["category:man", "condition:man", "condition_type:man"]
+        variations = ["@fields.gender", "x", "y", "man", "has_any_word"]
+        rows = [
+            header,
+            [
+                "replace_bit_of_text",
+                "ABTesting_Pre",
+                "",
+                "regex:" + CATASTROPHIC_PATTERN,
+            ]
+            + ["message"]
+            + variations,
+            ["replace_bit_of_text", "ABTesting_Pre", "", "Good morning!"]
+            + ["morning"]
+            + variations,
+        ]
+        sheet = FlowEditSheet("Test", rows, {"regex_time_budget": 0.1})
+        with self.assertLogs("rapidpro_abtesting", level="WARNING") as logs:
+            rpx.apply_editsheets([sheet])
+        self.assertIn("exceeded its time budget. Skipping operation.", logs.output[0])
+        # The other operation is still applied.
+        texts = [
+            action["text"]
+            for node in rpx._data["flows"][0]["nodes"]
+            for action in node["actions"]
+            if action["type"] == "send_msg"
+        ]
+        self.assertIn("Good x!", texts)
+        self.assertIn("Some generic message.", texts)
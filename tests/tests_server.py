@@ -0,0 +1,159 @@
+import http.client
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+import urllib.error
+import urllib.request
+
+from rapidpro_abtesting.server import BuildService, create_server
+
+
+class TestBuildService(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.input = os.path.join(self.tmpdir.name, "input.json")
+        shutil.copy("testdata/Linear_OneNodePerAction.json", self.input)
+        self.service = BuildService()
+        self.request = {
+            "input": self.input,
+            "sheets": ["testdata/master_sheet.csv"],
+            "format": "csv",
+            "validate": True,
+        }
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_apply(self):
+        response = self.service.apply(self.request)
+        self.assertEqual(response["issues"], [])
+        self.assertIn("invalid operation_type: flow_create", response["warnings"][0])
+        n_nodes = len(response["output"]["flows"][0]["nodes"])
+        self.assertGreater(n_nodes, 4)
+        self.assertEqual(
+            self.service.status(), {"cached_inputs": 1, "cached_sheets": 1}
+        )
+
+        # The cached input is not modified by the first request
+        response = self.service.apply(self.request)
+        self.assertEqual(len(response["output"]["flows"][0]["nodes"]), n_nodes)
+        self.assertEqual(response["warnings"], [])
+        self.assertEqual(
+            self.service.status(), {"cached_inputs": 1, "cached_sheets": 1}
+        )
+
+        # A changed input is loaded again
+        with open(self.input) as file:
+            data = json.load(file)
+        data["flows"][0]["name"] = "Renamed"
+        with open(self.input, "w") as file:
+            json.dump(data, file)
+        response = self.service.apply(self.request)
+        self.assertEqual(len(response["output"]["flows"][0]["nodes"]), 4)
+        self.assertEqual(self.service.status()["cached_inputs"], 2)
+
+    def test_delta_and_plan(self):
+        response = self.service.apply(dict(self.request, delta=True))
+        self.assertEqual(len(response["output"]["flows"]), 1)
+        self.assertEqual(len(response["output"]["groups"]), 2)
+
+        response = self.service.apply(dict(self.request, plan=True))
+        (plan,) = response["output"]["sheet_groups"]
+        self.assertEqual(plan["unmatched"], [])
+
+
+class TestBuildServer(unittest.TestCase):
+    def setUp(self):
+        self.server = create_server(BuildService(), port=0)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.url = "http://127.0.0.1:{}".format(self.server.server_address[1])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def post(self, path, content):
+        request = urllib.request.Request(
+            self.url + path,
+            data=json.dumps(content).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+        )
+        with urllib.request.urlopen(request) as response:
+            return json.loads(response.read())
+
+    def test_apply(self):
+        response = self.post(
+            "/apply",
+            {
+                "input": "testdata/Linear_OneNodePerAction.json",
+                "sheets": ["testdata/master_sheet.csv"],
+                "format": "csv",
+            },
+        )
+        self.assertGreater(len(response["output"]["flows"][0]["nodes"]), 4)
+        with urllib.request.urlopen(self.url + "/status") as status:
+            self.assertEqual(json.loads(status.read())["cached_inputs"], 1)
+        self.assertEqual(self.post("/clear", {})["cached_inputs"], 0)
+
+    def test_invalid_request(self):
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            self.post("/apply", {"input": "testdata/Linear_OneNodePerAction.json"})
+        self.assertEqual(context.exception.code, 400)
+        self.assertIn("sheets", json.loads(context.exception.read())["error"])
+
+        request = {
+            "input": "testdata/missing.json",
+            "sheets": ["testdata/master_sheet.csv"],
+            "format": "csv",
+        }
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            self.post("/apply", request)
+        self.assertEqual(context.exception.code, 400)
+        self.assertIn("missing.json", json.loads(context.exception.read())["error"])
+
+    def test_internal_error(self):
+        def apply(request):
+            raise ValueError("Internal error.")
+
+        self.server.service.apply = apply
+        with self.assertLogs("rapidpro_abtesting", level="ERROR"):
+            with self.assertRaises(urllib.error.HTTPError) as context:
+                self.post("/apply", {})
+        self.assertEqual(context.exception.code, 500)
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path):
+        super().__init__("localhost")
+        self._socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self._socket_path)
+
+
+@unittest.skipUnless(hasattr(socket, "AF_UNIX"), "requires Unix sockets")
+class TestBuildServerUnixSocket(unittest.TestCase):
+    def test_status(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            socket_path = os.path.join(tmpdir, "server.sock")
+            server = create_server(BuildService(), socket_path=socket_path)
+            thread = threading.Thread(target=server.serve_forever)
+            thread.start()
+            try:
+                connection = UnixHTTPConnection(socket_path)
+                connection.request("GET", "/status")
+                response = connection.getresponse()
+                self.assertEqual(response.status, 200)
+                self.assertEqual(json.loads(response.read())["cached_inputs"], 0)
+                connection.close()
+            finally:
+                server.shutdown()
+                server.server_close()
+                thread.join()
@@ -0,0 +1,62 @@
+import unittest
+
+from rapidpro_abtesting.rapidpro_abtest_creator import RapidProABTestCreator
+from rapidpro_abtesting.sheets import abtest_from_csv
+from rapidpro_abtesting.simulator import Context, FlowSimulator
+
+
+def make_node(uuid, text, destination_uuid):
+    return {
+        "uuid": uuid,
+        "actions": [{"uuid": uuid + "_action", "type": "send_msg", "text": text}],
+        "exits": [{"uuid": uuid + "_exit", "destination_uuid": destination_uuid}],
+    }
+
+
+class TestFlowSimulator(unittest.TestCase):
+    def test_run_combinations(self):
+        abtest = abtest_from_csv("testdata/Test1Assign_Personalization.csv")
+        rpx = RapidProABTestCreator("testdata/Linear_OneNodePerAction.json")
+        rpx.apply_abtests([abtest])
+        simulator = FlowSimulator(rpx._data["flows"][0])
+
+        groupA = abtest.groupA().name
+        groupB = abtest.groupB().name
+        results = simulator.run_combinations(
+            group_name_sets=[[], [groupA], [groupB]],
+            random_choice_sequences=[[0], [1]],
+        )
+        self.assertEqual(len(results), 6)
+        for result in results:
+            self.assertNotIn("error", result)
+            messages = [value for _, value in result["outputs"]]
+            if result["group_names"]:
+                group = result["group_names"][0]
+            else:
+                group = [groupA, groupB][result["random_choices"][0]]
+                self.assertIn(("add_contact_groups", group), result["outputs"])
+            if group == groupA:
+                self.assertIn("The first personalizable message.", messages)
+            else:
+                self.assertIn("The first personalizable message, Steve!", messages)
+
+    def test_run_many(self):
+        flow = {"nodes": [make_node("n1", "Hi", "n2"), make_node("n2", "Bye", None)]}
+        simulator = FlowSimulator(flow)
+        outputs = simulator.run_many([Context(), Context()])
+        self.assertEqual(outputs, [[("send_msg", "Hi"), ("send_msg", "Bye")]] * 2)
+
+    def test_invalid_flows(self):
+        flow = {"nodes": [make_node("n1", "Hi", "n2"), make_node("n2", "Bye", "n1")]}
+        with self.assertRaises(ValueError):
+            FlowSimulator(flow, max_steps=100).run(Context())
+        flow = {"nodes": [make_node("n1", "Hi", "nonexistent")]}
+        with self.assertRaises(ValueError):
+            FlowSimulator(flow).run(Context())
+        self.assertEqual(
+            FlowSimulator(flow).final_destination(Context(), "n1"), "nonexistent"
+        )
+        node = make_node("n1", "Hi", None)
+        node["actions"].append({"uuid": "a2", "type": "unknown_action"})
+        with self.assertRaises(ValueError):
+            FlowSimulator({"nodes": [node]})
@@ -0,0 +1,101 @@
+import logging
+import random
+import unittest
+
+from rapidpro_abtesting.abtest import FlowEditSheet
+from rapidpro_abtesting.rapidpro_abtest_creator import RapidProABTestCreator
+from rapidpro_abtesting.text_matcher import MultiPatternMatcher, can_create_occurrence
+
+
+class TestMultiPatternMatcher(unittest.TestCase):
+    def test_count_occurrences(self):
+        matcher = MultiPatternMatcher(["he", "she", "his", "hers", "he", "aa"])
+        self.assertEqual(
+            matcher.count_occurrences("ushers and shehe aaaaa"), [3, 2, 0, 1, 3, 2]
+        )
+
+    def test_matches_str_count(self):
+        rng = random.Random(0)
+        for _ in range(500):
+            patterns = [
+                "".join(rng.choice("ab") for _ in range(rng.randint(1, 4)))
+                for _ in range(rng.randint(1, 6))
+            ]
+            text = "".join(rng.choice("abc") for _ in range(rng.randint(0, 30)))
+            counts = MultiPatternMatcher(patterns).count_occurrences(text)
+            self.assertEqual(counts, [text.count(pattern) for pattern in patterns])
+
+    def test_empty_pattern(self):
+        with self.assertRaises(ValueError):
+            MultiPatternMatcher(["a", ""])
+
+    def test_can_create_occurrence(self):
+        self.assertTrue(can_create_occurrence("evening", "Good evening!"))
+        self.assertTrue(can_create_occurrence("evening", "even"))
+        self.assertTrue(can_create_occurrence("evening", "ning!"))
+        self.assertTrue(can_create_occurrence("evening", "Eve"))
+        self.assertTrue(can_create_occurrence("evening", ""))
+        self.assertFalse(can_create_occurrence("evening", "morning"))
+        self.assertFalse(can_create_occurrence("evening", "x"))
+
+
+class TestOccurrenceWarnings(unittest.TestCase):
+    def test_warnings(self):
+        rpx = RapidProABTestCreator("testdata/Linear_OneNodePerAction.json")
+        header = ["type_of_edit", "flow_id", "original_row_id", "node_identifier"]
+        header += ["change", "condition_var", "category"]
+        header += ["category:man", "condition:man", "condition_type:man"]
+        row = ["replace_bit_of_text", "ABTesting_Pre", "", "Good morning!"]
+        variations = ["@fields.gender", "x", "y", "man", "has_any_word"]
+        sheet = FlowEditSheet(
+            "Test",
+            [
+                header,
+                row + ["evening"] + variations,
+                row + ["o"] + variations,
+                row + ["morning"] + variations,
+            ],
+        )
+        with self.assertLogs("rapidpro_abtesting", level="WARNING") as logs:
+            rpx.apply_editsheets([sheet])
+        occurrence_warnings = [
+            output for output in logs.output if "occurrences" in output
+        ]
+        # Occurrences are reported once per input node, not for each variation,
+        # except for variations where a previous op removed the text.
+        self.assertEqual(len(occurrence_warnings), 4)
+        self.assertIn('No occurrences of "evening" found in node', logs.output[0])
+        self.assertIn('Multiple occurrences of "o" found in node', logs.output[1])
+        # The variations no longer contain "morning" after row 3.
+        self.assertIn('No occurrences of "morning" left in node', logs.output[2])
+        self.assertIn('No occurrences of "morning" left in node', logs.output[3])
+
+    def test_text_introduced_by_previous_op(self):
+        rpx = RapidProABTestCreator("testdata/Linear_OneNodePerAction.json")
+        header = ["type_of_edit", "flow_id", "original_row_id", "node_identifier"]
+        header += ["change", "condition_var", "category"]
+        header += ["category:man", "condition:man", "condition_type:man"]
+        row = ["replace_bit_of_text", "ABTesting_Pre", "", "Good morning!"]
+        condition = ["man", "has_any_word"]
+        sheet = FlowEditSheet(
+            "Test",
+            [
+                header,
+                row + ["morning", "@fields.gender", "evening", "evening!"] + condition,
+                row + ["evening", "@fields.gender", "night", "night"] + condition,
+            ],
+        )
+        with self.assertLogs("rapidpro_abtesting", level="WARNING") as logs:
+            rpx.apply_editsheets([sheet])
+            # Ensure there is a log entry to make assertLogs pass
+            logging.getLogger("rapidpro_abtesting").warning("Done.")
+        # The text of the second row is only in the node after the first row.
+        self.assertFalse(any("occurrences" in output for output in logs.output))
+        texts = [
+            action["text"]
+            for node in rpx._data["flows"][0]["nodes"]
+            for action in node["actions"]
+            if action["type"] == "send_msg"
+        ]
+        self.assertIn("Good night!", texts)
+        self.assertFalse(any("evening" in text for text in texts))
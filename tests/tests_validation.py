@@ -0,0 +1,70 @@
+import copy
+import unittest
+
+from rapidpro_abtesting.rapidpro_abtest_creator import RapidProABTestCreator
+from rapidpro_abtesting.sheets import abtest_from_csv
+from rapidpro_abtesting.validation import validate_rapidpro_data
+
+
+class TestValidation(unittest.TestCase):
+    def setUp(self):
+        rpx = RapidProABTestCreator("testdata/WaitForResponse.json")
+        rpx.apply_abtests([abtest_from_csv("testdata/Test_WaitForResponse.csv")])
+        self.rpx = rpx
+        self.data = rpx._data
+
+    def test_valid_output(self):
+        self.assertEqual(self.rpx.validate(), [])
+
+    def test_invalid_output(self):
+        data = copy.deepcopy(self.data)
+        flow = data["flows"][0]
+        router_nodes = [node for node in flow["nodes"] if "router" in node]
+        msg_nodes = [node for node in flow["nodes"] if "router" not in node]
+        # Duplicate node uuid
+        msg_nodes[1]["uuid"] = msg_nodes[0]["uuid"]
+        # Dangling destination
+        msg_nodes[0]["exits"][0]["destination_uuid"] = "nonexistent_node"
+        router = router_nodes[0]["router"]
+        router["categories"][0]["exit_uuid"] = "nonexistent_exit"
+        router["cases"][0]["category_uuid"] = "nonexistent_category"
+        router["default_category_uuid"] = "nonexistent_default"
+        flow["_ui"]["nodes"]["nonexistent_ui"] = {}
+        translations = next(iter(flow["localization"].values()))
+        translations["nonexistent_localizable"] = {}
+
+        issues = validate_rapidpro_data(data)
+        expected = [
+            "node uuid",
+            "dangling destination nonexistent_node",
+            "unknown exit_uuid nonexistent_exit",
+            "unknown category_uuid nonexistent_category",
+            "unknown default_category_uuid nonexistent_default",
+            "_ui entry nonexistent_ui",
+            "key nonexistent_localizable",
+        ]
+        for text in expected:
+            self.assertTrue(
+                any(text in issue for issue in issues),
+                "{} not in {}".format(text, issues),
+            )
+
+    def test_uuids_shared_across_flows(self):
+        data = copy.deepcopy(self.data)
+        flow = copy.deepcopy(data["flows"][0])
+        flow["uuid"] = "copied_flow"
+        flow["name"] = "Copied flow"
+        data["flows"].append(flow)
+
+        issues = validate_rapidpro_data(data)
+        node_uuid = flow["nodes"][0]["uuid"]
+        exit_uuid = flow["nodes"][0]["exits"][0]["uuid"]
+        for kind, uuid in [("Node", node_uuid), ("Exit", exit_uuid)]:
+            self.assertIn(
+                "{} uuid {} is used by multiple flows: {}, Copied flow.".format(
+                    kind, uuid, self.data["flows"][0]["name"]
+                ),
+                issues,
+            )
+        # Each flow on its own is valid
+        self.assertEqual(validate_rapidpro_data({"flows": [flow]}), [])
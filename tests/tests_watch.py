@@ -0,0 +1,143 @@
+import csv
+import os
+import tempfile
+import unittest
+
+from rapidpro_abtesting.simulator import FlowSimulator
+from rapidpro_abtesting.watch import (
+    IncrementalBuilder,
+    diff_sheet_rows,
+    flow_id_matches,
+)
+
+HEADER = ["type_of_edit", "flow_id", "original_row_id", "node_identifier"] + [
+    "change",
+    "change:Steve",
+    "assign_to_group",
+]
+
+
+class TestIncrementalBuilder(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.master_sheet = self.path("master_sheet.csv")
+        self.write_csv(
+            self.master_sheet,
+            [
+                ["flow_type", "flow_name", "sheet_name", "status"],
+                ["flow_testing", "", "Test_Flow_1", "released"],
+                ["flow_testing", "", "Test_Flow_2", "released"],
+            ],
+        )
+        self.write_test("Test_Flow_1", "Flow_1", "Steve")
+        self.write_test("Test_Flow_2", "Flow_2", "Steve")
+        self.builder = IncrementalBuilder(
+            "testdata/RegexMatchFlowNode.json", [self.master_sheet], "csv"
+        )
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def path(self, filename):
+        return os.path.join(self.tmpdir.name, filename)
+
+    def write_csv(self, filename, rows):
+        with open(filename, "w", newline="") as fout:
+            csv.writer(fout).writerows(rows)
+
+    def write_test(self, name, flow_id, replacement):
+        row = ["replace_bit_of_text", flow_id, "", "Regex:.*good.*", "good"]
+        self.write_csv(self.path(name + ".csv"), [HEADER, row + [replacement, ""]])
+
+    def flow(self, name):
+        flows = self.builder.output()["flows"]
+        return next(flow for flow in flows if flow["name"] == name)
+
+    def messages(self, flow):
+        groups = self.builder.output()["groups"]
+        return FlowSimulator(flow).run_combinations(
+            [(group["name"],) for group in groups]
+        )
+
+    def test_rebuild_changed_sheet(self):
+        self.assertEqual(self.builder.build(), ["Flow_1", "Flow_2"])
+        flow_1 = self.flow("Flow_1")
+
+        self.write_test("Test_Flow_2", "Flow_2", "Bob")
+        self.assertEqual(self.builder.build(), ["Flow_2"])
+        # Flow_1 is reused as it was
+        self.assertIs(self.flow("Flow_1"), flow_1)
+        messages = str(self.messages(self.flow("Flow_2")))
+        self.assertIn("A Bob personalizable message.", messages)
+        self.assertNotIn("Steve personalizable", messages)
+
+        # Nothing changed
+        self.assertEqual(self.builder.build(), [])
+        self.assertIs(self.flow("Flow_1"), flow_1)
+
+    def test_rebuild_equals_full_build(self):
+        self.builder.build()
+        self.write_test("Test_Flow_1", "Regex:Flow_.*", "Bob")
+        self.assertEqual(self.builder.build(), ["Flow_1", "Flow_2"])
+
+        full_builder = IncrementalBuilder(
+            "testdata/RegexMatchFlowNode.json", [self.master_sheet], "csv"
+        )
+        full_builder.build()
+        for flow, full_flow in zip(
+            self.builder.output()["flows"], full_builder.output()["flows"]
+        ):
+            self.assertEqual(len(flow["nodes"]), len(full_flow["nodes"]))
+            self.assertEqual(
+                FlowSimulator(flow).run_combinations(),
+                FlowSimulator(full_flow).run_combinations(),
+            )
+
+    def test_rebuild_changed_row(self):
+        row = ["replace_bit_of_text", "", "", "Regex:.*good.*", "good", "Steve", ""]
+        rows = [HEADER, row[:1] + ["Flow_1"] + row[2:], row[:1] + ["Flow_2"] + row[2:]]
+        self.write_csv(self.path("Test_Flow_2.csv"), rows)
+        self.builder.build()
+        self.assertIsNone(self.builder.changes())
+        flow_1 = self.flow("Flow_1")
+
+        rows[2][5] = "Bob"
+        self.write_csv(self.path("Test_Flow_2.csv"), rows)
+        self.assertEqual(self.builder.build(), ["Flow_2"])
+        self.assertIs(self.flow("Flow_1"), flow_1)
+        changes = self.builder.changes()
+        self.assertEqual(changes["rows"], ["ABTest Test_Flow_2 row 3"] * 2)
+        (node_uuid,) = changes["nodes"]
+        self.assertNotIn(node_uuid, [node["uuid"] for node in flow_1["nodes"]])
+        self.assertEqual(changes["flows"], ["Flow_2"])
+        messages = str(self.messages(self.flow("Flow_2")))
+        self.assertIn("A Bob personalizable message.", messages)
+
+    def test_diff_sheet_rows(self):
+        def sheet(hashes):
+            return {
+                "sheet_type": "ABTest",
+                "name": "Test",
+                "config": {},
+                "category_names": ["Steve"],
+                "operations": [{"row_hash": row_hash} for row_hash in hashes],
+            }
+
+        removed, added = diff_sheet_rows(sheet("abcd"), sheet("axcde"))
+        self.assertEqual([spec["row_hash"] for spec in removed], ["b"])
+        self.assertEqual([spec["row_hash"] for spec in added], ["x", "e"])
+        removed, added = diff_sheet_rows(None, sheet("ab"))
+        self.assertEqual((len(removed), len(added)), (0, 2))
+        other_sheet = dict(sheet("ab"), category_names=["Bob"])
+        removed, added = diff_sheet_rows(sheet("ab"), other_sheet)
+        self.assertEqual((len(removed), len(added)), (2, 2))
+
+    def test_watched_files(self):
+        self.assertIn(self.path("Test_Flow_1.csv"), self.builder.watched_files())
+        self.assertIn(self.master_sheet, self.builder.watched_files())
+
+    def test_flow_id_matches(self):
+        self.assertTrue(flow_id_matches("Flow_1", "Flow_1"))
+        self.assertFalse(flow_id_matches("Flow_1", "Flow_2"))
+        self.assertTrue(flow_id_matches("Regex:Flow_.*", "Flow_2"))
+        self.assertFalse(flow_id_matches("Regex:(", "Flow_2"))